@@ -1,28 +1,185 @@
+import asyncio
 import csv
 import json
 import os
 import re
+import sqlite3
+from copy import deepcopy
 from shutil import copyfile
 from time import sleep, time
 from uuid import uuid4
 
+from celery import current_app
 from celery.task import task
 from django.conf import settings
+from django.db import transaction
 
-from landscapesim.common.config import CONFIG_IMPORTS, VALUE_IMPORTS
-from landscapesim.common.consoles import STSimConsole
+from landscapesim.common.config import CONFIG_IMPORTS, OUTPUT_OPTION, VALUE_IMPORTS
+from landscapesim.common.consoles import CommandLog, STSimConsole, AsyncSTSimConsole
 from landscapesim.common.geojson import rasterize_geojson
+from landscapesim.common.libraries import (
+    delete_result_scenario, lease_working_libraries, merge_result_scenario, scenario_ids
+)
 from landscapesim.common.query import ssim_query
 from landscapesim.common.services import ServiceGenerator
+from landscapesim.common.sheets import SheetWriter
 from landscapesim.common.utils import get_random_csv
 from landscapesim.importers import ScenarioImporter, ReportImporter
-from landscapesim.models import Library, Scenario, TransitionGroup, RunScenarioModel
+from landscapesim.importers.report import ALL_REPORTS
+from landscapesim.models import Library, OutputOption, Scenario, TransitionGroup, RunScenarioModel
 from landscapesim.serializers import imports
 
 EXE = getattr(settings, 'STSIM_EXE_PATH')
 SCENARIO_SCAN_RATE = 2
 DATASET_DOWNLOAD_DIR = getattr(settings, 'DATASET_DOWNLOAD_DIR')
 STSIM_MULTIPLIER_DIR = getattr(settings, 'STSIM_MULTIPLIER_DIR')
+STSIM_DIRECT_SQLITE = getattr(settings, 'STSIM_DIRECT_SQLITE', True)
+STSIM_ITERATION_SHARDS = getattr(settings, 'STSIM_ITERATION_SHARDS', 1)  # Max working libraries to split a run over
+
+# Seconds a job may run the model before it is killed (STSIM_RUN_TIMEOUT is the former name of this setting)
+STSIM_JOB_MAX_TIME = getattr(settings, 'STSIM_JOB_MAX_TIME', getattr(settings, 'STSIM_RUN_TIMEOUT', None))
+JOB_POLL_RATE = 2
+
+# SyncroSim reports progress with lines such as 'Iteration 3 - Timestep 20', and 'Iteration 3 complete'
+ITERATION_PATTERN = re.compile(r'\biteration\W*(\d+)', re.I)
+TIMESTEP_PATTERN = re.compile(r'\btimestep\W*(\d+)', re.I)
+STSIM_PROGRESSIVE_SERVICES = getattr(settings, 'STSIM_PROGRESSIVE_SERVICES', False)  # Serve iterations as they finish
+PROGRESSIVE_SERVICES_SCAN_RATE = 10
+PROGRESSIVE_SERVICES_MAX_WAIT = 600  # Seconds to wait for progressive output services before creating the rest
+
+# Summary reports to create when a model run completes
+STSIM_RUN_REPORTS = getattr(settings, 'STSIM_RUN_REPORTS', ('stateclass-summary',))
+
+
+class ModelRunCancelled(Exception):
+    """ Raised when a model run is stopped by the watchdog. The status is recorded as the job's model_status. """
+
+    def __init__(self, status):
+        super().__init__('Model run {}'.format(status))
+        self.status = status
+
+
+def active_task_ids():
+    """ The IDs of the tasks being executed by every Celery worker, or None if the workers did not reply. """
+    active = current_app.control.inspect().active()
+    if active is None:
+        return None
+    return {x['id'] for tasks in active.values() for x in tasks}
+
+
+def split_iterations(min_iteration, max_iteration, shards):
+    """ Split an (inclusive) iteration range into at most shards contiguous ranges of near-equal size. """
+    count = max_iteration - min_iteration + 1
+    shards = max(1, min(shards, count))
+    ranges = []
+    start = min_iteration
+    for i in range(shards):
+        size = count // shards + (1 if i < count % shards else 0)
+        ranges.append((start, start + size - 1))
+        start += size
+    return ranges
+
+
+class RunProgress:
+    """ Tracks the progress of a model run from the output of the SyncroSim process of each shard. """
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.iterations = [None] * len(shards)  # The (iteration, timestep, complete) each shard last reported
+        self.saved = None
+
+    def on_line(self, index):
+        """ A callback for the output of a shard's model run. """
+        return lambda line: self.parse(index, line)
+
+    def parse(self, index, line):
+        iteration = ITERATION_PATTERN.search(line)
+        if iteration is None:
+            return
+        timestep = TIMESTEP_PATTERN.search(line)
+        state = (int(iteration.group(1)), int(timestep.group(1)) if timestep else None, 'complete' in line.lower())
+        previous = self.iterations[index]
+        self.iterations[index] = state
+        if previous is None or previous[0] != state[0] or state[2]:
+            shard = self.shards[index]
+            print('{}: iteration {} {}'.format(shard.console.lib, state[0], 'complete' if state[2] else 'started'))
+
+    @property
+    def fraction(self):
+        """ The fraction (0-1) of the run's iterations which are complete, or None before any progress is reported. """
+        if not any(self.iterations):
+            return None
+        done = 0
+        total = 0
+        for shard, state in zip(self.shards, self.iterations):
+            min_iteration, max_iteration = shard.iterations
+            total += max_iteration - min_iteration + 1
+            if state is None:
+                continue
+            iteration, timestep, complete = state
+            done += iteration - min_iteration + (1 if complete else 0)
+            if timestep is not None and not complete:
+                run_control = shard.config['run_control']
+                min_timestep = int(run_control.get('MinimumTimestep') or 0)
+                max_timestep = int(run_control.get('MaximumTimestep') or 0)
+                if max_timestep > min_timestep:
+                    done += (timestep - min_timestep) / (max_timestep - min_timestep + 1)
+        return max(0.0, min(1.0, done / total))
+
+    def save(self, job):
+        """ Record the fraction of the run which is complete on the job, if it has changed since it was last saved. """
+        fraction = self.fraction
+        if fraction is not None and fraction != self.saved:
+            RunScenarioModel.objects.filter(id=job.id).update(run_progress=fraction)
+            self.saved = fraction
+
+
+async def watch_job(job, run, progress=None):
+    """
+    Cancel a model run if its job is cancelled or has run for longer than STSIM_JOB_MAX_TIME. Cancelling the run
+    kills the SyncroSim process tree of every shard.
+    :param progress: (Optional) A RunProgress to record on the job as the run progresses.
+    :return: The model_status to record for the job, if the run was cancelled.
+    """
+    started = time()
+    while not run.done():
+        await asyncio.sleep(JOB_POLL_RATE)
+        if progress is not None:
+            progress.save(job)
+        if RunScenarioModel.objects.filter(id=job.id, cancel_requested=True).exists():
+            status = 'cancelled'
+        elif STSIM_JOB_MAX_TIME is not None and time() - started > STSIM_JOB_MAX_TIME:
+            status = 'timeout'
+        else:
+            continue
+        run.cancel()
+        return status
+
+
+async def run_shards(shards, job):
+    """
+    Run the model for each shard concurrently, returning the result scenario ID of each. If any shard fails, the other
+    shards are cancelled, and their SyncroSim processes have exited, before the error is raised. The progress of the
+    run is parsed from the output of each shard as it is written, and recorded on the job.
+    """
+    progress = RunProgress(shards)
+    runs = [
+        asyncio.ensure_future(shard.console.run_model_async(shard.scenario_id, on_line=progress.on_line(i)))
+        for i, shard in enumerate(shards)
+    ]
+    run = asyncio.ensure_future(asyncio.gather(*runs))
+    watchdog = asyncio.ensure_future(watch_job(job, run, progress))
+    try:
+        result = await run
+        progress.save(job)
+        return result
+    except asyncio.CancelledError:
+        raise ModelRunCancelled(watchdog.result() if watchdog.done() else 'cancelled')
+    finally:
+        watchdog.cancel()
+        for x in runs:
+            x.cancel()
+        await asyncio.gather(*runs, return_exceptions=True)
 
 
 class ModelBootstrapper:
@@ -94,24 +251,50 @@ class ModelBootstrapper:
         for key, deserializer in imports.CONFIG_INPUTS + imports.VALUE_INPUTS:
             self.config[key] = deserializer(self.config[key]).validated_data
 
-    def setup_transition_spatial_multipliers(self):
+    def setup_transition_spatial_multipliers(self, cleanup=True):
         """
         If there are transition spatial multipliers, move them to the appropriate scenario location on disk.
+        :param cleanup: Remove the multipliers once they are copied. Keep them when more libraries need them.
         """
-        parent = self.job.parent_scenario
+        multiplier_directory = os.path.join(
+            self.console.lib + '.input', 'Scenario-' + str(self.scenario_id), 'STSim_TransitionSpatialMultiplier'
+        )
         for tsm in self.config['transition_spatial_multipliers']:
             filename = tsm['MultiplierFileName']
             src = os.path.join(STSIM_MULTIPLIER_DIR, filename)
-            dst = os.path.join(parent.multiplier_directory, filename)
-            if not os.path.exists(parent.multiplier_directory):
-                os.makedirs(parent.multiplier_directory)
+            dst = os.path.join(multiplier_directory, filename)
+            if not os.path.exists(multiplier_directory):
+                os.makedirs(multiplier_directory)
             copyfile(src, dst)
-            os.remove(src)      # Once the file is copied, we can cleanup the transition multipliers
+            if cleanup:
+                os.remove(src)      # Once the file is copied, we can cleanup the transition multipliers
+
+    def write_configuration(self):
+        """
+        Writes the validated run configuration directly into the library. All sheets are replaced in a single
+        transaction, so if any sheet fails the scenario is left unchanged.
+        """
+
+        sheets = []
+        for pair in CONFIG_IMPORTS + VALUE_IMPORTS:
+            key, sheet_name, field_map = pair
+            rows = [self.config[key]] if pair in CONFIG_IMPORTS else self.config[key]
+            sheets.append((sheet_name, field_map, rows))
+        SheetWriter(self.console.lib, self.job.parent_scenario.project.pid).write_sheets(self.scenario_id, sheets)
+        self.console.invalidate_metadata()
 
     def import_configuration(self):
         """ Imports validated run configuration into csv formatted sheets for import. """
 
         print('Importing configuration for Scenario {}'.format(self.scenario_id))
+        if STSIM_DIRECT_SQLITE:
+            try:
+                self.write_configuration()
+                print('Successfully wrote run configuration for scenario {}'.format(self.scenario_id))
+                return
+            except sqlite3.Error:
+                print('Could not write configuration to the library directly, importing through SyncroSim...')
+
         for pair in CONFIG_IMPORTS + VALUE_IMPORTS:
             key = pair[0]
             sheet_name = pair[1]
@@ -145,55 +328,198 @@ class ModelBootstrapper:
         if len(self.config.get('transition_spatial_multipliers')) == 0:
             ssim_query(
                 "DELETE FROM STSim_TransitionSpatialMultiplier WHERE ScenarioID={}".format(self.scenario_id),
-                self.library
+                self.console.lib
             )
 
-    def run_setup(self):
-        """ Perform the LandscapeSim -> SyncroSim import. """
-        print('Validating scenario configuration...')
-        self.validate_configuration()
+    def write_setup(self, cleanup=True):
+        """ Write the validated configuration into the console's library. """
         print('Creating transition spatial_multipliers...')
-        self.setup_transition_spatial_multipliers()
+        self.setup_transition_spatial_multipliers(cleanup)
         print('Importing scenario configuration...')
         self.import_configuration()
         print('Finalizing import...')
         self.execute_ssim_queries()
+
+    def run_setup(self):
+        """ Perform the LandscapeSim -> SyncroSim import. """
+        print('Validating scenario configuration...')
+        self.validate_configuration()
+        self.write_setup()
         self.job.model_status = 'running'
-        self.job.save()
+        self.job.save(update_fields=['model_status'])
 
     def run_model(self):
         print('Running scenario {}...'.format(self.scenario_id))
-        return int(self.console.run_model(self.scenario_id))
+        return self.run_watched([self])[0]
+
+    def run_watched(self, shards):
+        """
+        Run the model for each shard under the job watchdog. If the run is stopped (ModelRunCancelled), or fails, the
+        partial result scenarios of the run are removed from each library before the error is raised.
+        :return: The result scenario ID of each shard.
+        """
+        existing = [scenario_ids(shard.console.lib) for shard in shards]
+        loop = asyncio.new_event_loop()
+        try:
+            return [int(x) for x in loop.run_until_complete(run_shards(shards, self.job))]
+        except Exception:
+            self.job.refresh_from_db(fields=['result_scenario'])
+            for i, shard in enumerate(shards):
+                # Other runs may be writing to a library which isn't leased, so only remove this run's result if known
+                if i == 0 and self.job.working_library is None and self.job.result_scenario is not None:
+                    removed = {self.job.result_scenario.sid}
+                else:
+                    removed = scenario_ids(shard.console.lib) - existing[i]
+                for result_sid in removed:
+                    print('Removing partial result scenario {} from {}'.format(result_sid, shard.console.lib))
+                    delete_result_scenario(shard.console.lib, result_sid)
+                shard.console.invalidate_metadata()
+            raise
+        finally:
+            loop.close()
+
+    @property
+    def iterations(self):
+        """ The (inclusive) range of iterations in the validated configuration. """
+        run_control = self.config['run_control']
+        min_iteration = int(run_control['MinimumIteration'] or 1)
+        return min_iteration, int(run_control['MaximumIteration'] or min_iteration)
+
+    def shard(self, console, min_iteration, max_iteration):
+        """ A bootstrapper for running a subset of this run's iterations in the library used by another console. """
+        config = deepcopy(self.config)
+        config['run_control']['MinimumIteration'] = min_iteration
+        config['run_control']['MaximumIteration'] = max_iteration
+        return ModelBootstrapper(self.scenario_id, self.library, config, console, self.job)
+
+    def run_sharded_setup(self, consoles):
+        """
+        Perform the LandscapeSim -> SyncroSim import into several libraries, splitting the iterations of the run
+        between them.
+        :param consoles: An AsyncSTSimConsole for each library which may run a share of the iterations.
+        :return: A list of bootstrappers, one for each shard of the run.
+        """
+        print('Validating scenario configuration...')
+        self.validate_configuration()
+        ranges = split_iterations(*self.iterations, len(consoles))
+        shards = [self.shard(console, *iterations) for console, iterations in zip(consoles, ranges)]
+        for i, shard in enumerate(shards):
+            print('Writing iterations {}-{} to {}'.format(*shard.iterations, shard.console.lib))
+            shard.write_setup(cleanup=i == len(shards) - 1)
+        self.job.model_status = 'running'
+        self.job.save(update_fields=['model_status'])
+        return shards
+
+    def run_sharded_model(self, shards):
+        """
+        Run each shard concurrently, then merge the results of every shard into the first shard's result scenario.
+        :param shards: The bootstrappers returned by run_sharded_setup().
+        :return: The result scenario ID, in the first shard's library.
+        """
+        print('Running scenario {} in {} shards...'.format(self.scenario_id, len(shards)))
+        result_sids = self.run_watched(shards)
+        result_sid = result_sids[0]
+        primary = shards[0].console
+        for shard, shard_sid in zip(shards[1:], result_sids[1:]):
+            print('Merging iterations {}-{} into scenario {}'.format(*shard.iterations, result_sid))
+            merge_result_scenario(primary.lib, result_sid, shard.console.lib, shard_sid, *self.iterations)
+            shard.console.invalidate_metadata()
+        primary.invalidate_metadata()
+        return result_sid
 
 
 @task
-def look_for_new_scenario(run_id):
-    """ Scan for the new scenario that was created. """
+def look_for_new_scenario(run_id, existing_sids):
+    """
+    Scan for the new scenario that was created.
+    :param existing_sids: The scenario IDs in the run's library (see scenario_ids) before the model run started. The
+    library may be a working copy, which shares its scenario IDs (and output directories) with the original library.
+    """
     run = RunScenarioModel.objects.get(id=run_id)
 
-    # If run is not spatial, return immediately
+    # If run is not spatial, or was stopped, return immediately
     is_spatial = json.loads(run.inputs)['config']['run_control']['is_spatial']
-    if not is_spatial:
+    if not is_spatial or run.model_status in ('cancelled', 'timeout', 'failed'):
         return
 
-    recorded_sids = {x['sid'] for x in Scenario.objects.filter(is_result=True).values('sid')}
-    spatial_directories = os.listdir(os.path.dirname(os.path.dirname(run.parent_scenario.output_directory)))
-    directory_sids = {int(x.split('-')[1]) for x in spatial_directories}
-    new_sids = directory_sids - recorded_sids
+    library_file = run.working_library.file if run.working_library_id else run.parent_scenario.library.file
+    output_directory = library_file + '.output'
+    directory_sids = set()
+    if os.path.exists(output_directory):
+        directory_sids = {int(x.split('-')[1]) for x in os.listdir(output_directory) if x.startswith('Scenario-')}
+    new_sids = directory_sids - set(existing_sids)
     if new_sids:
-        sid = new_sids.pop()
+        # A run creates a single result scenario, and SyncroSim assigns increasing IDs
+        sid = max(new_sids)
+        if len(new_sids) > 1:
+            print('Found several new scenarios in {} ({}), using {}'.format(library_file, sorted(new_sids), sid))
         scenario, _ = Scenario.objects.get_or_create(
                     project=run.parent_scenario.project,
                     name=run.parent_scenario.name,
                     sid=sid,
                     is_result=True,
-                    parent=run.parent_scenario
+                    parent=run.parent_scenario,
+                    working_library=run.working_library
             )
         run.result_scenario = scenario
-        run.save()
+        run.save(update_fields=['result_scenario'])
     else:
         sleep(SCENARIO_SCAN_RATE)
-        look_for_new_scenario.delay(run_id)
+        look_for_new_scenario.delay(run_id, existing_sids)
+
+
+@task
+def update_output_services(run_id):
+    """
+    Add the iterations which a spatial model run has completed to the result scenario's output services, so that they
+    can be viewed while the remaining iterations are still running.
+    """
+    # The job is only locked to claim iterations, so the services are updated outside of the transaction
+    with transaction.atomic():
+        run = RunScenarioModel.objects.select_for_update().get(id=run_id)
+        config = json.loads(run.inputs)['config']
+        if not config['run_control']['is_spatial'] or run.model_status not in ('starting', 'running'):
+            return
+
+        iterations = set()
+        if run.result_scenario is not None:
+            # The result scenario's run control and output options are only imported once the run completes
+            run_control = config['run_control']
+            output_options = OutputOption(**{name: config['output_options'].get(name) for name, _ in OUTPUT_OPTION})
+            iterations = ServiceGenerator(run.result_scenario).completed_iterations(
+                int(run_control['min_timestep']), int(run_control['max_timestep']), output_options
+            ) - set(json.loads(run.service_iterations))
+        if iterations:
+            run.updating_services = True
+            run.save(update_fields=['updating_services'])
+
+    if iterations:
+        added = set()   # Iterations which failed are claimed again by the next scan
+        try:
+            ServiceGenerator(run.result_scenario).create_output_services(iterations, output_options)
+            added = iterations
+        finally:
+            with transaction.atomic():
+                run = RunScenarioModel.objects.select_for_update().get(id=run_id)
+                run.service_iterations = json.dumps(sorted(set(json.loads(run.service_iterations)) | added))
+                run.updating_services = False
+                run.save(update_fields=['service_iterations', 'updating_services'])
+
+    sleep(PROGRESSIVE_SERVICES_SCAN_RATE)
+    update_output_services.delay(run_id)
+
+
+def wait_for_output_services(job):
+    """
+    Wait (up to PROGRESSIVE_SERVICES_MAX_WAIT seconds) for update_output_services to finish adding iterations to the
+    job's output services. The job's model_status must no longer be 'running', so that no more are added.
+    """
+    started = time()
+    while RunScenarioModel.objects.filter(id=job.id, updating_services=True).exists():
+        if time() - started > PROGRESSIVE_SERVICES_MAX_WAIT:
+            print('Output services for job {} are still being updated, continuing anyway'.format(job.uuid))
+            return
+        sleep(JOB_POLL_RATE)
 
 
 @task(bind=True)
@@ -207,22 +533,60 @@ def run_model(self, library_name, sid):
     :param sid: The scenario id which we are running the model on. The scenario must not be a result scenario.
     """
     lib = Library.objects.get(name__iexact=library_name)
-    console = STSimConsole(exe=EXE, lib_path=lib.file, orig_lib_path=lib.orig_file)
     job = RunScenarioModel.objects.get(celery_id=self.request.id)
+
+    # Run on working copies of the library if the library has any, otherwise on the library itself
+    try:
+        with lease_working_libraries(
+                lib, STSIM_ITERATION_SHARDS, job, active_task_ids=active_task_ids) as working_libraries:
+            job.working_library = working_libraries[0] if working_libraries else None
+            if RunScenarioModel.objects.filter(id=job.id, cancel_requested=True).exists():
+                raise ModelRunCancelled('cancelled')
+            execute_model_run(job, lib, sid, working_libraries[1:])
+    except ModelRunCancelled as e:
+        print('Model run for job {} {}'.format(job.uuid, e.status))
+        cancel_model_run(job, e.status)
+        return
+    except Exception:
+        # Including LeaseTimeout, when no working library became available
+        print('Model run for job {} failed'.format(job.uuid))
+        cancel_model_run(job, 'failed')
+        raise
+
+    # Continue post-processing task for later usage and free the worker.
+    post_process_results.delay(job.id)
+
+
+def execute_model_run(job, lib, sid, shard_libraries=()):
+    """
+    Runs a model for a job, on the job's working library (or the library itself), and imports the results.
+    :param job: The RunScenarioModel for this run.
+    :param lib: The Library containing the project.
+    :param sid: The scenario id which we are running the model on.
+    :param shard_libraries: (Optional) Additional working libraries to split the iterations of the run over.
+    """
+    lib_file = job.working_library.file if job.working_library else lib.file
+    console = AsyncSTSimConsole(exe=EXE, lib_path=lib_file, orig_lib_path=lib.orig_file)
     job.model_status = 'starting'
-    job.save()
+    job.save(update_fields=['model_status', 'working_library'])
 
     # Configure ST-Sim configuration
     config = json.loads(job.inputs)['config']
     boot = ModelBootstrapper(sid, lib, config, console, job)
-    boot.run_setup()
+    consoles = [console] + [
+        AsyncSTSimConsole(exe=EXE, lib_path=x.file, orig_lib_path=lib.orig_file) for x in shard_libraries or []
+    ]
+    if shard_libraries:
+        shards = boot.run_sharded_setup(consoles)
+    else:
+        boot.run_setup()
 
-    # Execute model run
-    try:
-        look_for_new_scenario.delay(job.id)
-        result_sid = boot.run_model()
-    except:
-        raise IOError("Error running model")
+    # Execute model run. If it is stopped or fails, run_model records the job's status. The result scenario is the one
+    # which isn't in the library before the run.
+    look_for_new_scenario.delay(job.id, sorted(scenario_ids(lib_file)))
+    if STSIM_PROGRESSIVE_SERVICES:
+        update_output_services.delay(job.id)
+    result_sid = boot.run_sharded_model(shards) if shard_libraries else boot.run_model()
 
     # Create initial LandscapeSim entries
     scenario_info = console.get_scenario_attrs(result_sid)
@@ -232,7 +596,8 @@ def run_model(self, library_name, sid):
         name=scenario_info['name'],
         sid=result_sid,
         is_result=True,
-        parent=job.parent_scenario
+        parent=job.parent_scenario,
+        working_library=job.working_library
     )
 
     # If running spatially, we should have caught the scenario 
@@ -242,34 +607,49 @@ def run_model(self, library_name, sid):
         job.result_scenario = scenario
     job.outputs = json.dumps({'result_scenario': {'id': scenario.id, 'sid': scenario.sid}})
     job.model_status = 'processing'
-    job.save()
+    job.save(update_fields=['result_scenario', 'outputs', 'model_status'])
 
     # Begin importing data into LandscapeSim
     importer = ScenarioImporter(console, scenario)
     importer.import_run_control()
     importer.import_output_options()
 
-    # Create ncdjango services
+    # Create ncdjango services, or add the remaining iterations to those created while the model was running
+    if STSIM_PROGRESSIVE_SERVICES:
+        wait_for_output_services(job)
     service_generator = ServiceGenerator(scenario)
     service_generator.create_output_services()
 
     # Create reports
     reporter = ReportImporter(console, scenario)
-    reporter.create_stateclass_summary()
+    reporter.create_summaries([x for x in ALL_REPORTS if x[0] in STSIM_RUN_REPORTS])
+
+    # Record how much time was spent in each SyncroSim command for this job, across the consoles of every shard
+    outputs = json.loads(job.outputs)
+    outputs['commands'] = CommandLog.merge(x.command_log for x in consoles).summary()
+    job.outputs = json.dumps(outputs)
 
     # Signal that the model can now be used for viewing.
     job.model_status = 'complete'
-    job.save()
+    job.save(update_fields=['outputs', 'model_status'])
 
-    # Continue post-processing task for later usage and free the worker.
-    post_process_results.delay(job.id)
+
+def cancel_model_run(job, status):
+    """ Record a stopped (or failed) model run, removing the result scenario if one was already recorded for it. """
+    job.refresh_from_db(fields=['result_scenario'])
+    scenario = job.result_scenario
+    job.result_scenario = None
+    job.model_status = status
+    job.save(update_fields=['result_scenario', 'model_status'])
+    if scenario is not None:
+        scenario.delete()
 
 
 @task
 def post_process_results(run_id):
     run = RunScenarioModel.objects.get(id=run_id)
     scenario = run.result_scenario
-    console = STSimConsole(lib_path=scenario.library.file, orig_path=scenario.library.orig_file, exe=EXE)
+    console = STSimConsole(lib_path=scenario.library_file, orig_path=scenario.library.orig_file, exe=EXE)
     ScenarioImporter(console, scenario).import_post_processed_sheets(create_input_services=False)
 
 
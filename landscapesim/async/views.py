@@ -1,6 +1,10 @@
+from rest_framework import status
+from rest_framework.decorators import detail_route
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, mixins
 
 from landscapesim.async.serializers import RunModelReadOnlySerializer, RunModelCreateSerializer
+from landscapesim.async.tasks import run_model
 from landscapesim.models import RunScenarioModel
 
 
@@ -14,3 +18,23 @@ class RunModelViewset(mixins.CreateModelMixin, mixins.RetrieveModelMixin, Generi
         if self.request.method == 'POST':
             serializer_class = RunModelCreateSerializer
         return serializer_class
+
+    @detail_route(methods=['post'])
+    def cancel(self, request, *args, **kwargs):
+        """
+        Stop a model run. Jobs which have not started are revoked, and running jobs are killed by the worker's
+        watchdog, which marks the job as 'cancelled' once SyncroSim has stopped and partial outputs are removed.
+        """
+        job = self.get_object()
+        if job.model_status not in ('waiting', 'starting', 'running'):
+            return Response(
+                {'detail': 'Cannot cancel a job which is {}.'.format(job.model_status)}, status=status.HTTP_409_CONFLICT
+            )
+
+        jobs = RunScenarioModel.objects.filter(id=job.id)
+        jobs.update(cancel_requested=True)
+        if jobs.filter(model_status='waiting').update(model_status='cancelled'):
+            run_model.AsyncResult(job.celery_id).revoke()
+
+        job.refresh_from_db()
+        return Response(RunModelReadOnlySerializer(job).data, status=status.HTTP_202_ACCEPTED)
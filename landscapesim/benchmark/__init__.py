@@ -0,0 +1,8 @@
+"""
+    Tools for benchmarking the import pipeline without a SyncroSim installation.
+
+    - library: Generates synthetic .ssim libraries (and their GeoTIFFs) of a configurable size.
+    - console: A stand-in for SyncroSim.Console.exe, which answers commands from a synthetic library.
+
+    See the benchmark_import management command.
+"""
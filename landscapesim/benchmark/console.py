@@ -0,0 +1,123 @@
+"""
+    A stand-in for SyncroSim.Console.exe, which answers the commands used by LandscapeSim from a generated library
+    (see landscapesim.benchmark.library). Used to benchmark the import pipeline without a SyncroSim installation.
+
+    Usage (the arguments are the same as SyncroSim's):
+        python console.py --lib=<library> --list --scenarios
+        python console.py --lib=<library> --export --sheet=STSim_Transition --file=<csv> --sid=1
+        python console.py --lib=<library> --console=stsim --create-report --name=stateclass-summary --file=<csv> --sids=3
+        python console.py --lib=<library> --run --sid=1
+
+    Consoles run SyncroSim through mono on posix systems, so a 'mono' on the PATH which runs this script with Python
+    is needed there (see the benchmark_import management command).
+"""
+
+import csv
+import os
+import sqlite3
+import sys
+from types import SimpleNamespace
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from landscapesim.benchmark.library import run_scenario
+from landscapesim.common.sheets import REPORT_TABLES, SheetReader, SheetWriter, format_value
+
+VERSION = 'SyncroSim Console 1.0 (LandscapeSim benchmark stand-in)'
+
+
+def parse_args(args):
+    """ Parse SyncroSim arguments (e.g. --lib=<path> --list --scenarios) into a dict. Flags have a value of True. """
+    options = {}
+    for arg in args:
+        name, _, value = arg.lstrip('-').partition('=')
+        options[name] = value if value else True
+    return options
+
+
+def list_items(con, kind):
+    if kind == 'datafeeds':
+        for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'SSim_%'"):
+            print('Datafeed {}'.format(name))
+    elif kind == 'projects':
+        for pid, name in con.execute('SELECT ProjectID, Name FROM SSim_Project ORDER BY ProjectID'):
+            print('{} {}'.format(pid, name))
+    elif kind == 'scenarios':
+        for sid, pid, is_result, name in con.execute(
+                'SELECT ScenarioID, ProjectID, IsResult, Name FROM SSim_Scenario ORDER BY ScenarioID'):
+            print('{} {} {} {}'.format(sid, pid, '(Y)' if is_result else '(N)', name))
+
+
+def export_sheet(con, lib, sheet_name, path, sid=None, pid=None):
+    """ Export a sheet to CSV, as SyncroSim does: definition IDs as names, and booleans as 'Yes' or ''. """
+    info = con.execute('PRAGMA table_info([{}])'.format(sheet_name)).fetchall()
+    columns = [x[1] for x in info if not x[5] and x[1] not in ('ProjectID', 'ScenarioID')]
+    is_bool = [x[2] == 'BOOLEAN' for x in info if not x[5] and x[1] not in ('ProjectID', 'ScenarioID')]
+    filter_column, filter_value = ('ProjectID', int(pid)) if pid is not None else ('ScenarioID', int(sid))
+    rows = con.execute(SheetReader.build_query(sheet_name, columns, filter_column), (filter_value,)).fetchall()
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([format_value(v, b) for v, b in zip(row, is_bool)])
+
+
+def import_sheet(con, lib, sheet_name, path, sid):
+    """ Replace a scenario's sheet with the rows of a CSV. """
+    pid = con.execute('SELECT ProjectID FROM SSim_Scenario WHERE ScenarioID = ?', (int(sid),)).fetchone()[0]
+    with open(path, 'r') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        sheet_map = [(x, x) for x in reader.fieldnames or []]
+    SheetWriter(lib, pid).write_sheets(sid, [(sheet_name, sheet_map, rows)])
+
+
+def create_report(lib, report_name, path, sid):
+    rows = SheetReader(SimpleNamespace(lib=lib, orig_lib=None)).read_report(report_name, sid)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=[x[1] for x in REPORT_TABLES[report_name][1]])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(args):
+    options = parse_args(args)
+    if 'version' in options:
+        print(VERSION)
+        return 0
+
+    lib = options.get('lib')
+    if not lib or not os.path.exists(lib):
+        print('The library does not exist: {}'.format(lib))
+        return 1
+
+    con = sqlite3.connect(lib)
+    try:
+        if 'list' in options:
+            list_items(con, next(x for x in ('datafeeds', 'projects', 'scenarios') if x in options))
+        elif 'list-reports' in options:
+            print('Available reports:')
+            for name in REPORT_TABLES:
+                print(name)
+        elif 'export' in options:
+            export_sheet(con, lib, options['sheet'], options['file'], sid=options.get('sid'), pid=options.get('pid'))
+        elif 'import' in options:
+            import_sheet(con, lib, options['sheet'], options['file'], options['sid'])
+        elif 'create-report' in options:
+            create_report(lib, options['name'], options['file'], options['sids'])
+        elif 'run' in options:
+            result_sid = run_scenario(
+                lib, int(options['sid']), on_iteration=lambda x: print('Iteration {} complete'.format(x), flush=True)
+            )
+            print('Run complete. Result scenario ID is: {}'.format(result_sid))
+        else:
+            print('Unsupported command: {}'.format(' '.join(args)))
+            return 1
+    finally:
+        con.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
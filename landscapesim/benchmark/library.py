@@ -0,0 +1,384 @@
+"""
+    Synthetic SyncroSim libraries for benchmarking.
+
+    A generated library is a SQLite database with the tables LandscapeSim reads and writes: project definitions,
+    scenario datafeeds and summary output tables, plus SSim_Project and SSim_Scenario tables which list the projects
+    and scenarios of the library. Spatial scenarios have initial conditions rasters, and their model runs write output
+    rasters, as GeoTIFFs in the usual .input and .output directories.
+
+    Table and column names follow landscapesim.common.config, so that the library can be read by SheetReader and
+    written by SheetWriter. Row values are random, but consistent with the project definitions they reference.
+"""
+
+import os
+import random
+import sqlite3
+from itertools import product
+from shutil import copyfile, copytree, rmtree
+
+from landscapesim.common import config
+from landscapesim.common.sheets import CALCULATED_REPORT_COLUMNS, REPORT_TABLES
+
+_name = (('name', 'Name'),)
+
+# Project definition tables: (table name, primary key, sheet map)
+DEFINITION_TABLES = (
+    ('STSim_Terminology', None, config.TERMINOLOGY),
+    ('Stats_DistributionType', 'DistributionTypeID', config.DISTRIBUTION_TYPE),
+    ('STSim_Stratum', 'StratumID', config.STRATUM),
+    ('STSim_SecondaryStratum', 'SecondaryStratumID', config.SECONDARY_STRATUM),
+    ('STSim_StateLabelX', 'StateLabelXID', _name),
+    ('STSim_StateLabelY', 'StateLabelYID', _name),
+    ('STSim_StateClass', 'StateClassID', config.STATECLASS),
+    ('STSim_TransitionType', 'TransitionTypeID', config.TRANSITION_TYPE),
+    ('STSim_TransitionGroup', 'TransitionGroupID', config.TRANSITION_GROUP),
+    ('STSim_TransitionTypeGroup', None, config.TRANSITION_TYPE_GROUP),
+    ('STSim_TransitionMultiplierType', 'TransitionMultiplierTypeID', config.TRANSITION_MULTIPLIER_TYPE),
+    ('STSim_AttributeGroup', 'AttributeGroupID', config.ATTRIBUTE_GROUP),
+    ('STSim_StateAttributeType', 'StateAttributeTypeID', config.STATE_ATTRIBUTE_TYPE),
+    ('STSim_TransitionAttributeType', 'TransitionAttributeTypeID', config.TRANSITION_ATTRIBUTE_TYPE)
+)
+
+# Scenario datafeed tables: (table name, sheet map)
+SCENARIO_TABLES = (
+    ('STSim_RunControl', config.RUN_CONTROL),
+    ('STSim_OutputOptions', config.OUTPUT_OPTION),
+    ('Stats_DistributionValue', config.DISTRIBUTION_VALUE),
+    ('STSim_DeterministicTransition', config.DETERMINISTIC_TRANSITION),
+    ('STSim_Transition', config.TRANSITION),
+    ('STSim_InitialConditionsNonSpatial', config.INITIAL_CONDITIONS_NON_SPATIAL),
+    ('STSim_InitialConditionsNonSpatialDistribution', config.INITIAL_CONDITIONS_NON_SPATIAL_DISTRIBUTION),
+    ('STSim_InitialConditionsSpatial', config.INITIAL_CONDITIONS_SPATIAL),
+    ('STSim_TransitionTarget', config.TRANSITION_TARGET),
+    ('STSim_TransitionMultiplierValue', config.TRANSITION_MULTIPLIER_VALUE),
+    ('STSim_TransitionSizeDistribution', config.TRANSITION_SIZE_DISTRIBUTION),
+    ('STSim_TransitionSizePrioritization', config.TRANSITION_SIZE_PRIORITIZATION),
+    ('STSim_TransitionSpatialMultiplier', config.TRANSITION_SPATIAL_MULTIPLIER),
+    ('STSim_StateAttributeValue', config.STATE_ATTRIBUTE_VALUE),
+    ('STSim_TransitionAttributeValue', config.TRANSITION_ATTRIBUTE_VALUE),
+    ('STSim_TransitionAttributeTarget', config.TRANSITION_ATTRIBUTE_TARGET)
+)
+
+# Columns which SyncroSim stores as booleans (-1 for True), and exports as 'Yes' or ''
+BOOLEAN_COLUMNS = {'IsInternal', 'IsPrimary', 'IsSpatial', 'AgeReset', 'CalcFromDist', 'CellAreaOverride'} | {
+    column for _, column in config.OUTPUT_OPTION if not column.endswith('Timesteps')
+}
+
+# Definition tables that output rows are generated for, by the ID column which references them
+OUTPUT_DIMENSIONS = {
+    'StratumID': 'STSim_Stratum',
+    'StateClassID': 'STSim_StateClass',
+    'TransitionGroupID': 'STSim_TransitionGroup',
+    'TransitionTypeID': 'STSim_TransitionType',
+    'StateAttributeTypeID': 'STSim_StateAttributeType',
+    'TransitionAttributeTypeID': 'STSim_TransitionAttributeType'
+}
+
+CELL_SIZE = 30
+XLL_CORNER = 500000
+YLL_CORNER = 4800000
+SRS = '+proj=utm +zone=11 +datum=WGS84 +units=m +no_defs'
+CRS = {'init': 'EPSG:32611'}
+
+
+def _column_type(column):
+    if column in BOOLEAN_COLUMNS:
+        return 'BOOLEAN'
+    return 'INTEGER' if column.endswith('ID') else ''
+
+
+def _create_table(con, table, pk, columns):
+    definitions = ['[{}] INTEGER PRIMARY KEY'.format(pk)] + [
+        '[{}] {}'.format(column, _column_type(column)).strip() for column in columns if column != pk
+    ]
+    con.execute('CREATE TABLE [{}] ({})'.format(table, ', '.join(definitions)))
+
+
+def create_schema(con):
+    """ Create the tables of an empty library. """
+    con.execute('CREATE TABLE SSim_Project (ProjectID INTEGER PRIMARY KEY, Name TEXT)')
+    con.execute(
+        'CREATE TABLE SSim_Scenario (ScenarioID INTEGER PRIMARY KEY, ProjectID INTEGER, Name TEXT, '
+        'IsResult BOOLEAN, ParentID INTEGER)'
+    )
+    for table, pk, sheet_map in DEFINITION_TABLES:
+        _create_table(con, table, pk or table + 'ID', ['ProjectID'] + [x[1] for x in sheet_map])
+    for table, sheet_map in SCENARIO_TABLES:
+        _create_table(con, table, table + 'ID', ['ScenarioID'] + [x[1] for x in sheet_map])
+    for table, sheet_map in REPORT_TABLES.values():
+        columns = [x[1] for x in sheet_map if x[1] not in CALCULATED_REPORT_COLUMNS]
+        _create_table(con, table, table + 'ID', ['ScenarioID'] + columns)
+
+
+def _insert(con, table, row):
+    """ Insert a row (a dict keyed by column name), returning its primary key. """
+    columns = list(row.keys())
+    return con.execute('INSERT INTO [{}] ({}) VALUES ({})'.format(
+        table, ', '.join('[{}]'.format(c) for c in columns), ', '.join('?' for _ in columns)
+    ), [row[c] for c in columns]).lastrowid
+
+
+def _insert_many(con, table, rows):
+    rows = list(rows)
+    if not rows:
+        return 0
+    columns = list(rows[0].keys())
+    con.executemany('INSERT INTO [{}] ({}) VALUES ({})'.format(
+        table, ', '.join('[{}]'.format(c) for c in columns), ', '.join('?' for _ in columns)
+    ), [[row[c] for c in columns] for row in rows])
+    return len(rows)
+
+
+def _color():
+    return '255,{},{},{}'.format(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+
+
+def create_project(con, name, strata=5, stateclasses=10, transition_types=5, attribute_types=3):
+    """ Create a project and its definitions. Each transition type has a transition group of the same name. """
+    pid = _insert(con, 'SSim_Project', {'Name': name})
+    _insert(con, 'STSim_Terminology', {
+        'ProjectID': pid, 'AmountLabel': 'Area', 'AmountUnits': 'Hectares', 'StateLabelX': 'Class',
+        'StateLabelY': 'Subclass', 'PrimaryStratumLabel': 'Stratum', 'SecondaryStratumLabel': 'Secondary Stratum',
+        'TimestepUnits': 'Year'
+    })
+    for distribution in ('Uniform', 'Normal'):
+        _insert(con, 'Stats_DistributionType', {'ProjectID': pid, 'Name': distribution, 'IsInternal': -1})
+    for i in range(1, strata + 1):
+        _insert(con, 'STSim_Stratum', {'ProjectID': pid, 'Name': 'Stratum {}'.format(i), 'Color': _color(), 'ID': i})
+    _insert(con, 'STSim_SecondaryStratum', {'ProjectID': pid, 'Name': 'Secondary Stratum 1', 'ID': 1})
+    label_y = _insert(con, 'STSim_StateLabelY', {'ProjectID': pid, 'Name': 'All'})
+    for i in range(1, stateclasses + 1):
+        label_x = _insert(con, 'STSim_StateLabelX', {'ProjectID': pid, 'Name': 'Class {}'.format(i)})
+        _insert(con, 'STSim_StateClass', {
+            'ProjectID': pid, 'Name': 'Class {}:All'.format(i), 'Color': _color(), 'StateLabelXID': label_x,
+            'StateLabelYID': label_y, 'ID': i
+        })
+    for i in range(1, transition_types + 1):
+        name = 'Transition {}'.format(i)
+        transition_type = _insert(con, 'STSim_TransitionType', {
+            'ProjectID': pid, 'Name': name, 'Color': _color(), 'ID': i
+        })
+        transition_group = _insert(con, 'STSim_TransitionGroup', {'ProjectID': pid, 'Name': name})
+        _insert(con, 'STSim_TransitionTypeGroup', {
+            'ProjectID': pid, 'TransitionTypeID': transition_type, 'TransitionGroupID': transition_group,
+            'IsPrimary': -1
+        })
+    _insert(con, 'STSim_TransitionMultiplierType', {'ProjectID': pid, 'Name': 'Multiplier 1'})
+    attribute_group = _insert(con, 'STSim_AttributeGroup', {'ProjectID': pid, 'Name': 'Attributes'})
+    for i in range(1, attribute_types + 1):
+        for table, kind in (('STSim_StateAttributeType', 'State'), ('STSim_TransitionAttributeType', 'Transition')):
+            _insert(con, table, {
+                'ProjectID': pid, 'Name': '{} Attribute {}'.format(kind, i), 'Units': 'Tons',
+                'AttributeGroupID': attribute_group
+            })
+    return pid
+
+
+def definition_ids(con, pid, table, column=None):
+    """ The primary keys (or another column) of a project's definitions. """
+    pk = dict((x[0], x[1]) for x in DEFINITION_TABLES if x[1])[table]
+    return [x[0] for x in con.execute(
+        'SELECT [{}] FROM [{}] WHERE ProjectID = ? ORDER BY [{}]'.format(column or pk, table, pk), (pid,)
+    )]
+
+
+def create_scenario(lib, con, pid, name, iterations=2, timesteps=10, raster_size=64):
+    """ Create an input scenario, with rows for the common datafeeds and initial conditions rasters. """
+    sid = _insert(con, 'SSim_Scenario', {'ProjectID': pid, 'Name': name, 'IsResult': 0})
+    strata = definition_ids(con, pid, 'STSim_Stratum')
+    stateclasses = definition_ids(con, pid, 'STSim_StateClass')
+    transition_types = definition_ids(con, pid, 'STSim_TransitionType')
+    transition_groups = definition_ids(con, pid, 'STSim_TransitionGroup')
+    multiplier_type = definition_ids(con, pid, 'STSim_TransitionMultiplierType')[0]
+    distribution_types = definition_ids(con, pid, 'Stats_DistributionType')
+    state_attributes = definition_ids(con, pid, 'STSim_StateAttributeType')
+    transition_attributes = definition_ids(con, pid, 'STSim_TransitionAttributeType')
+    num_cells = raster_size * raster_size
+    cell_area = CELL_SIZE * CELL_SIZE / 10000
+
+    _insert(con, 'STSim_RunControl', {
+        'ScenarioID': sid, 'MinimumIteration': 1, 'MaximumIteration': iterations, 'MinimumTimestep': 0,
+        'MaximumTimestep': timesteps, 'IsSpatial': -1
+    })
+    _insert(con, 'STSim_OutputOptions', {
+        'ScenarioID': sid, **{column: 1 if column.endswith('Timesteps') else -1 for _, column in config.OUTPUT_OPTION}
+    })
+    _insert_many(con, 'Stats_DistributionValue', ({
+        'ScenarioID': sid, 'DistributionTypeID': x, 'Min': 0, 'Max': 1, 'RelativeFrequency': 1
+    } for x in distribution_types))
+    _insert_many(con, 'STSim_DeterministicTransition', ({
+        'ScenarioID': sid, 'StratumIDSource': stratum, 'StateClassIDSource': stateclass, 'StratumIDDest': None,
+        'StateClassIDDest': stateclasses[(i + 1) % len(stateclasses)], 'AgeMin': 0, 'AgeMax': 20 * (i + 1),
+        'Location': 'A{}'.format(i + 1)
+    } for stratum in strata for i, stateclass in enumerate(stateclasses)))
+    _insert_many(con, 'STSim_Transition', ({
+        'ScenarioID': sid, 'StratumIDSource': stratum, 'StateClassIDSource': stateclass, 'StratumIDDest': None,
+        'StateClassIDDest': random.choice(stateclasses), 'TransitionTypeID': transition_type,
+        'Probability': round(random.random() / 10, 4), 'AgeReset': -1
+    } for stratum, stateclass, transition_type in product(strata, stateclasses, transition_types)))
+    _insert(con, 'STSim_InitialConditionsNonSpatial', {
+        'ScenarioID': sid, 'TotalAmount': num_cells * cell_area, 'NumCells': num_cells, 'CalcFromDist': 0
+    })
+    _insert_many(con, 'STSim_InitialConditionsNonSpatialDistribution', ({
+        'ScenarioID': sid, 'StratumID': stratum, 'StateClassID': stateclass, 'RelativeAmount': random.random()
+    } for stratum, stateclass in product(strata, stateclasses)))
+    _insert(con, 'STSim_InitialConditionsSpatial', {
+        'ScenarioID': sid, 'NumRows': raster_size, 'NumColumns': raster_size, 'NumCells': num_cells,
+        'CellSize': CELL_SIZE, 'CellSizeUnits': 'Meter', 'CellArea': cell_area, 'CellAreaOverride': 0,
+        'XLLCorner': XLL_CORNER, 'YLLCorner': YLL_CORNER, 'SRS': SRS, 'StratumFileName': 'stratum.tif',
+        'StateClassFileName': 'stateclass.tif', 'AgeFileName': 'age.tif'
+    })
+    _insert_many(con, 'STSim_TransitionMultiplierValue', ({
+        'ScenarioID': sid, 'StratumID': stratum, 'TransitionGroupID': transition_group,
+        'TransitionMultiplierTypeID': multiplier_type, 'Amount': 1
+    } for stratum, transition_group in product(strata, transition_groups)))
+    _insert_many(con, 'STSim_StateAttributeValue', ({
+        'ScenarioID': sid, 'StratumID': stratum, 'StateClassID': stateclass, 'StateAttributeTypeID': attribute,
+        'Value': round(random.random() * 100, 2)
+    } for stratum, stateclass, attribute in product(strata, stateclasses, state_attributes)))
+    _insert_many(con, 'STSim_TransitionAttributeValue', ({
+        'ScenarioID': sid, 'StratumID': stratum, 'TransitionGroupID': transition_group,
+        'TransitionAttributeTypeID': attribute, 'Value': round(random.random() * 100, 2)
+    } for stratum, transition_group, attribute in product(strata, transition_groups, transition_attributes)))
+
+    # Rasters use the user-facing IDs of strata and state classes
+    input_directory = os.path.join(lib + '.input', 'Scenario-' + str(sid), 'STSim_InitialConditionsSpatial')
+    strata_values = definition_ids(con, pid, 'STSim_Stratum', 'ID')
+    stateclass_values = definition_ids(con, pid, 'STSim_StateClass', 'ID')
+    write_raster(os.path.join(input_directory, 'stratum.tif'), random_raster(strata_values, raster_size))
+    write_raster(os.path.join(input_directory, 'stateclass.tif'), random_raster(stateclass_values, raster_size))
+    write_raster(os.path.join(input_directory, 'age.tif'), random_raster(range(100), raster_size))
+    return sid
+
+
+def random_raster(values, size):
+    import numpy  # Only needed for spatial scenarios, so the stand-in console starts quickly for other commands
+    return numpy.random.choice(list(values), (size, size)).astype(numpy.int32)
+
+
+def write_raster(path, data):
+    """ Write a single band GeoTIFF in the projection and extent used by generated libraries. """
+    import rasterio
+    from rasterio.transform import from_origin
+
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    height, width = data.shape
+    transform = from_origin(XLL_CORNER, YLL_CORNER + height * CELL_SIZE, CELL_SIZE, CELL_SIZE)
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=height, width=width, count=1, dtype=str(data.dtype), crs=CRS,
+        transform=transform, nodata=-9999
+    ) as dataset:
+        dataset.write(data, 1)
+
+
+def _output_rows(sid, columns, iteration, timesteps, ids):
+    """ Random summary output rows for an iteration, with a row for each combination of the referenced IDs. """
+    dimensions = [x for x in columns if x in OUTPUT_DIMENSIONS]
+    for timestep, combination in product(timesteps, product(*[ids[OUTPUT_DIMENSIONS[x]] for x in dimensions])):
+        row = dict.fromkeys(columns)
+        row.update(zip(dimensions, combination))
+        row.update({'ScenarioID': sid, 'Iteration': iteration, 'Timestep': timestep})
+        row['Amount'] = round(random.random() * 1000, 3)
+        if 'AgeMin' in row:
+            row['AgeMin'] = 0
+        if 'EndStateClassID' in row:
+            row['EndStateClassID'] = random.choice(ids['STSim_StateClass'])
+        yield row
+
+
+def run_scenario(lib, sid, on_iteration=None):
+    """
+    Simulate a model run of a scenario. A result scenario is created with a copy of the scenario's datafeeds, random
+    summary output for each iteration and timestep, and (for spatial scenarios) output rasters.
+    :param on_iteration: (Optional) Called with each iteration as it completes.
+    :return: The result scenario ID.
+    """
+    con = sqlite3.connect(lib)
+    try:
+        with con:
+            pid, name = con.execute('SELECT ProjectID, Name FROM SSim_Scenario WHERE ScenarioID = ?', (sid,)).fetchone()
+            result_sid = _insert(con, 'SSim_Scenario', {
+                'ProjectID': pid, 'Name': name, 'IsResult': -1, 'ParentID': sid
+            })
+            for table, sheet_map in SCENARIO_TABLES:
+                columns = ', '.join('[{}]'.format(x[1]) for x in sheet_map)
+                con.execute('INSERT INTO [{table}] (ScenarioID, {columns}) SELECT ?, {columns} FROM [{table}] '
+                            'WHERE ScenarioID = ?'.format(table=table, columns=columns), (result_sid, sid))
+
+            min_iteration, max_iteration, min_timestep, max_timestep, is_spatial = con.execute(
+                'SELECT MinimumIteration, MaximumIteration, MinimumTimestep, MaximumTimestep, IsSpatial '
+                'FROM STSim_RunControl WHERE ScenarioID = ?', (result_sid,)
+            ).fetchone()
+            size = con.execute(
+                'SELECT NumRows, NumColumns FROM STSim_InitialConditionsSpatial WHERE ScenarioID = ?', (result_sid,)
+            ).fetchone()
+            ids = {table: definition_ids(con, pid, table) for table in OUTPUT_DIMENSIONS.values()}
+            stateclass_values = definition_ids(con, pid, 'STSim_StateClass', 'ID')
+            timesteps = range(int(min_timestep), int(max_timestep) + 1)
+
+            output_directory = os.path.join(lib + '.output', 'Scenario-' + str(result_sid), 'Spatial')
+            for iteration in range(int(min_iteration), int(max_iteration) + 1):
+                for table, sheet_map in REPORT_TABLES.values():
+                    columns = ['ScenarioID'] + [x[1] for x in sheet_map if x[1] not in CALCULATED_REPORT_COLUMNS]
+                    _insert_many(con, table, _output_rows(result_sid, columns, iteration, timesteps, ids))
+
+                if is_spatial and size is not None:
+                    for timestep in timesteps:
+                        prefix = os.path.join(output_directory, 'It{:04d}-Ts{:04d}'.format(iteration, timestep))
+                        write_raster(prefix + '-sc.tif', random_raster(stateclass_values, size[0]))
+                        if timestep > min_timestep:
+                            for transition_group in ids['STSim_TransitionGroup']:
+                                write_raster(
+                                    '{}-tg-{}.tif'.format(prefix, transition_group), random_raster((0, 1), size[0])
+                                )
+                if on_iteration is not None:
+                    on_iteration(iteration)
+    finally:
+        con.close()
+
+    input_directory = os.path.join(lib + '.input', 'Scenario-' + str(sid))
+    if os.path.exists(input_directory):
+        copytree(input_directory, os.path.join(lib + '.input', 'Scenario-' + str(result_sid)))
+    return result_sid
+
+
+def generate_library(path, projects=1, scenarios=2, results=1, strata=5, stateclasses=10, transition_types=5,
+                     attribute_types=3, iterations=2, timesteps=10, raster_size=64):
+    """
+    Generate a library, along with the original copy of the library that add_library expects (<name>_orig.ssim).
+    :param scenarios: The number of input scenarios in each project.
+    :param results: The number of model runs of each input scenario.
+    :return: The path to the original copy of the library.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    for directory in (path + '.input', path + '.output'):
+        if os.path.exists(directory):
+            rmtree(directory)
+    con = sqlite3.connect(path)
+    try:
+        with con:
+            create_schema(con)
+            input_scenarios = []
+            for p in range(1, projects + 1):
+                pid = create_project(con, 'Project {}'.format(p), strata, stateclasses, transition_types,
+                                     attribute_types)
+                for s in range(1, scenarios + 1):
+                    input_scenarios.append(create_scenario(
+                        path, con, pid, 'Scenario {}'.format(s), iterations, timesteps, raster_size
+                    ))
+    finally:
+        con.close()
+
+    for sid in input_scenarios:
+        for _ in range(results):
+            run_scenario(path, sid)
+
+    orig_path = path.split('.ssim')[0] + '_orig.ssim'
+    copyfile(path, orig_path)
+    if os.path.exists(orig_path + '.input'):
+        rmtree(orig_path + '.input')
+    if os.path.exists(path + '.input'):
+        copytree(path + '.input', orig_path + '.input')
+    return orig_path
@@ -0,0 +1,94 @@
+"""
+    Bulk loading of model rows.
+
+    On PostgreSQL, rows are streamed into the model's table with COPY FROM STDIN, formatting each row as it is read
+    rather than building the whole payload (or a model instance per row) in memory. Other databases fall back to
+    batched bulk_create.
+"""
+
+from itertools import chain, islice
+
+from django.db import connection, models, transaction
+
+COPY_BATCH_SIZE = 1000
+
+
+def format_copy_value(value):
+    """ Format a value for PostgreSQL's COPY text format. Model instances are written as their primary key. """
+    if value is None:
+        return '\\N'
+    if isinstance(value, models.Model):
+        return str(value.pk)
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class CopyStream:
+    """ A file-like object which formats rows as COPY text as they are read. """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            line = '\t'.join(format_copy_value(x) for x in row) + '\n'
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+
+        data = ''.join(parts)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def load_rows(model, rows):
+    """
+    Insert rows into a model's table.
+    :param model: The model class to create rows for.
+    :param rows: An iterable of dicts mapping model field names to values (model instances for foreign keys). Every
+    row must have the same fields.
+    :return: The number of rows inserted.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    rows = chain([first], rows)
+
+    if connection.vendor != 'postgresql':
+        count = 0
+        with transaction.atomic():
+            while True:
+                batch = [model(**row) for row in islice(rows, COPY_BATCH_SIZE)]
+                if not batch:
+                    break
+                model.objects.bulk_create(batch)
+                count += len(batch)
+        return count
+
+    fields = list(first.keys())
+    stream = CopyStream([row[f] for f in fields] for row in rows)
+    statement = 'COPY {} ({}) FROM STDIN'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(model._meta.get_field(f).column) for f in fields)
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(statement, stream)
+    return stream.count
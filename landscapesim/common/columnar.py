@@ -0,0 +1,181 @@
+"""
+    Columnar storage for summary reports.
+
+    A summary report has a row for every iteration, timestep, stratum and class, which is a lot of rows to store and
+    query through the ORM. A ColumnarReport instead keeps each column of a report as a typed NumPy array, stored as a
+    compressed .npz file in the result scenario's output directory. Foreign keys are stored as primary keys, with
+    NULL_KEY in place of null.
+
+    Rows keep an 'id' column so that they serialize in the same shape as report rows stored in the database. Rows
+    loaded from the database keep their primary keys; rows which were never stored in the database are numbered
+    from 1, in the order they were imported.
+"""
+
+import os
+
+import numpy
+from django.conf import settings
+from django.db import models
+
+# Where summary report rows are stored: 'database' (a model instance per row) or 'columnar' (.npz files)
+STSIM_REPORT_STORAGE = getattr(settings, 'STSIM_REPORT_STORAGE', 'database')
+
+NULL_KEY = -1
+ID_COLUMN = 'id'
+
+
+def report_path(scenario, report_name):
+    """ The path of the columnar file for a scenario's report. """
+    return os.path.join(
+        scenario.library_file + '.output', 'Scenario-' + str(scenario.sid), 'Reports', report_name + '.npz'
+    )
+
+
+def report_fields(row_model):
+    """ The fields of a report row model which are stored as columns. """
+    return [f for f in row_model._meta.concrete_fields if not f.primary_key and f.name != 'report']
+
+
+def column_dtype(field):
+    if field.is_relation or isinstance(field, models.IntegerField):
+        return numpy.int32
+    if isinstance(field, models.BooleanField):
+        return numpy.bool_
+    return numpy.float64
+
+
+class ColumnarReport:
+    """ A summary report held as one array per column, with simple filtering and aggregation. """
+
+    def __init__(self, columns):
+        """
+        Constructor
+        :param columns: A dict of column arrays, keyed by field attribute name (e.g. 'stratum_id'). All arrays must
+        have the same length. Rows are numbered from 1 if there is no 'id' column.
+        """
+        if columns and ID_COLUMN not in columns:
+            length = len(next(iter(columns.values())))
+            columns = {ID_COLUMN: numpy.arange(1, length + 1, dtype=numpy.int64), **columns}
+        self.columns = columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    @classmethod
+    def from_rows(cls, row_model, rows):
+        """
+        Create a report from mapped report rows (see ReportImporter.map_row).
+        :param row_model: The report row model the rows would otherwise be created as.
+        :param rows: An iterable of dicts, keyed by model field names. Foreign keys may be model instances.
+        """
+        fields = report_fields(row_model)
+        data = {f.attname: [] for f in fields}
+        for row in rows:
+            for field in fields:
+                value = row[field.name] if field.name in row else field.get_default()
+                if field.is_relation:
+                    value = NULL_KEY if value is None else value.pk
+                data[field.attname].append(value)
+        return cls({f.attname: numpy.array(data[f.attname], dtype=column_dtype(f)) for f in fields})
+
+    @classmethod
+    def from_queryset(cls, row_model, queryset):
+        """ Create a report from report rows stored in the database. """
+        fields = report_fields(row_model)
+        values = list(queryset.order_by('pk').values_list('pk', *[f.attname for f in fields]))
+        ids, *columns = list(zip(*values)) if values else [() for _ in range(len(fields) + 1)]
+        return cls({
+            ID_COLUMN: numpy.array(ids, dtype=numpy.int64),
+            **{f.attname: numpy.array([NULL_KEY if x is None else x for x in column], dtype=column_dtype(f))
+               for f, column in zip(fields, columns)}
+        })
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def save(self, path):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        numpy.savez_compressed(path, **self.columns)
+
+    def _column_name(self, name):
+        """ Allow foreign key columns to be referred to by field name (e.g. 'stratum' for 'stratum_id'). """
+        return name if name in self.columns else name + '_id'
+
+    @staticmethod
+    def _key(value):
+        if value is None:
+            return NULL_KEY
+        return value.pk if isinstance(value, models.Model) else value
+
+    def values(self, name):
+        """ The array of values for a column. """
+        return self.columns[self._column_name(name)]
+
+    def filter(self, **criteria):
+        """
+        Select the rows matching all criteria, e.g. filter(stratum=stratum, timestep=10, iteration=[1, 2]).
+        Values may be model instances, primary keys or values, or a list of any of them to match one of.
+        :return: A new ColumnarReport.
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        for name, value in criteria.items():
+            column = self.values(name)
+            if isinstance(value, (list, tuple, set)):
+                mask &= numpy.isin(column, [self._key(x) for x in value])
+            else:
+                mask &= column == self._key(value)
+        return ColumnarReport({name: column[mask] for name, column in self.columns.items()})
+
+    def aggregate(self, name, by=(), func=numpy.mean):
+        """
+        Aggregate a column, optionally grouped by other columns. For example, aggregate('amount', by=('timestep',))
+        gives the mean amount across iterations at each timestep.
+        :param name: The column to aggregate.
+        :param by: (Optional) Columns to group by.
+        :param func: The aggregate function, applied to the values of each group.
+        :return: The aggregated value, or a dict of aggregated values keyed by group (a tuple if grouping by more
+        than one column). Null foreign keys are None in group keys, as in a values() queryset. Returns None if there
+        are no rows and no grouping.
+        """
+        values = self.values(name)
+        if not by:
+            return func(values) if len(values) else None
+
+        keys = numpy.stack([self.values(x) for x in by], axis=1)
+        groups, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        is_key = [self._column_name(x).endswith('_id') for x in by]
+
+        def group_key(key):
+            key = [None if k and x == NULL_KEY else x for x, k in zip(key.tolist(), is_key)]
+            return tuple(key) if len(by) > 1 else key[0]
+
+        return {group_key(key): func(values[inverse == i]) for i, key in enumerate(groups)}
+
+    def rows(self):
+        """
+        The report as a list of dicts, in the same form as serialized report rows (without the 'report' key): 'id',
+        then each column, with foreign keys under their field names (e.g. 'stratum') and null keys as None.
+        """
+        names = [(name[:-3] if name.endswith('_id') else name, name) for name in self.columns]
+        lists = [self.columns[name].tolist() for _, name in names]
+        return [
+            {field: (None if name.endswith('_id') and value == NULL_KEY else value)
+             for (field, name), value in zip(names, row)}
+            for row in zip(*lists)
+        ]
+
+
+def load_report(scenario, report_name, row_model, report=None):
+    """
+    Load a scenario's summary report as a ColumnarReport, from its columnar file if there is one, otherwise from the
+    report rows in the database.
+    :param report: (Optional) The report model instance, if the rows are stored in the database.
+    """
+    path = report_path(scenario, report_name)
+    if os.path.exists(path):
+        return ColumnarReport.load(path)
+    return ColumnarReport.from_queryset(row_model, row_model.objects.filter(report=report))
@@ -317,3 +317,16 @@ VALUE_IMPORTS = (
     ('transition_attribute_values', 'STSim_TransitionAttributeValue', TRANSITION_ATTRIBUTE_VALUE),
     #('transition_attribute_targets', 'STSim_TransitionAttributeTarget', TRANSITION_ATTRIBUTE_TARGET)
 )
+# Scenario values which are shared with the parent scenario, rather than copied, when the rows are identical
+SHARED_VALUES = (
+    ('deterministic_transitions', 'STSim_DeterministicTransition'),
+    ('transitions', 'STSim_Transition'),
+    ('transition_targets', 'STSim_TransitionTarget'),
+    ('transition_multiplier_values', 'STSim_TransitionMultiplierValue'),
+    ('transition_size_distributions', 'STSim_TransitionSizeDistribution'),
+    ('transition_size_prioritizations', 'STSim_TransitionSizePrioritization'),
+    ('transition_spatial_multipliers', 'STSim_TransitionSpatialMultiplier'),
+    ('state_attribute_values', 'STSim_StateAttributeValue'),
+    ('transition_attribute_values', 'STSim_TransitionAttributeValue'),
+    ('transition_attribute_targets', 'STSim_TransitionAttributeTarget')
+)
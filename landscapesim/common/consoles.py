@@ -4,10 +4,18 @@
     Available Consoles (Verbose Name, basename, Python class):
         - System Console                        'system'        Console
         - ST-Sim State and Transition Console   'stsim'         STSimConsole
+
+    AsyncSTSimConsole provides the same interface, but runs commands with asyncio so that output can be streamed,
+    and commands can be given deadlines or cancelled.
 """
 
+import asyncio
 import os
+import signal
 import subprocess
+import threading
+from collections import deque, namedtuple, OrderedDict
+from time import perf_counter
 
 # The standard installation location for SyncroSim (subject to change. Not valid for linux installations)
 DEFAULT_EXE = "C:\\Program Files\\SyncroSim\\1\\SyncroSim.Console.Exe"
@@ -16,6 +24,166 @@ DEFAULT_EXE = "C:\\Program Files\\SyncroSim\\1\\SyncroSim.Console.Exe"
 NICENESS = 20
 NICE_CMD = ['nice', '-n', '{}'.format(NICENESS)]
 
+# Executables which have already been verified to run in this process
+VERIFIED_EXECUTABLES = set()
+
+# Libraries which have been validated, and had their spatial directories created, in this process.
+# Maps (lib, orig_lib) to the library stamp at the time (see LibraryMetadataCache.stamp)
+PREPARED_LIBRARIES = {}
+
+# Commands which modify the library contents, and therefore invalidate any cached library metadata
+MODIFYING_COMMANDS = ('--run', '--import')
+
+# Number of commands to keep accounting records for, per console
+COMMAND_LOG_SIZE = 1000
+
+# An accounting record for a single SyncroSim command (args excludes the executable and library). cpu_time (user +
+# system, in seconds) and max_rss (as reported by getrusage, i.e. kilobytes on Linux) are None where the platform
+# cannot report them for a single process.
+CommandRecord = namedtuple('CommandRecord', ('args', 'wall_time', 'cpu_time', 'max_rss', 'returncode'))
+
+
+def command_name(args):
+    """ A short name for a SyncroSim command, made from its arguments without values (e.g. '--list --scenarios'). """
+    return ' '.join(x for x in args if '=' not in x)
+
+
+def wait_process(process):
+    """
+    Wait for a subprocess.Popen process to exit, setting its returncode. Where the platform supports it, the process is
+    reaped with wait4 to collect its resource usage.
+    :return: A tuple of (cpu_time, max_rss), which are None if resource usage is not available.
+    """
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None, None
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+def run_command(input_args):
+    """
+    Run a process to completion, collecting its resource usage.
+    :return: A tuple of (subprocess.CompletedProcess, wall_time, cpu_time, max_rss)
+    """
+    start = perf_counter()
+    process = subprocess.Popen(input_args, stdout=subprocess.PIPE)
+    with process.stdout:
+        stdout = process.stdout.read()
+    cpu_time, max_rss = wait_process(process)
+    result = subprocess.CompletedProcess(input_args, process.returncode, stdout=stdout)
+    return result, perf_counter() - start, cpu_time, max_rss
+
+
+class CommandLog:
+    """ A ring buffer of CommandRecords for the most recent commands executed by a console. """
+
+    def __init__(self, size=COMMAND_LOG_SIZE):
+        self.records = deque(maxlen=size)
+        self.count = 0  # All commands executed, including those no longer recorded
+
+    def add(self, record):
+        self.records.append(record)
+        self.count += 1
+
+    @classmethod
+    def merge(cls, logs):
+        """ A log of every record in several logs, e.g. those of the consoles for each shard of a model run. """
+        merged = cls(size=None)
+        for log in logs:
+            merged.records.extend(log.records)
+            merged.count += log.count
+        return merged
+
+    def summary(self):
+        """
+        Summarize the recorded commands by command name, ordered by total wall time (the hottest commands first).
+        :return: A list of dicts, JSON serializable.
+        """
+        totals = OrderedDict()
+        for record in self.records:
+            name = command_name(record.args)
+            entry = totals.setdefault(name, {'command': name, 'count': 0, 'wall_time': 0.0, 'cpu_time': None,
+                                             'max_rss': None})
+            entry['count'] += 1
+            entry['wall_time'] += record.wall_time
+            if record.cpu_time is not None:
+                entry['cpu_time'] = (entry['cpu_time'] or 0.0) + record.cpu_time
+            if record.max_rss is not None:
+                entry['max_rss'] = max(entry['max_rss'] or 0, record.max_rss)
+        return sorted(totals.values(), key=lambda x: x['wall_time'], reverse=True)
+
+
+class LibraryMetadataCache:
+    """
+    Process-wide cache for the output of SyncroSim '--list' commands (datafeeds, projects and scenarios).
+
+    Entries are keyed on the absolute library path and stamped with the library file's mtime and size, so a library
+    that is modified outside of this process is detected on the next lookup. Commands that modify a library through a
+    Console (see MODIFYING_COMMANDS) invalidate the library's entry explicitly.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def stamp(lib):
+        """ The (mtime, size) of the library file, or None if it could not be read. """
+        try:
+            stat = os.stat(lib)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, lib, key):
+        """
+        Retrieve a cached value for a library.
+        :param lib: Absolute path to the .ssim library.
+        :param key: The type of metadata (e.g. 'datafeeds', 'projects', 'scenarios').
+        :return: The cached value, or None if there is no valid entry.
+        """
+        stamp = self.stamp(lib)
+        with self._lock:
+            entry = self._entries.get(lib)
+            if stamp is not None and entry is not None and entry['stamp'] == stamp and key in entry['values']:
+                self.hits += 1
+                return entry['values'][key]
+            self.misses += 1
+            return None
+
+    def set(self, lib, key, value, stamp):
+        """
+        Store a value for a library.
+        :param stamp: The library stamp taken *before* the value was collected, so that concurrent modifications
+        are never recorded against a newer stamp.
+        """
+        if stamp is None:
+            return
+        with self._lock:
+            entry = self._entries.get(lib)
+            if entry is None or entry['stamp'] != stamp:
+                entry = self._entries[lib] = {'stamp': stamp, 'values': {}}
+            entry['values'][key] = value
+
+    def invalidate(self, lib=None):
+        """ Drop the cached entry for a library, or for all libraries if no library is given. """
+        with self._lock:
+            if lib is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(lib, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'libraries': len(self._entries)}
+
+
+METADATA_CACHE = LibraryMetadataCache()
+
 
 class ConsoleMeta(type):
     """  Metaclass for handling the different console names, enforcing each console to specify a name """
@@ -34,27 +202,54 @@ class Console:
     def __init__(self, **kwargs):
         if 'lib_path' not in kwargs:
             raise ValueError("Invalid input params. Make sure to specify 'lib_path'")
+        self.command_log = CommandLog()
         self.prefix = 'mono' if os.name == 'posix' else ''
         self.sep = '\r\n' if os.name != 'posix' else '\n'
         exe = os.path.abspath((DEFAULT_EXE if 'exe' not in kwargs else kwargs['exe']))
         self.lib = os.path.abspath(kwargs['lib_path'])
         self.exe_lib = [exe, "--lib=" + self.lib]
 
-        # test working executable
-        try:
-            self.exec_command(["--version"])
-        except FileNotFoundError:
-            if exe == DEFAULT_EXE:
-                raise ValueError("The path to the default installation is not valid (" + DEFAULT_EXE + "), or the path"+
-                                 " provided for the exe was invalid")
-            else:
-                raise ValueError("The provided executable path for SyncroSim is invalid.\nProvided path was: " + exe)
+        # test working executable, once per executable for the lifetime of the process
+        if exe not in VERIFIED_EXECUTABLES:
+            try:
+                self.exec_command(["--version"])
+            except FileNotFoundError:
+                if exe == DEFAULT_EXE:
+                    raise ValueError("The path to the default installation is not valid (" + DEFAULT_EXE + "), or the "
+                                     "path provided for the exe was invalid")
+                else:
+                    raise ValueError("The provided executable path for SyncroSim is invalid.\nProvided path was: " + exe)
+            VERIFIED_EXECUTABLES.add(exe)
+
+        self.spatial_input_dir = self.lib + '.input'
+        self.spatial_output_dir = self.lib + '.output'
+
+        self.orig_lib = None
+        self.exe_orig_lib = None
+        if 'orig_lib_path' in kwargs:
+            self.orig_lib = os.path.abspath(kwargs['orig_lib_path'])
+            self.exe_orig_lib = [exe, "--lib=" + self.orig_lib]
+            self.spatial_orig_input_dir = self.orig_lib + '.input'
+            self.spatial_orig_output_dir = self.orig_lib + '.output'
+
+        # Library validation and spatial directory checks are deferred until the library is used (see prepare_library)
+
+    def __str__(self):
+        return self.lib
+
+    def prepare_library(self):
+        """
+        Validates the library paths and creates the spatial directories for each library and all existing scenarios.
+        This only runs once per process for each library, or again if the library has changed since it was prepared.
+        """
+        key = (self.lib, self.orig_lib)
+        stamp = METADATA_CACHE.stamp(self.lib)
+        if stamp is not None and PREPARED_LIBRARIES.get(key) == stamp:
+            return
 
         # test working library paths and create spatial directories for each library as needed
         try:
             self.list_datafeeds()
-            self.spatial_input_dir = self.lib + '.input'
-            self.spatial_output_dir = self.lib + '.output'
             if not os.path.exists(self.spatial_input_dir):
                 os.mkdir(self.spatial_input_dir)
             if not os.path.exists(self.spatial_output_dir):
@@ -62,14 +257,9 @@ class Console:
         except OSError:
             raise ValueError("The provided library path is invalid.\nProvided path was: " + self.lib)
 
-        self.exe_orig_lib = None
-        if 'orig_lib_path' in kwargs:
-            self.orig_lib = os.path.abspath(kwargs['orig_lib_path'])
-            self.exe_orig_lib = [exe, "--lib=" + self.orig_lib]
+        if self.exe_orig_lib is not None:
             try:
                 self.list_datafeeds(orig=True)
-                self.spatial_orig_input_dir = self.orig_lib + '.input'
-                self.spatial_orig_output_dir = self.orig_lib + '.output'
                 if not os.path.exists(self.spatial_orig_input_dir):
                     os.mkdir(self.spatial_orig_input_dir)
 
@@ -80,9 +270,7 @@ class Console:
 
         # verify that all the necessary directories exist for all the existing scenarios
         self.verify_spatial_directories()
-
-    def __str__(self):
-        return self.lib
+        PREPARED_LIBRARIES[key] = stamp
 
     def verify_spatial_directories(self):
         scenarios = self.list_scenarios()
@@ -117,6 +305,17 @@ class Console:
         :param orig: Use the original library to execute the command on.
         :return: subprocess object with stdout as a subprocess.PIPE (i.e. bytes) value.
         """
+        input_args = self._command_args(args, orig)
+        try:
+            result, wall_time, cpu_time, max_rss = run_command(input_args)
+        finally:
+            if any(x in args for x in MODIFYING_COMMANDS):
+                self.invalidate_metadata()
+        self.command_log.add(CommandRecord(args, wall_time, cpu_time, max_rss, result.returncode))
+        return result
+
+    def _command_args(self, args, orig=False):
+        """ Build the full process arguments for a SyncroSim command. """
         if orig and "--import" in args:
             raise KeyError("Command ignored - importing into original library will corrupt data.")
         input_args = list()
@@ -126,7 +325,26 @@ class Console:
             input_args.append(self.prefix)
         input_args += self.exe_orig_lib if orig else self.exe_lib
         input_args += args
-        return subprocess.run(input_args, stdout=subprocess.PIPE)
+        return input_args
+
+    def invalidate_metadata(self):
+        """ Drop any cached metadata for the working library. Call after modifying the library outside a Console. """
+        METADATA_CACHE.invalidate(self.lib)
+
+    def _list(self, kind, orig=False):
+        """
+        Executes a '--list' command, returning the cached output if the library has not changed since it was last run.
+        :param kind: The type of item to list (i.e. 'datafeeds', 'projects' or 'scenarios')
+        :param orig: Use the original library to execute the command on.
+        :return: The stdout (bytes) of the list command.
+        """
+        lib = self.orig_lib if orig else self.lib
+        output = METADATA_CACHE.get(lib, kind)
+        if output is None:
+            stamp = METADATA_CACHE.stamp(lib)
+            output = self.exec_command(["--list", "--" + kind], orig=orig).stdout
+            METADATA_CACHE.set(lib, kind, output, stamp)
+        return output
 
     def list_scenario_attrs(self, results_only=None, orig=False):
         """
@@ -136,8 +354,7 @@ class Console:
         :return: A list of dict objects with scenario information (name, sid, pid)
         """
 
-        args = ["--list", "--scenarios"]
-        output = self.exec_command(args, orig=orig).stdout.split(str.encode(self.sep))
+        output = self._list('scenarios', orig=orig).split(str.encode(self.sep))
         results = list()
         for line in output:
             if len(line.decode()) > 0:
@@ -169,8 +386,7 @@ class Console:
         :param orig: List results from the original library
         :return A list of scenario IDs from the library
         """
-        args = ["--list", "--scenarios"]
-        output = self.exec_command(args, orig=orig).stdout.split(str.encode(self.sep))
+        output = self._list('scenarios', orig=orig).split(str.encode(self.sep))
         results = list()
         for line in output:
             if len(line.decode()) > 0:
@@ -186,8 +402,7 @@ class Console:
         :param orig: Return results from the original library
         :return: jA list of project IDs from the library
         """
-        args = ["--list", "--projects"]
-        output = self.exec_command(args, orig=orig).stdout.decode().split(self.sep)
+        output = self._list('projects', orig=orig).decode().split(self.sep)
         results = dict()
         for line in output:
             if len(line) > 0:
@@ -201,8 +416,7 @@ class Console:
         :param orig: List results from the original library
         :return A list of available sheets from the given library
         """
-        args = ["--list", "--datafeeds"]
-        output = [x.split()[-1] for x in self.exec_command(args, orig=orig).stdout.decode().strip().split(self.sep)]
+        output = [x.split()[-1] for x in self._list('datafeeds', orig=orig).decode().strip().split(self.sep)]
         return output
 
     def run_model(self, sid):
@@ -211,6 +425,7 @@ class Console:
         :param sid: The scenario to run the model for.
         :return: The result scenario ID from this model run.
         """
+        self.prepare_library()
         if self.exe_orig_lib and str(sid) in self.list_scenarios(results_only=True):
             raise ValueError(str(sid) + ' is not an available scenario in the original (non-editable) library.')
 
@@ -225,6 +440,7 @@ class Console:
         :param sheet_name: The sheet to perform the action on.
         :param path: External file path to import from or export to.
         """
+        self.prepare_library()
         action = '--' + action
         args = [action, "--sheet=" + sheet_name, "--file=" + path]
         if sheet_name in self.list_datafeeds(orig=orig):
@@ -311,3 +527,114 @@ class STSimConsole(ReporterConsole):
     name = 'stsim'
 
 # Other consoles simply need to supply their name (i.e. 'stsim', 'stockflow', etc)
+
+
+def kill_process_group(process):
+    """ Kill a process started in its own session, along with any processes it started. """
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass    # Already exited
+
+
+class AsyncSTSimConsole(STSimConsole):
+    """
+    ST-Sim Console which runs commands with asyncio. Output is streamed line by line to an optional callback, commands
+    can be given a deadline, and cancelling a command kills the whole SyncroSim process group. Several commands can be
+    supervised concurrently from a single event loop (e.g. with asyncio.gather).
+    """
+
+    def __init__(self, timeout=None, on_line=None, **kwargs):
+        """
+        Constructor
+        :param timeout: (Optional) Default deadline, in seconds, for model runs executed with run_model().
+        :param on_line: (Optional) Default callback for each line of model run output, as a str.
+        """
+        self.timeout = timeout
+        self.on_line = on_line
+        super().__init__(**kwargs)
+
+    async def exec_command_async(self, args, orig=False, timeout=None, on_line=None):
+        """
+        Executes a command to SyncroSim without blocking the event loop.
+        :param args: The arguments provided to the console
+        :param orig: Use the original library to execute the command on.
+        :param timeout: (Optional) Seconds to wait before the command is killed and subprocess.TimeoutExpired raised.
+        :param on_line: (Optional) Called with each line of output (str, without line endings) as it is written.
+        :return: subprocess.CompletedProcess with stdout as bytes, as returned by exec_command.
+        """
+        input_args = self._command_args(args, orig)
+        loop = asyncio.get_event_loop()
+        start = perf_counter()
+
+        # The process is reaped with wait4 in an executor (rather than by the event loop's child watcher), so that its
+        # CPU time and peak memory are recorded as they are for synchronous commands.
+        process = subprocess.Popen(input_args, stdout=subprocess.PIPE, start_new_session=os.name == 'posix')
+        reader = asyncio.StreamReader(loop=loop)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader, loop=loop), process.stdout
+        )
+        exited = loop.run_in_executor(None, wait_process, process)
+
+        async def communicate():
+            lines = []
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                lines.append(line)
+                if on_line is not None:
+                    on_line(line.decode().rstrip())
+            await asyncio.shield(exited)
+            return b''.join(lines)
+
+        try:
+            stdout = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+            await exited
+            raise subprocess.TimeoutExpired(input_args, timeout)
+        except asyncio.CancelledError:
+            kill_process_group(process)
+            await exited
+            raise
+        finally:
+            transport.close()
+            if any(x in args for x in MODIFYING_COMMANDS):
+                self.invalidate_metadata()
+
+        cpu_time, max_rss = exited.result()
+        self.command_log.add(CommandRecord(args, perf_counter() - start, cpu_time, max_rss, process.returncode))
+        return subprocess.CompletedProcess(input_args, process.returncode, stdout=stdout)
+
+    async def run_model_async(self, sid, timeout=None, on_line=None):
+        """
+        Performs a model run without blocking the event loop.
+        :param sid: The scenario to run the model for.
+        :param timeout: (Optional) Seconds to wait before the run is killed and subprocess.TimeoutExpired raised.
+        :param on_line: (Optional) Called with each line of output from the run.
+        :return: The result scenario ID from this model run.
+        """
+        # Preparing the library and listing its scenarios run SyncroSim synchronously, so they are moved off the event
+        # loop to keep the output of other shards' runs streaming.
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.prepare_library)
+        if self.exe_orig_lib:
+            results = await loop.run_in_executor(None, lambda: self.list_scenarios(results_only=True))
+            if str(sid) in results:
+                raise ValueError(str(sid) + ' is not an available scenario in the original (non-editable) library.')
+
+        args = ["--run", "--sid=" + str(sid)]
+        result = await self.exec_command_async(args, timeout=timeout, on_line=on_line)
+        return result.stdout.strip().split()[-1].decode()
+
+    def run_model(self, sid):
+        """ Performs a model run, enforcing the console's default deadline and streaming output to its callback. """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.run_model_async(sid, timeout=self.timeout, on_line=self.on_line))
+        finally:
+            loop.close()
@@ -0,0 +1,211 @@
+"""
+    Working library pools.
+
+    All model runs for a library would otherwise share Library.file, so concurrent runs contend on a single SQLite
+    database and its .input/.output directories. A library may instead have a pool of working copies, cloned from
+    Library.orig_file, which are leased to one model run at a time.
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from shutil import copyfile, copytree, move, rmtree
+from time import sleep, time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from landscapesim.models import WorkingLibrary
+
+# Seconds to wait between attempts to lease a working library when all are in use
+LEASE_POLL_RATE = 2
+STSIM_LEASE_MAX_WAIT = getattr(settings, 'STSIM_LEASE_MAX_WAIT', 3600)  # Seconds to wait for a working library
+
+# Tables which hold the outputs of result scenarios. Other tables named STSim_Output* (e.g. STSim_OutputOptions) are
+# inputs, which the result scenario already has its own copy of.
+OUTPUT_TABLES = (
+    'STSim_OutputStratum',
+    'STSim_OutputStratumState',
+    'STSim_OutputStratumTransition',
+    'STSim_OutputStratumTransitionState',
+    'STSim_OutputStateAttribute',
+    'STSim_OutputTransitionAttribute'
+)
+
+
+def working_library_path(library, index):
+    """ The path of the index-th working copy of a library. """
+    return library.file.split('.ssim')[0] + '_work{}.ssim'.format(index)
+
+
+def create_working_libraries(library, count):
+    """
+    Clone the library's original file until the library has a pool of (at least) count working copies.
+    Spatial inputs for the library's scenarios are copied alongside each working copy.
+    :return: The list of WorkingLibrary instances that were created.
+    """
+    created = []
+    for index in range(library.working_libraries.count(), count):
+        path = working_library_path(library, index)
+        copyfile(library.orig_file, path)
+        if os.path.exists(library.file + '.input') and not os.path.exists(path + '.input'):
+            copytree(library.file + '.input', path + '.input')
+        created.append(WorkingLibrary.objects.create(library=library, index=index, file=path))
+    return created
+
+
+class LeaseTimeout(Exception):
+    """ Raised when no working library could be leased within STSIM_LEASE_MAX_WAIT seconds. """
+
+
+def release_stale_leases(library, active_task_ids):
+    """
+    Release leases held by jobs whose Celery tasks are no longer running (e.g. after a worker crashed), and leases
+    which no longer have a job (the job was deleted while it held the lease). Every lease is taken for a job.
+    :param active_task_ids: The IDs of the Celery tasks being executed by every worker.
+    """
+    stale = Q(job__isnull=True) | ~Q(job__celery_id__in=active_task_ids)
+    return library.working_libraries.filter(leased__isnull=False).filter(stale).update(job=None, leased=None)
+
+
+def _lease_free_libraries(library, count, job):
+    """ Lease up to count working copies which are not in use, without waiting. """
+    with transaction.atomic():
+        leased = list(library.working_libraries.select_for_update(skip_locked=True)
+                      .filter(leased__isnull=True).order_by('index')[:count])
+        for working_library in leased:
+            working_library.job = job
+            working_library.leased = timezone.now()
+            working_library.save()
+    return leased
+
+
+@contextmanager
+def lease_working_libraries(library, count, job, active_task_ids=None, max_wait=STSIM_LEASE_MAX_WAIT):
+    """
+    Lease up to count working copies of a library for the duration of the context. Waits until at least one copy is
+    available, then takes as many of the free copies as it can, so jobs never wait on each other's partial leases.
+    :param library: The Library to lease working copies of.
+    :param count: The maximum number of copies to lease.
+    :param job: The RunScenarioModel holding the leases. A lease without a job is treated as stale.
+    :param active_task_ids: (Optional) Returns the IDs of the running Celery tasks, or None if they are unknown. Used
+    to release leases held by jobs which are no longer running before waiting.
+    :param max_wait: (Optional) Seconds to wait for a copy before LeaseTimeout is raised.
+    :return: The list of leased WorkingLibrary instances, which is empty if the library has no working copies.
+    """
+    if not library.working_libraries.exists():
+        yield []
+        return
+
+    started = time()
+    leased = _lease_free_libraries(library, count, job)
+    while not leased:
+        task_ids = active_task_ids() if active_task_ids is not None else None
+        if task_ids is not None and release_stale_leases(library, task_ids):
+            leased = _lease_free_libraries(library, count, job)
+            continue
+        if max_wait is not None and time() - started > max_wait:
+            raise LeaseTimeout('No working copy of {} was available after {} seconds.'.format(library.name, max_wait))
+        sleep(LEASE_POLL_RATE)
+        leased = _lease_free_libraries(library, count, job)
+
+    try:
+        yield leased
+    finally:
+        for working_library in leased:
+            working_library.job = None
+            working_library.leased = None
+            working_library.save()
+
+
+def _output_tables(con, schema='main'):
+    """ The names of the output tables (see OUTPUT_TABLES) in a library. """
+    tables = {x[0] for x in con.execute("SELECT name FROM [{}].sqlite_master WHERE type = 'table'".format(schema))}
+    return [t for t in OUTPUT_TABLES if t in tables]
+
+
+def _table_columns(con, table, schema='main'):
+    """ The columns of a table, except an integer primary key (which SQLite assigns on insert). """
+    info = con.execute('PRAGMA [{}].table_info([{}])'.format(schema, table)).fetchall()
+    return [x[1] for x in info if not (x[5] and x[2].upper() == 'INTEGER')]
+
+
+def scenario_ids(lib):
+    """ The IDs of a library's scenarios, including result scenarios which only have an output directory so far. """
+    output_directory = lib + '.output'
+    sids = set()
+    if os.path.exists(output_directory):
+        sids.update(int(x.split('-')[1]) for x in os.listdir(output_directory) if x.startswith('Scenario-'))
+    con = sqlite3.connect(lib)
+    try:
+        sids.update(x[0] for x in con.execute('SELECT ScenarioID FROM SSim_Scenario'))
+    finally:
+        con.close()
+    return sids
+
+
+def delete_result_scenario(lib, sid):
+    """
+    Delete a (partial) result scenario from a library, e.g. when its model run was stopped or failed. Its rows are
+    removed from every table (including SSim_Scenario), along with its spatial input and output directories.
+    """
+    sid = int(sid)
+    con = sqlite3.connect(lib)
+    try:
+        with con:
+            for (table,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                if any(x[1] == 'ScenarioID' for x in con.execute('PRAGMA table_info([{}])'.format(table))):
+                    con.execute('DELETE FROM [{}] WHERE ScenarioID = ?'.format(table), (sid,))
+    finally:
+        con.close()
+
+    for directory in (lib + '.output', lib + '.input'):
+        rmtree(os.path.join(directory, 'Scenario-' + str(sid)), ignore_errors=True)
+
+
+def merge_result_scenario(lib, sid, source_lib, source_sid, min_iteration, max_iteration):
+    """
+    Merge the outputs of a result scenario from another library into a result scenario, e.g. when the iterations of
+    a model run were split between several working libraries. Output rows are copied (and removed from the source
+    library), and spatial outputs are moved into the result scenario's output directory. Output files are named by
+    iteration and timestep, so the results of disjoint iteration ranges never collide.
+    :param lib: Path to the library containing the result scenario to merge into.
+    :param sid: The result scenario to merge into.
+    :param source_lib: Path to the library containing the result scenario to merge from.
+    :param source_sid: The result scenario to merge from.
+    :param min_iteration: The first iteration of the merged result scenario.
+    :param max_iteration: The last iteration of the merged result scenario.
+    """
+    sid = int(sid)
+    source_sid = int(source_sid)
+
+    con = sqlite3.connect(lib)
+    try:
+        con.execute('ATTACH DATABASE ? AS source', (source_lib,))
+        with con:
+            for table in _output_tables(con, 'source'):
+                columns = _table_columns(con, table, 'source')
+                con.execute('INSERT INTO main.[{table}] ({columns}) SELECT {values} FROM source.[{table}] '
+                            'WHERE ScenarioID = ?'.format(
+                                table=table,
+                                columns=', '.join('[{}]'.format(c) for c in columns),
+                                values=', '.join('?' if c == 'ScenarioID' else '[{}]'.format(c) for c in columns)
+                            ), (sid, source_sid))
+                con.execute('DELETE FROM source.[{}] WHERE ScenarioID = ?'.format(table), (source_sid,))
+            con.execute('UPDATE main.STSim_RunControl SET MinimumIteration = ?, MaximumIteration = ? '
+                        'WHERE ScenarioID = ?', (min_iteration, max_iteration, sid))
+    finally:
+        con.close()
+
+    source_directory = os.path.join(source_lib + '.output', 'Scenario-' + str(source_sid))
+    directory = os.path.join(lib + '.output', 'Scenario-' + str(sid))
+    for root, _, files in os.walk(source_directory):
+        destination = os.path.join(directory, os.path.relpath(root, source_directory))
+        if not os.path.exists(destination):
+            os.makedirs(destination)
+        for filename in files:
+            move(os.path.join(root, filename), os.path.join(destination, filename))
+    if os.path.exists(source_directory):
+        rmtree(source_directory)
@@ -2,8 +2,11 @@ import sqlite3
 
 
 def ssim_query(smt, library):
-    """ Connect to a SyncroSim sqlite database, and execute a query and return data. """
-    with sqlite3.connect(library.file) as con:
+    """
+    Connect to a SyncroSim sqlite database, and execute a query and return data.
+    :param library: A Library instance, or the path to a .ssim file.
+    """
+    with sqlite3.connect(library if isinstance(library, str) else library.file) as con:
         cur = con.cursor()
         cur.execute(smt)
         data = cur.fetchall()
@@ -1,13 +1,19 @@
 import datetime
 import glob
+import multiprocessing
 import os
 import random
-import subprocess
 import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from shutil import copyfile
+from time import time
 
+import netCDF4
+import numpy
 import pyproj
-import xarray
+import rasterio
 from clover.geometry.bbox import BBox
+from clover.netcdf.crs import set_crs
 from clover.netcdf.describe import describe
 from clover.render.renderers.stretched import StretchedRenderer
 from clover.render.renderers.unique import UniqueValuesRenderer
@@ -20,7 +26,10 @@ from landscapesim import models
 from landscapesim.common.query import ssim_query
 
 NC_ROOT = getattr(settings, 'NC_SERVICE_DATA_ROOT')
-CLOVER_PATH = getattr(settings, 'CLOVER_PATH', None)
+STSIM_NETCDF_COMPLEVEL = getattr(settings, 'STSIM_NETCDF_COMPLEVEL', 4)  # zlib level for netCDF files, 0 to disable
+STSIM_NETCDF_JOBS = getattr(settings, 'STSIM_NETCDF_JOBS', 2)    # Worker processes for converting rasters, 1 to disable
+STSIM_NETCDF_MERGE_MEMORY = getattr(settings, 'STSIM_NETCDF_MERGE_MEMORY', 256 * 1024 ** 2)  # Bytes read at once
+STSIM_TIMESERIES_STORE = getattr(settings, 'STSIM_TIMESERIES_STORE', False)  # Also write stores for pixel histories
 
 CREATE_SERVICE_ERROR_MSG = "Error creating ncdjango service for {} in scenario {}, skipping..."
 CREATE_RENDERER_ERROR_MSG = "Error creating renderer for {vname}. Did you set ID values for your {vname} definitions?"
@@ -43,6 +52,20 @@ CTYPE_HASH = {'strata': 'str',
               'transition_groups': 'tg',
               'avg_annual_transition_probability': 'tgap'}
 
+# Raster outputs written by a run: (OutputOption field, output frequency field, raster class type)
+RASTER_OUTPUTS = (
+    ('raster_sc', 'raster_sc_t', 'sc'),
+    ('raster_tr', 'raster_tr_t', 'tg'),
+    ('raster_sa', 'raster_sa_t', 'sa'),
+    ('raster_ta', 'raster_ta_t', 'ta'),
+    ('raster_strata', 'raster_strata_t', 'str'),
+    ('raster_age', 'raster_age_t', 'age'),
+    ('raster_aatp', 'raster_aatp_t', 'tgap')
+)
+
+# Seconds an iteration's rasters must be unchanged before the iteration is considered written
+RASTER_SETTLE_TIME = 5
+
 # Sometimes we need to talk to the ssim dbs directly =)
 SSIM_TABLE = {'transition_groups': 'STSim_TransitionGroup',
               'state_attributes': 'STSim_StateAttributeType',
@@ -56,6 +79,278 @@ INNER_TABLE = {'transition_groups': models.TransitionGroup,
                'avg_annual_transition_probability': models.TransitionGroup}
 
 
+NETCDF_CHUNK_SIZE = 256
+
+# netCDF time values are days since TIME_ORIGIN, matching the time range of the ncdjango services
+TIME_ORIGIN = 'days since 2000-01-01 00:00:00'
+
+# Time series stores are chunked in tiles of this many cells square, with every iteration and timestep in each chunk
+TIMESERIES_TILE_SIZE = 16
+
+# The largest window (in cells square) which can be read from a time series store at once
+PIXEL_HISTORY_MAX_SIZE = 16
+
+
+def smallest_dtype(data, nodata=None):
+    """ The smallest integer dtype which can hold the values of an integer array, and its nodata value. """
+    values = [data.min(), data.max()] if data.size else [0]
+    if nodata is not None:
+        values.append(nodata)
+    return numpy.result_type(*[numpy.min_scalar_type(int(x)) for x in values])
+
+
+def geotiff_to_netcdf(paths, netcdf_out, variable_name, has_time=False, categorical=False):
+    """
+    Convert a GeoTIFF, or a stack of GeoTIFFs, to a CF-compliant netCDF file. Every raster must have the same grid.
+    :param paths: The GeoTIFFs to convert. A stack is written in the order given, one timestep per raster.
+    :param netcdf_out: Path to the netCDF file to create.
+    :param variable_name: The name of the netCDF variable.
+    :param has_time: Write the rasters along a time dimension (as a time series), rather than a single grid.
+    :param categorical: The rasters are class IDs (e.g. state classes), so store them in the smallest integer type.
+    """
+    if not paths or (len(paths) > 1 and not has_time):
+        raise ValueError("Expected one raster, or a time series of rasters, for {}.".format(variable_name))
+
+    with rasterio.open(paths[0]) as src:
+        height, width = src.height, src.width
+        crs, transform, nodata, dtype = src.crs, src.transform, src.nodata, numpy.dtype(src.dtypes[0])
+
+    # Read each raster directly into its slice of the stack
+    data = numpy.empty((len(paths), height, width), dtype=dtype)
+    for i, path in enumerate(paths):
+        with rasterio.open(path) as src:
+            if (src.height, src.width) != (height, width):
+                raise ValueError("{} does not have the same dimensions as {}.".format(path, paths[0]))
+            src.read(1, out=data[i])
+
+    if categorical and numpy.issubdtype(dtype, numpy.integer):
+        data = data.astype(smallest_dtype(data, nodata), copy=False)
+    if nodata is not None:
+        nodata = data.dtype.type(nodata)
+
+    # Rasters without a CRS (None, or an empty CRS) get projected-style x/y coordinates and no grid mapping
+    is_geographic = bool(crs) and crs.is_geographic
+    x_name, y_name = ('lon', 'lat') if is_geographic else ('x', 'y')
+    with netCDF4.Dataset(netcdf_out, 'w', format='NETCDF4') as dataset:
+        dataset.Conventions = 'CF-1.6'
+        if crs:
+            dataset.proj4 = crs.to_string()     # Carried through merges, and read by describe() before grid mappings
+        dataset.createDimension(y_name, height)
+        dataset.createDimension(x_name, width)
+        dimensions = (y_name, x_name)
+        chunk_sizes = (min(height, NETCDF_CHUNK_SIZE), min(width, NETCDF_CHUNK_SIZE))
+
+        if has_time:
+            dataset.createDimension('time', len(paths))
+            time = dataset.createVariable('time', 'i4', ('time',))
+            time.standard_name = 'time'
+            time.units = TIME_ORIGIN
+            time.calendar = 'standard'
+            time[:] = numpy.arange(len(paths))
+            dimensions = ('time',) + dimensions
+            chunk_sizes = (1,) + chunk_sizes
+
+        # Coordinates are cell centers
+        for name, size, origin, step, axis in ((x_name, width, transform.c, transform.a, 'X'),
+                                               (y_name, height, transform.f, transform.e, 'Y')):
+            coordinate = dataset.createVariable(name, 'f8', (name,))
+            coordinate.axis = axis
+            if is_geographic:
+                coordinate.standard_name = 'longitude' if axis == 'X' else 'latitude'
+                coordinate.units = 'degrees_east' if axis == 'X' else 'degrees_north'
+            else:
+                coordinate.standard_name = 'projection_x_coordinate' if axis == 'X' else 'projection_y_coordinate'
+                coordinate.units = 'm'
+            coordinate[:] = origin + (numpy.arange(size) + 0.5) * step
+
+        variable = dataset.createVariable(
+            variable_name, data.dtype, dimensions, zlib=STSIM_NETCDF_COMPLEVEL > 0,
+            complevel=STSIM_NETCDF_COMPLEVEL or 1, chunksizes=chunk_sizes, fill_value=nodata
+        )
+        variable[:] = data if has_time else data[0]
+
+        # A CF grid mapping variable (with grid_mapping_name and projection parameters), referenced by the variable
+        if crs:
+            try:
+                set_crs(dataset, variable_name, pyproj.Proj(crs.to_string()), set_proj4_att=True)
+            except (KeyError, ValueError):
+                variable.proj4 = crs.to_string()
+                print("No CF grid mapping for {}, only its proj4 string is written".format(crs.to_string()))
+
+
+def netcdf_slabs(variable, memory_limit):
+    """ Slices along the first dimension of a netCDF variable, each holding at most memory_limit bytes (or one row). """
+    if not variable.dimensions:
+        yield ()
+        return
+    length = variable.shape[0]
+    row_size = int(numpy.prod(variable.shape[1:])) * variable.dtype.itemsize
+    step = max(1, memory_limit // max(row_size, 1))
+    for i in range(0, length, step):
+        yield slice(i, min(i + step, length))
+
+
+def copy_netcdf_variable(variable, target, categorical=False, memory_limit=STSIM_NETCDF_MERGE_MEMORY):
+    """
+    Copy a netCDF variable to another dataset, compressed and chunked one step (or row) at a time.
+    :param variable: The source variable, with automatic masking and scaling disabled.
+    :param target: The netCDF4.Dataset to copy the variable to. It must already have the variable's dimensions.
+    :param categorical: The variable holds class IDs, so store it in the smallest integer type which holds them.
+    :param memory_limit: The maximum number of bytes to read at once.
+    """
+    attributes = {k: variable.getncattr(k) for k in variable.ncattrs()}
+    fill_value = attributes.pop('_FillValue', None)
+    dtype = variable.dtype
+
+    if categorical and numpy.issubdtype(dtype, numpy.integer) and dtype.itemsize > 1:
+        dtypes = [smallest_dtype(variable[x], fill_value) for x in netcdf_slabs(variable, memory_limit)]
+        dtype = numpy.result_type(*dtypes) if dtypes else dtype
+        if fill_value is not None:
+            fill_value = dtype.type(fill_value)
+
+    chunk_sizes = None
+    if len(variable.dimensions) > 1:
+        chunk_sizes = [1] * (len(variable.shape) - 2) + [min(x, NETCDF_CHUNK_SIZE) for x in variable.shape[-2:]]
+
+    compress = STSIM_NETCDF_COMPLEVEL > 0 and bool(variable.dimensions)     # Scalars (e.g., crs) can't be compressed
+    copy = target.createVariable(
+        variable.name, dtype, variable.dimensions, zlib=compress, complevel=STSIM_NETCDF_COMPLEVEL or 1,
+        shuffle=compress, chunksizes=chunk_sizes, fill_value=fill_value
+    )
+    copy.set_auto_maskandscale(False)
+    copy.setncatts(attributes)
+    for slab in netcdf_slabs(variable, memory_limit):
+        copy[slab] = variable[slab].astype(dtype, copy=False)
+
+
+def write_timeseries_store(netcdf_in, netcdf_out, memory_limit=STSIM_NETCDF_MERGE_MEMORY):
+    """
+    Write a companion to a time series service's netCDF file, laid out for reading the history of a pixel. Each series
+    (the variables of the service which differ only by iteration, e.g. stateclasses-1, stateclasses-2, ...) is stored
+    as a single (iteration, time, y, x) variable, chunked in small tiles holding every iteration and timestep.
+    :param netcdf_in: The service's netCDF file.
+    :param netcdf_out: Path to the time series store to create.
+    :param memory_limit: The maximum number of bytes to read at once (at least one row of tiles is always read).
+    """
+    with netCDF4.Dataset(netcdf_in) as source:
+        source.set_auto_maskandscale(False)
+        series = {}
+        for name, variable in source.variables.items():
+            if len(variable.dimensions) == 3:
+                prefix, iteration = name.rsplit('-', 1)
+                series.setdefault(prefix, {})[int(iteration)] = variable
+        if not series:
+            raise ValueError("{} has no time series variables.".format(netcdf_in))
+
+        iterations = sorted({x for variables in series.values() for x in variables})
+        time_name, y_name, x_name = next(iter(next(iter(series.values())).values())).dimensions
+        steps, height, width = [len(source.dimensions[x]) for x in (time_name, y_name, x_name)]
+        chunk_sizes = (len(iterations), steps, min(height, TIMESERIES_TILE_SIZE), min(width, TIMESERIES_TILE_SIZE))
+
+        # Write to a temporary file, so the store can be replaced while it is being read
+        tmp_out = netcdf_out + '.tmp'
+        with netCDF4.Dataset(tmp_out, 'w', format='NETCDF4') as target:
+            target.setncatts({k: source.getncattr(k) for k in source.ncattrs()})
+            target.createDimension('iteration', len(iterations))
+            for name in (time_name, y_name, x_name):
+                target.createDimension(name, len(source.dimensions[name]))
+            for name, variable in source.variables.items():
+                if name in (time_name, y_name, x_name) or not variable.dimensions:  # Coordinates and grid mappings
+                    copy_netcdf_variable(variable, target)
+            iteration = target.createVariable('iteration', 'i4', ('iteration',))
+            iteration[:] = iterations
+
+            for name, variables in sorted(series.items()):
+                first = next(iter(variables.values()))
+                attributes = {k: first.getncattr(k) for k in first.ncattrs()}
+                fill_value = attributes.pop('_FillValue', None)
+                dtype = numpy.result_type(*[x.dtype for x in variables.values()])
+
+                variable = target.createVariable(
+                    name, dtype, ('iteration', time_name, y_name, x_name), zlib=STSIM_NETCDF_COMPLEVEL > 0,
+                    complevel=STSIM_NETCDF_COMPLEVEL or 1, shuffle=True, chunksizes=chunk_sizes,
+                    fill_value=None if fill_value is None else dtype.type(fill_value)
+                )
+                variable.set_auto_maskandscale(False)
+                variable.setncatts(attributes)
+
+                # Read bands of whole tile rows, from every iteration, to rearrange them into tiles
+                row_size = len(iterations) * steps * width * dtype.itemsize
+                rows = max(memory_limit // max(row_size, 1) // chunk_sizes[2], 1) * chunk_sizes[2]
+                for y in range(0, height, rows):
+                    band = slice(y, min(y + rows, height))
+                    data = numpy.full(
+                        (len(iterations), steps, band.stop - band.start, width), fill_value or 0, dtype=dtype
+                    )
+                    for i, iteration in enumerate(iterations):
+                        if iteration in variables:
+                            data[i] = variables[iteration][:, band, :]
+                    variable[:, :, band, :] = data
+
+    os.replace(tmp_out, netcdf_out)
+
+
+def read_pixel_history(path, series, x, y, size=1):
+    """
+    Read every iteration and timestep of a pixel, or of a small window centered on it, from a time series store.
+    :param path: Path to the time series store (see write_timeseries_store).
+    :param series: The series to read, e.g. 'stateclasses', or 'transition_groups-<id>'.
+    :param x: The x coordinate of the pixel, in the projection of the data.
+    :param y: The y coordinate of the pixel, in the projection of the data.
+    :param size: The width (and height) of the window to read, in cells.
+    :return: A dict with the iterations, the coordinates of the center cell, and the values, indexed by
+    [iteration][timestep][row][column]. Cells without data are None.
+    """
+    if not 0 < size <= PIXEL_HISTORY_MAX_SIZE:
+        raise ValueError("The window size must be between 1 and {}.".format(PIXEL_HISTORY_MAX_SIZE))
+
+    with netCDF4.Dataset(path) as dataset:
+        if series not in dataset.variables or len(dataset.variables[series].dimensions) != 4:
+            raise KeyError("There is no time series for {}.".format(series))
+        variable = dataset.variables[series]
+        _, _, y_name, x_name = variable.dimensions
+
+        cells = []
+        for name, value in ((y_name, y), (x_name, x)):
+            coordinates = dataset.variables[name][:]
+            index = int(numpy.abs(coordinates - value).argmin())
+            cell_size = abs(coordinates[1] - coordinates[0]) if len(coordinates) > 1 else 0
+            if abs(coordinates[index] - value) > cell_size / 2:
+                raise ValueError("({}, {}) is outside the extent of the data.".format(x, y))
+            start = max(index - size // 2, 0)
+            cells.append((index, slice(start, min(start + size, len(coordinates)))))
+        (row, rows), (column, columns) = cells
+
+        return {
+            'iterations': dataset.variables['iteration'][:].tolist(),
+            'x': float(dataset.variables[x_name][column]),
+            'y': float(dataset.variables[y_name][row]),
+            'values': variable[:, :, rows, columns].tolist()    # Masked cells (e.g. nodata) are None
+        }
+
+
+def convert_raster(conversion):
+    """
+    Convert a GeoTIFF (stack) to netCDF. Runs in a worker process.
+    :param conversion: A tuple of (geotiff_file_or_pattern, netcdf_out, variable_name, categorical).
+    :return: The netCDF path and the time taken to convert it.
+    """
+    start = time()
+    ServiceGenerator.convert_to_netcdf(*conversion)
+    return conversion[1], time() - start
+
+
+def can_start_processes():
+    """ Daemonic processes, such as Celery's prefork pool workers, are not allowed to start child processes. """
+    if multiprocessing.current_process().daemon:
+        return False
+    try:
+        import billiard     # Celery's fork of multiprocessing, which tracks its own pool processes
+    except ImportError:
+        return True
+    return not billiard.current_process().daemon
+
+
 # Sanity check for creating ncdjango services correctly
 def has_nc_root(func):
     def wrapper(*args, **kwargs):
@@ -72,6 +367,17 @@ class ServiceGenerator:
     def __init__(self, scenario):
         self.scenario = scenario
 
+    @property
+    def data_directory(self):
+        """ The directory for the scenario's netcdf files, relative to NC_ROOT. """
+        return os.path.join(
+            self.scenario.project.library.name, self.scenario.project.name, 'Scenario-' + str(self.scenario.sid)
+        )
+
+    def timeseries_store_path(self, variable_name):
+        """ Absolute path to the time series store for an output service (see write_timeseries_store). """
+        return os.path.join(NC_ROOT, self.data_directory, 'output', variable_name + '.timeseries.nc')
+
     @staticmethod
     def generate_unique_renderer(values, randomize_colors=False):
         if randomize_colors:
@@ -102,7 +408,7 @@ class ServiceGenerator:
         ])
 
     def generate_service(self, filename_or_pattern, variable_name, unique=True, has_colormap=True,
-                         model_set=None, model_id_lookup=None,):
+                         model_set=None, model_id_lookup=None, service=None, only_iterations=None):
         """
         Creates an ncdjango service from a geotiff (stack).
         :param filename_or_pattern: A local filename or glob pattern.
@@ -111,15 +417,15 @@ class ServiceGenerator:
         :param has_colormap: Indicate whether the service has a colormap or not.
         :param model_set: The Queryset to filter over.
         :param model_id_lookup: A unique identifier used for specific datasets.
-        :return: One (1) ncdjango service.
+        :param service: (Optional) An existing time series service to add the variables of new iterations to.
+        :param only_iterations: (Optional) Only add variables for these iterations of a time series.
+        :return: One (1) ncdjango service, or None if there are no rasters for it yet.
         """
 
         has_time = '*' in filename_or_pattern   # pattern if true, filename otherwise
 
         # Construct relative path for new netcdf file, relative to NC_ROOT. Used as 'data_path' in ncdjango.Service
-        nc_rel_path = os.path.join(
-            self.scenario.project.library.name, self.scenario.project.name, 'Scenario-' + str(self.scenario.sid)
-        )
+        nc_rel_path = self.data_directory
         if has_time:
             nc_rel_path = os.path.join(nc_rel_path, 'output', variable_name + '.nc')
         else:
@@ -131,11 +437,12 @@ class ServiceGenerator:
             os.makedirs(os.path.dirname(nc_full_path))
 
         variable_names = []
+        existing_names = set(service.variable_set.values_list('variable', flat=True)) if service else set()
 
         # No patterns, so create a simple input raster
         if not has_time:
             self.convert_to_netcdf(
-                os.path.join(self.scenario.input_directory, filename_or_pattern), nc_full_path, variable_name
+                os.path.join(self.scenario.input_directory, filename_or_pattern), nc_full_path, variable_name, unique
             )
 
         # Time series output pattern, convert to timeseries netcdf
@@ -147,12 +454,15 @@ class ServiceGenerator:
             iterations = []
             timesteps = []
             ssim_ids = []
+            conversions = []
 
             glob_pattern = glob.glob(os.path.join(self.scenario.output_directory, filename_or_pattern))
             glob_pattern.sort()
             for f in glob_pattern:
 
                 it, ts, *ctype_id = f[:-4].split(os.sep)[-1].split('-')
+                if only_iterations is not None and int(it[2:]) not in only_iterations:
+                    continue
 
                 if it not in iterations:
                     iterations.append(it)   # E.g. ['It0001','It0002', ...]
@@ -203,10 +513,12 @@ class ServiceGenerator:
                         id=pattern_id,
                         iteration=iteration_num
                     )
+                    if iteration_var_name in existing_names:
+                        continue
                     variable_names.append(iteration_var_name)
                     iteration_nc_file = os.path.join(self.scenario.output_directory,
                                                      iteration_var_name + '.nc')
-                    self.convert_to_netcdf(pattern, iteration_nc_file, iteration_var_name)
+                    conversions.append((pattern, iteration_nc_file, iteration_var_name, unique))
 
                 merge_nc_pattern = os.path.join(self.scenario.output_directory, variable_name + '-*-*.nc')
 
@@ -222,12 +534,21 @@ class ServiceGenerator:
                     iteration_num = int(pattern.split(os.sep)[-1].split('-')[0][2:])
                     iteration_var_name = '{variable_name}-{iteration}'.format(variable_name=variable_name,
                                                                               iteration=iteration_num)
+                    if iteration_var_name in existing_names:
+                        continue
                     variable_names.append(iteration_var_name)
                     iteration_nc_file = os.path.join(self.scenario.output_directory,
                                                      iteration_var_name + '.nc')
-                    self.convert_to_netcdf(pattern, iteration_nc_file, iteration_var_name)
+                    conversions.append((pattern, iteration_nc_file, iteration_var_name, unique))
+
+            if not conversions:
+                return service
 
-            self.merge_netcdf(merge_nc_pattern, nc_full_path)
+            # Every iteration must be converted before the iterations are merged (or added to the existing service)
+            self.convert_rasters(conversions)
+            self.merge_netcdf(merge_nc_pattern, nc_full_path, categorical=unique, append=service is not None)
+            if STSIM_TIMESERIES_STORE:
+                write_timeseries_store(nc_full_path, self.timeseries_store_path(variable_name))
 
         info = describe(nc_full_path)
         grid = info['variables'][variable_names[0] if len(variable_names) else variable_name]['spatial_grid']['extent']
@@ -248,15 +569,19 @@ class ServiceGenerator:
             t_end = t_start + datetime.timedelta(1) * steps_per_variable
 
         try:
-            service = Service.objects.create(
-                name=uuid.uuid4(),
-                data_path=nc_rel_path,
-                projection=grid['proj4'],
-                full_extent=extent,
-                initial_extent=extent
-            )
+            if service is not None:
+                offset = service.variable_set.count()
+            else:
+                offset = 0
+                service = Service.objects.create(
+                    name=uuid.uuid4(),
+                    data_path=nc_rel_path,
+                    projection=grid['proj4'],
+                    full_extent=extent,
+                    initial_extent=extent
+                )
 
-            if has_time and len(variable_names) and steps_per_variable:
+            if has_time and len(variable_names) and steps_per_variable and not offset:
 
                 # Set required time fields
                 service.supports_time = True
@@ -282,12 +607,17 @@ class ServiceGenerator:
             else:
                 renderer = self.generate_stretched_renderer(info)
 
+                # The value range may have grown with the new iterations
+                for variable in service.variable_set.all():
+                    variable.renderer = renderer
+                    variable.save()
+
             if has_time and len(variable_names):
 
                 for name in variable_names:
                     Variable.objects.create(
                         service=service,
-                        index=variable_names.index(name),
+                        index=offset + variable_names.index(name),
                         variable=name,
                         projection=grid['proj4'],
                         x_dimension=x,
@@ -321,32 +651,103 @@ class ServiceGenerator:
             raise Error(CREATE_SERVICE_ERROR_MSG.format(variable_name, self.scenario.sid))
 
     @staticmethod
-    def convert_to_netcdf(geotiff_file_or_pattern, netcdf_out, variable_name):
+    def convert_to_netcdf(geotiff_file_or_pattern, netcdf_out, variable_name, categorical=False):
         """
         Convert input rasters to netcdf for use in ncdjango
-        :param geotiff_file_or_pattern: Absolute path (or pattern of paths) to geotiff(s) to convert to netCDF
+        :param geotiff_file_or_pattern: Absolute path (or pattern of paths) to geotiff(s) to convert to netCDF. A
+        pattern is converted to a time series, ordered by file name (i.e. by timestep).
         :param netcdf_out: Absolute path to netCDF file.
         :param variable_name: The variable name.
+        :param categorical: The rasters are class IDs, rather than continuous values.
         """
+        has_time = '*' in geotiff_file_or_pattern
+        paths = sorted(glob.glob(geotiff_file_or_pattern)) if has_time else [geotiff_file_or_pattern]
+        geotiff_to_netcdf(paths, netcdf_out, variable_name, has_time=has_time, categorical=categorical)
 
-        try:
-            subprocess.run(
-                [CLOVER_PATH if CLOVER_PATH else "clover", "to_netcdf", geotiff_file_or_pattern, netcdf_out,
-                 variable_name]
-            )
-        except:
-            raise subprocess.SubprocessError("Failed calling clover. Did you setup clover correctly?")
+    @staticmethod
+    def convert_rasters(conversions, jobs=STSIM_NETCDF_JOBS):
+        """
+        Convert several GeoTIFF stacks to netCDF, across a pool of worker processes. Conversions run one at a time
+        in processes which cannot start a pool (e.g. a Celery prefork worker).
+        :param conversions: A list of (geotiff_file_or_pattern, netcdf_out, variable_name, categorical) tuples.
+        :param jobs: The maximum number of conversions to run at once.
+        """
+        start = time()
+        jobs = min(jobs, len(conversions), os.cpu_count() or 1)
+        if jobs > 1 and not can_start_processes():
+            print("Converting rasters in this process, since it cannot start worker processes")
+            jobs = 1
+        if jobs < 2:
+            results = [convert_raster(x) for x in conversions]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(convert_raster, x) for x in conversions]
+                results = [x.result() for x in as_completed(futures)]
+        for netcdf_out, elapsed in results:
+            print("Converted {} ({:.1f}s)".format(os.path.basename(netcdf_out), elapsed))
+        print("Converted {} rasters to netCDF ({} jobs, {:.1f}s)".format(
+            len(conversions), max(jobs, 1), time() - start
+        ))
 
     @staticmethod
-    def merge_netcdf(pattern, out):
+    def merge_netcdf(pattern, out, categorical=False, memory_limit=STSIM_NETCDF_MERGE_MEMORY, remove_inputs=True,
+                     append=False):
         """
-        Merges a list of netcdf files with different variables and same dimensions into a single netcdf file.
+        Merges a list of netcdf files with different variables and same dimensions into a single netcdf file. Variables
+        are copied one at a time, in slabs along their first dimension, so at most memory_limit bytes are held at once.
         :param pattern: glob.glob pattern (not necessarily a regex)
         :param out: Path to the created netcdf file
+        :param categorical: The variables are class IDs, so store them in the smallest integer type.
+        :param memory_limit: The maximum number of bytes to read from the input files at once.
+        :param remove_inputs: Delete the input files once they are merged.
+        :param append: Add the variables to an existing netcdf file, with the same dimensions, rather than creating it.
+        The file may be in use by a service, so the variables are added to a copy which then replaces the file.
         """
-        glob_pattern = glob.glob(pattern)
-        glob_pattern.sort()
-        xarray.open_mfdataset(glob_pattern).to_netcdf(out)  # using open_mfdataset prevents issues with file handles
+        start = time()
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            raise ValueError("No netCDF files match {}.".format(pattern))
+
+        # netCDF4 files can't be written while they are being read, so write to a temporary file next to the target
+        tmp_out = out + '.tmp'
+        if append:
+            copyfile(out, tmp_out)
+        try:
+            ServiceGenerator._merge_netcdf_files(paths, pattern, tmp_out, categorical, memory_limit, append)
+            os.replace(tmp_out, out)
+        finally:
+            if os.path.exists(tmp_out):
+                os.remove(tmp_out)
+
+        if remove_inputs:
+            for path in paths:
+                os.remove(path)
+        print("Merged {} netCDF files into {} ({:.1f}s)".format(len(paths), os.path.basename(out), time() - start))
+
+    @staticmethod
+    def _merge_netcdf_files(paths, pattern, out, categorical, memory_limit, append):
+        """ Copy the variables of several netCDF files into one (see merge_netcdf). """
+        with netCDF4.Dataset(out, 'a' if append else 'w', format='NETCDF4') as target:
+            for i, path in enumerate(paths):
+                with netCDF4.Dataset(path) as source:
+                    source.set_auto_maskandscale(False)     # Copy the stored values, rather than masked floats
+                    if i == 0 and not append:
+                        target.setncatts({k: source.getncattr(k) for k in source.ncattrs()})
+                        for name, dimension in source.dimensions.items():
+                            target.createDimension(name, len(dimension))
+                    elif any(n not in target.dimensions or len(d) != len(target.dimensions[n])
+                             for n, d in source.dimensions.items()):
+                        raise ValueError("{} does not have the same dimensions as {}.".format(path, out))
+
+                    for name, variable in source.variables.items():
+                        is_data = len(variable.dimensions) > 1
+                        if name in target.variables:
+                            if is_data:
+                                raise ValueError("Variable {} is in more than one file matching {}.".format(
+                                    name, pattern
+                                ))
+                            continue    # Coordinates and grid mappings are shared by every file
+                        copy_netcdf_variable(variable, target, categorical and is_data, memory_limit)
 
     @has_nc_root
     def create_input_services(self):
@@ -372,51 +773,107 @@ class ServiceGenerator:
 
         sis.save()
 
+    def completed_iterations(self, min_timestep, max_timestep, output_options):
+        """
+        The iterations which a model run, which may still be going, has written every raster for. Iterations may finish
+        in any order, so each one is checked for every timestep at which its enabled raster outputs are written, and
+        its rasters must not have changed for RASTER_SETTLE_TIME seconds.
+        :param min_timestep: The first timestep of the run.
+        :param max_timestep: The last timestep of the run.
+        :param output_options: The OutputOption of the run.
+        """
+        expected = {}
+        for enabled, frequency, ctype in RASTER_OUTPUTS:
+            if getattr(output_options, enabled):
+                step = max(getattr(output_options, frequency) or 1, 1)
+                expected[ctype] = set(range(min_timestep, max_timestep + 1, step)) | {max_timestep}
+
+        directory = self.scenario.output_directory
+        if not expected or not os.path.exists(directory):
+            return set()
+
+        # Timesteps written for each iteration and raster type, and when each iteration's rasters last changed
+        written = {}
+        modified = {}
+        for filename in os.listdir(directory):
+            if not (filename.startswith('It') and filename.endswith('.tif')):
+                continue
+            it, ts, ctype = filename[:-4].split('-')[:3]
+            iteration = int(it[2:])
+            written.setdefault((iteration, ctype), set()).add(int(ts[2:]))
+            modified[iteration] = max(modified.get(iteration, 0), os.path.getmtime(os.path.join(directory, filename)))
+
+        settled = time() - RASTER_SETTLE_TIME
+        return {
+            iteration for iteration, last_modified in modified.items() if last_modified < settled and all(
+                timesteps <= written.get((iteration, ctype), set()) for ctype, timesteps in expected.items()
+            )
+        }
+
     @has_nc_root
-    def create_output_services(self):
-        """ Generates a set of ncdjango services and time-series variables to associate with a scenario. """
+    def create_output_services(self, iterations=None, output_options=None):
+        """
+        Generates a set of ncdjango services and time-series variables to associate with a scenario. If the scenario
+        already has output services, variables for iterations they don't have yet are added to them.
+        :param iterations: (Optional) Only add these iterations, e.g. those completed by a model run still going.
+        :param output_options: (Optional) The OutputOption of the run, if the scenario's hasn't been imported yet.
+        """
 
         assert self.scenario.is_result   # sanity check
 
-        sos = models.ScenarioOutputServices.objects.create(scenario=self.scenario)
-        oo = self.scenario.output_options
+        sos, _ = models.ScenarioOutputServices.objects.get_or_create(scenario=self.scenario)
+        oo = output_options or self.scenario.output_options
 
         # State Classes
         if oo.raster_sc:
-            sos.stateclass = self.generate_service('It*-Ts*-sc.tif', 'stateclasses')
+            sos.stateclass = self.generate_service(
+                'It*-Ts*-sc.tif', 'stateclasses', service=sos.stateclass, only_iterations=iterations
+            )
 
         # Transition Groups
         if oo.raster_tr:
             sos.transition_group = self.generate_service(
                 'It*-Ts*-tg-*.tif', 'transition_groups', has_colormap=False,
-                model_set=self.scenario.project.transition_types, model_id_lookup='transition_type_id'
+                model_set=self.scenario.project.transition_types, model_id_lookup='transition_type_id',
+                service=sos.transition_group, only_iterations=iterations
             )
 
         # State Attributes
         if oo.raster_sa:
-            sos.state_attribute = self.generate_service('It*-Ts*-sa-*.tif', 'state_attributes', unique=False)
+            sos.state_attribute = self.generate_service(
+                'It*-Ts*-sa-*.tif', 'state_attributes', unique=False, service=sos.state_attribute,
+                only_iterations=iterations
+            )
 
         # Transition Attributes
         if oo.raster_ta:
-            sos.transition_attribute = self.generate_service('It*-Ts*-ta-*.tif', 'transition_attributes', unique=False)
+            sos.transition_attribute = self.generate_service(
+                'It*-Ts*-ta-*.tif', 'transition_attributes', unique=False, service=sos.transition_attribute,
+                only_iterations=iterations
+            )
 
         # Strata
         if oo.raster_strata:
-            sos.stratum = self.generate_service('It*-Ts*-str.tif', 'strata')
+            sos.stratum = self.generate_service(
+                'It*-Ts*-str.tif', 'strata', service=sos.stratum, only_iterations=iterations
+            )
 
         # Age
         if oo.raster_age:
-            sos.age = self.generate_service('It*-Ts*-age.tif', 'age', unique=False)
+            sos.age = self.generate_service(
+                'It*-Ts*-age.tif', 'age', unique=False, service=sos.age, only_iterations=iterations
+            )
 
         # Time since transition
-        if oo.raster_tst:
+        if oo.raster_tst and iterations is None:
             # TODO - implement RasterOutputTST (find use case first)
             print("RasterOutputTST not implemented yet. For now, please disable this output option.")
 
         # Average annual transition group probability
         if oo.raster_aatp:
             sos.avg_annual_transition_group_probability = self.generate_service(
-                'It*-Ts*-tgap-*.tif', 'avg_annual_transition_probability', unique=False
+                'It*-Ts*-tgap-*.tif', 'avg_annual_transition_probability', unique=False,
+                service=sos.avg_annual_transition_group_probability, only_iterations=iterations
             )
 
         sos.save()
@@ -0,0 +1,264 @@
+"""
+    Direct readers and writers for SyncroSim datafeed tables.
+
+    A .ssim library is a SQLite database, so most sheets can be read without starting a SyncroSim process. Rows are
+    returned in the same shape as a SyncroSim CSV export: keyed by the SyncroSim column names used in
+    landscapesim.common.config, with all values as strings, ID columns resolved to the names of the definitions they
+    reference, and booleans written as 'Yes' or ''. Writers accept rows in the same shape.
+"""
+
+import sqlite3
+from collections import defaultdict
+
+from landscapesim.common import config
+from landscapesim.common.types import empty_or_yes_to_bool
+
+# Maps SyncroSim ID columns to the (table, primary key) they reference. Values are resolved to the 'Name' column.
+_stratum = ('STSim_Stratum', 'StratumID')
+_stateclass = ('STSim_StateClass', 'StateClassID')
+_distribution_type = ('Stats_DistributionType', 'DistributionTypeID')
+ID_COLUMN_TABLES = {
+    'StratumID': _stratum,
+    'StratumIDSource': _stratum,
+    'StratumIDDest': _stratum,
+    'SecondaryStratumID': ('STSim_SecondaryStratum', 'SecondaryStratumID'),
+    'StateClassID': _stateclass,
+    'StateClassIDSource': _stateclass,
+    'StateClassIDDest': _stateclass,
+    'EndStateClassID': _stateclass,
+    'StateLabelXID': ('STSim_StateLabelX', 'StateLabelXID'),
+    'StateLabelYID': ('STSim_StateLabelY', 'StateLabelYID'),
+    'TransitionGroupID': ('STSim_TransitionGroup', 'TransitionGroupID'),
+    'TransitionTypeID': ('STSim_TransitionType', 'TransitionTypeID'),
+    'TransitionMultiplierTypeID': ('STSim_TransitionMultiplierType', 'TransitionMultiplierTypeID'),
+    'AttributeGroupID': ('STSim_AttributeGroup', 'AttributeGroupID'),
+    'StateAttributeTypeID': ('STSim_StateAttributeType', 'StateAttributeTypeID'),
+    'TransitionAttributeTypeID': ('STSim_TransitionAttributeType', 'TransitionAttributeTypeID'),
+    'DistributionTypeID': _distribution_type,
+    'DistributionType': _distribution_type,
+}
+
+# Maps ST-Sim report names to the output tables they are generated from.
+REPORT_TABLES = {
+    'stateclass-summary': ('STSim_OutputStratumState', config.STATECLASS_SUMMARY_ROW),
+    'transition-summary': ('STSim_OutputStratumTransition', config.TRANSITION_SUMMARY_ROW),
+    'transition-stateclass-summary': ('STSim_OutputStratumTransitionState', config.TRANSITION_STATECLASS_SUMMARY_ROW),
+    'state-attributes': ('STSim_OutputStateAttribute', config.STATE_ATTRIBUTE_SUMMARY_ROW),
+    'transition-attributes': ('STSim_OutputTransitionAttribute', config.TRANSITION_ATTRIBUTE_SUMMARY_ROW),
+}
+
+# Report columns which are calculated by SyncroSim when the report is created, rather than stored.
+_landscape_proportion = 'ProportionOfLandscape'
+_stratum_proportion = 'ProportionOfStratumID'
+CALCULATED_REPORT_COLUMNS = (_landscape_proportion, _stratum_proportion)
+
+REPORT_BATCH_SIZE = 10000   # Report rows fetched from a library at a time
+
+
+def format_value(value, is_bool=False):
+    """ Format a SQLite value the same way SyncroSim does when exporting to CSV. """
+    if is_bool:
+        return 'Yes' if value else ''
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class SheetReader:
+    """ Reads datafeed and output tables directly from the library used by a Console. """
+
+    def __init__(self, console):
+        self.console = console
+
+    def _library(self, orig=False):
+        lib = self.console.orig_lib if orig else self.console.lib
+        if lib is None:
+            raise ValueError("The console has no original library.")
+        return lib
+
+    @staticmethod
+    def build_query(table, columns, filter_column):
+        """
+        Build a SELECT for the given SyncroSim columns, joining ID columns with the tables they reference.
+        :param table: The SyncroSim table to read from.
+        :param columns: The SyncroSim column names to select, in order.
+        :param filter_column: The column to filter rows on (i.e. 'ProjectID' or 'ScenarioID').
+        :return: The SQL statement, taking a single parameter for the filter value.
+        """
+        selects = []
+        joins = []
+        for i, column in enumerate(columns):
+            reference = ID_COLUMN_TABLES.get(column)
+            if reference is None or reference[0] == table:
+                selects.append('t.[{}]'.format(column))
+            else:
+                ref_table, ref_pk = reference
+                alias = 'j{}'.format(i)
+                selects.append('{}.Name'.format(alias))
+                joins.append('LEFT JOIN [{table}] AS {alias} ON t.[{column}] = {alias}.[{pk}]'.format(
+                    table=ref_table, alias=alias, column=column, pk=ref_pk
+                ))
+        return 'SELECT {} FROM [{}] AS t {} WHERE t.[{}] = ? ORDER BY t.rowid'.format(
+            ', '.join(selects), table, ' '.join(joins), filter_column
+        )
+
+    def _execute(self, lib, query, params):
+        with sqlite3.connect(lib) as con:
+            return con.execute(query, params).fetchall()
+
+    def read_sheet(self, sheet_name, sheet_map, type_map, sid=None, pid=None, orig=False):
+        """
+        Read a project or scenario sheet.
+        :param sheet_name: The SyncroSim datafeed name (e.g. 'STSim_Transition').
+        :param sheet_map: The name mapping (see landscapesim.common.config)
+        :param type_map: Type conversions for the sheet. Used to determine which columns are booleans.
+        :param sid: Scenario ID to read the sheet for.
+        :param pid: Project ID to read the sheet for. Takes precedence over the scenario ID.
+        :param orig: Read from the original library.
+        :return: A list of dicts, keyed by SyncroSim column names.
+        """
+        columns = [x[1] for x in sheet_map]
+        if pid is not None:
+            filter_column, filter_value = 'ProjectID', int(pid)
+        elif sid is not None:
+            filter_column, filter_value = 'ScenarioID', int(sid)
+        else:
+            raise ValueError("Either a scenario or project ID must be specified.")
+
+        is_bool = [t is empty_or_yes_to_bool for t in type_map]
+        rows = self._execute(self._library(orig), self.build_query(sheet_name, columns, filter_column), (filter_value,))
+        return [{c: format_value(v, b) for c, v, b in zip(columns, row, is_bool)} for row in rows]
+
+    def read_report(self, report_name, sid, batch_size=REPORT_BATCH_SIZE):
+        """
+        Read the rows of an ST-Sim summary report for a result scenario, as the report would be written by SyncroSim.
+        Rows are fetched from the library in batches as they are iterated, so a report is never held in memory.
+        :param report_name: The name of the ST-Sim report (e.g. 'stateclass-summary').
+        :param sid: The result scenario ID.
+        :param batch_size: The number of rows to fetch from the library at a time.
+        :return: An iterator of dicts, keyed by SyncroSim column names.
+        """
+        if report_name not in REPORT_TABLES:
+            raise ValueError("{} cannot be read directly from the library.".format(report_name))
+
+        table, sheet_map = REPORT_TABLES[report_name]
+        columns = [x[1] for x in sheet_map]
+        stored = [c for c in columns if c not in CALCULATED_REPORT_COLUMNS]
+
+        # Open the cursor (and calculate totals) before returning, so that a library which cannot be read fails here
+        # rather than part way through the report.
+        con = sqlite3.connect(self._library())
+        try:
+            stratum_totals = None
+            if any(c in columns for c in CALCULATED_REPORT_COLUMNS):
+                stratum_totals = self._stratum_totals(con, table, int(sid))
+            cursor = con.execute(self.build_query(table, stored, 'ScenarioID'), (int(sid),))
+        except Exception:
+            con.close()
+            raise
+        return self._iter_report_rows(con, cursor, columns, stored, stratum_totals, batch_size)
+
+    @staticmethod
+    def _stratum_totals(con, table, sid):
+        """ Total amounts of a report's output table by (iteration, timestep, stratum name). """
+        ref_table, ref_pk = ID_COLUMN_TABLES['StratumID']
+        query = (
+            'SELECT t.Iteration, t.Timestep, s.Name, SUM(t.Amount) FROM [{table}] AS t '
+            'LEFT JOIN [{ref_table}] AS s ON t.StratumID = s.[{ref_pk}] WHERE t.ScenarioID = ? '
+            'GROUP BY t.Iteration, t.Timestep, s.Name'
+        ).format(table=table, ref_table=ref_table, ref_pk=ref_pk)
+        return {(iteration, timestep, stratum): total or 0 for iteration, timestep, stratum, total in con.execute(
+            query, (sid,)
+        )}
+
+    @staticmethod
+    def _iter_report_rows(con, cursor, columns, stored, stratum_totals, batch_size):
+        """ Format the rows of a report cursor, calculating proportions from the totals if the report has them. """
+        landscape_totals = defaultdict(float)
+        for (iteration, timestep, _), total in (stratum_totals or {}).items():
+            landscape_totals[(iteration, timestep)] += total
+
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                for values in batch:
+                    row = dict(zip(stored, values))
+                    if stratum_totals is not None:
+                        amount = row['Amount'] or 0
+                        landscape_total = landscape_totals[(row['Iteration'], row['Timestep'])]
+                        stratum_total = stratum_totals[(row['Iteration'], row['Timestep'], row['StratumID'])]
+                        row[_landscape_proportion] = amount / landscape_total if landscape_total else 0.0
+                        row[_stratum_proportion] = amount / stratum_total if stratum_total else 0.0
+                    yield {c: format_value(row[c]) for c in columns}
+        finally:
+            con.close()
+
+
+class SheetWriter:
+    """
+    Writes scenario datafeeds directly into a library. All sheets passed to write_sheets() are replaced within a
+    single transaction, so either every sheet is written or the library is left unchanged.
+    """
+
+    def __init__(self, lib, pid):
+        """
+        Constructor
+        :param lib: Path to the .ssim library to write to.
+        :param pid: The SyncroSim project ID that names are resolved against.
+        """
+        self.lib = lib
+        self.pid = int(pid)
+        self._lookups = {}
+
+    def _lookup(self, con, reference):
+        """ Return a name -> ID map for a project definition table, loading it once per writer. """
+        if reference not in self._lookups:
+            table, pk = reference
+            rows = con.execute(
+                'SELECT Name, [{pk}] FROM [{table}] WHERE ProjectID = ?'.format(pk=pk, table=table), (self.pid,)
+            ).fetchall()
+            self._lookups[reference] = dict(rows)
+        return self._lookups[reference]
+
+    def _to_sqlite(self, con, sheet_name, column, value):
+        """ Reverse the CSV formatting of a value (see format_value), resolving definition names to IDs. """
+        if value is None or value == '':
+            return None
+        reference = ID_COLUMN_TABLES.get(column)
+        if reference is not None and reference[0] != sheet_name:
+            try:
+                return self._lookup(con, reference)[value]
+            except KeyError:
+                raise ValueError("{} is not a valid {} for {}.".format(value, column, sheet_name))
+        if value == 'Yes':
+            return -1   # SyncroSim stores True as -1
+        return value
+
+    def write_sheets(self, sid, sheets):
+        """
+        Replace the rows of one or more scenario sheets.
+        :param sid: The scenario ID to write to.
+        :param sheets: An iterable of (sheet_name, sheet_map, rows), where rows are dicts keyed by SyncroSim column
+        names, as produced by landscapesim.serializers.imports.
+        """
+        sid = int(sid)
+        con = sqlite3.connect(self.lib)
+        try:
+            with con:   # Commits on success, rolls back every sheet if any sheet fails
+                for sheet_name, sheet_map, rows in sheets:
+                    columns = [x[1] for x in sheet_map]
+                    con.execute('DELETE FROM [{}] WHERE ScenarioID = ?'.format(sheet_name), (sid,))
+                    if not rows:
+                        continue
+                    statement = 'INSERT INTO [{}] (ScenarioID, {}) VALUES (?, {})'.format(
+                        sheet_name, ', '.join('[{}]'.format(c) for c in columns), ', '.join('?' for _ in columns)
+                    )
+                    con.executemany(statement, [
+                        [sid] + [self._to_sqlite(con, sheet_name, c, row[c]) for c in columns] for row in rows
+                    ])
+        finally:
+            con.close()
@@ -25,6 +25,7 @@ from django.conf import settings
 
 from landscapesim.common.geojson import zonal_stats
 from landscapesim.importers import ProjectImporter
+from landscapesim.importers.base import sheet_digest
 from landscapesim.importers.project import STRATUM
 from landscapesim.models import Stratum, StateClass
 
@@ -101,21 +102,19 @@ class LandfireProjectImporter(ProjectImporter):
         Custom definitions based on external CSV mappings for a given value.
         """
         sheet_name, model, sheet_map, type_map = sheet_config
-        self.console.export_sheet(sheet_name, self.temp_file, **self.sheet_kwargs)
-        with open(self.temp_file, 'r') as sheet:
-            reader = csv.DictReader(sheet)
-            data = [r for r in reader]
-            for row in data:
-                mapped_row = self.map_row(row, sheet_map, type_map)
-                row_id = mapped_row[map_key]
-                descriptive_name = name_mapping[row_id]
-                color = color_mapping[row_id]
-                mapped_row['description'] = descriptive_name
-                mapped_row['color'] = color
-                instance_data = {**self.import_kwargs, **mapped_row}
-                model.objects.create(**instance_data)
+        rows = self._read_sheet(sheet_config)
+        for row in rows:
+            mapped_row = self.map_row(row, sheet_map, type_map)
+            row_id = mapped_row[map_key]
+            descriptive_name = name_mapping[row_id]
+            color = color_mapping[row_id]
+            mapped_row['description'] = descriptive_name
+            mapped_row['color'] = color
+            instance_data = {**self.import_kwargs, **mapped_row}
+            model.objects.create(**instance_data)
+        self.record_fingerprint(sheet_name, sheet_digest(rows))
+        self.definitions.invalidate(model)
         print("Imported {} (with customized LANDFIRE descriptions)".format(sheet_name))
-        self._cleanup_temp_file()
     
     def import_stratum(self):
         self._extract_sheet_alternative_names_and_colors(STRATUM, 'stratum_id', BPS_NAMES, BPS_COLORS)
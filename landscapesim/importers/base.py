@@ -1,13 +1,32 @@
 import csv
+import hashlib
+import json
 import os
+import sqlite3
 from inspect import isfunction
+from time import time
 
 from django.conf import settings
+from django.db import transaction
 
-from landscapesim.models import Project, Scenario
+from landscapesim.common import config
+from landscapesim.common.sheets import SheetReader
+from landscapesim.importers.filters import DefinitionIndex
+from landscapesim.models import Project, Scenario, SheetFingerprint
 
 DEBUG = getattr(settings, 'DEBUG')
 
+# Read sheets directly from the .ssim library, falling back to exporting through SyncroSim
+STSIM_DIRECT_SQLITE = getattr(settings, 'STSIM_DIRECT_SQLITE', True)
+
+# Number of rows to insert per query when importing a sheet
+STSIM_IMPORT_BATCH_SIZE = getattr(settings, 'STSIM_IMPORT_BATCH_SIZE', 1000)
+
+
+def sheet_digest(rows):
+    """ A digest of the rows read from a sheet, for detecting whether a sheet has changed since it was imported. """
+    return hashlib.sha1(json.dumps(rows, sort_keys=True).encode()).hexdigest()
+
 
 class ImporterBase:
     """
@@ -49,6 +68,7 @@ class ImporterBase:
 
         if relationship is not None:
             self.import_kwargs[relationship] = self.filter_obj
+        self.definitions = DefinitionIndex(self.project) if self.project is not None else None
 
     def _cleanup_temp_file(self):
         if not DEBUG and os.path.exists(self.temp_file):
@@ -77,18 +97,89 @@ class ImporterBase:
             model_field, sheet_field = pair
             data = row_data[sheet_field]
             is_filter = not (isinstance(type_or_filter, type) or isfunction(type_or_filter))
-            result[model_field] = type_or_filter.get(data, self.project) if is_filter else type_or_filter(data)
+            result[model_field] = (
+                type_or_filter.get(data, self.project, self.definitions) if is_filter else type_or_filter(data)
+            )
         return result
 
-    def _extract_sheet(self, sheet_config):
-        """ Extract data from the STSimConsole and import into LandscapeSim. """
+    def _read_sheet(self, sheet_config):
+        """
+        Read the rows of a SyncroSim sheet. Reads directly from the library when possible, otherwise the sheet is
+        exported through the STSimConsole.
+        :return: A list of dicts, keyed by SyncroSim column names.
+        """
         sheet_name, model, sheet_map, type_map = sheet_config
+        if STSIM_DIRECT_SQLITE:
+            try:
+                return SheetReader(self.console).read_sheet(
+                    sheet_name, sheet_map, type_map, sid=self.sheet_kwargs.get('sid'),
+                    pid=self.sheet_kwargs.get('pid'), orig=self.sheet_kwargs.get('orig', False)
+                )
+            except (sqlite3.Error, ValueError):
+                print("Could not read {} from the library, exporting through SyncroSim...".format(sheet_name))
+
         self.console.export_sheet(sheet_name, self.temp_file, **self.sheet_kwargs)
         with open(self.temp_file, 'r') as sheet:
-            reader = csv.DictReader(sheet)
-            data = [r for r in reader]
-            for row in data:
-                instance_data = {**self.import_kwargs, **self.map_row(row, sheet_map, type_map)}
-                model.objects.create(**instance_data)
-        print("Imported {}".format(sheet_name))
+            data = [r for r in csv.DictReader(sheet)]
         self._cleanup_temp_file()
+        return data
+
+    def record_fingerprint(self, sheet_name, digest, source=None):
+        """
+        Store the digest of the rows imported from a sheet for this importer's project or scenario.
+        :param source: (Optional) The scenario storing the rows, if they are shared rather than copied.
+        """
+        SheetFingerprint.objects.update_or_create(
+            sheet_name=sheet_name, **self.import_kwargs, defaults={'digest': digest, 'source': source}
+        )
+
+    def shared_source(self, sheet_name, digest):
+        """
+        The scenario storing rows identical to those of a sheet, if they can be shared rather than copied. Only the
+        parent scenario's rows (or the rows the parent itself shares) are considered.
+        """
+        parent = self.scenario.parent if self.scenario is not None else None
+        if parent is None or sheet_name not in dict(config.SHARED_VALUES).values():
+            return None
+        fingerprint = parent.sheet_fingerprints.filter(sheet_name=sheet_name, digest=digest).first()
+        if fingerprint is None:
+            return None
+        return fingerprint.source or parent
+
+    def sheet_changed(self, sheet_config):
+        """ Whether a sheet differs from the rows last imported from it. """
+        fingerprint = SheetFingerprint.objects.filter(sheet_name=sheet_config[0], **self.import_kwargs).first()
+        return fingerprint is None or fingerprint.digest != sheet_digest(self._read_sheet(sheet_config))
+
+    def _extract_sheet(self, sheet_config):
+        """
+        Extract data from the STSimConsole and import into LandscapeSim. Rows are inserted in batches of
+        STSIM_IMPORT_BATCH_SIZE, within a single transaction for the sheet.
+        """
+        sheet_name, model, sheet_map, type_map = sheet_config
+        start = time()
+        count = 0
+        batch = []
+        rows = self._read_sheet(sheet_config)
+        digest = sheet_digest(rows)
+        source = self.shared_source(sheet_name, digest)
+        if source is not None:
+            self.record_fingerprint(sheet_name, digest, source)
+            print("Shared {} with scenario {}".format(sheet_name, source.sid))
+            return
+
+        with transaction.atomic():
+            for row in rows:
+                batch.append(model(**{**self.import_kwargs, **self.map_row(row, sheet_map, type_map)}))
+                if len(batch) >= STSIM_IMPORT_BATCH_SIZE:
+                    model.objects.bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                model.objects.bulk_create(batch)
+                count += len(batch)
+            self.record_fingerprint(sheet_name, digest)
+        if self.definitions is not None:
+            self.definitions.invalidate(model)
+        elapsed = time() - start
+        print("Imported {} ({} rows, {:.0f} rows/sec)".format(sheet_name, count, count / elapsed if elapsed else 0))
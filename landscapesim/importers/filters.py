@@ -1,13 +1,50 @@
+from threading import Lock
+
 from landscapesim.models import Stratum, StateClass, SecondaryStratum, TransitionGroup, TransitionType, AttributeGroup,\
     StateAttributeType, TransitionAttributeType, TransitionMultiplierType, DistributionType
 
 
+class DefinitionIndex:
+    """
+    Name indexes of a project's definitions, so that the rows of an import can be mapped without a query per column.
+    An index belongs to a single importer, and therefore lasts for one import run: definitions re-imported elsewhere
+    (e.g. by sync_library in another process) are never looked up in a stale index, and it never holds more than the
+    definitions of one project.
+    """
+    def __init__(self, project):
+        self.project = project
+        self._indexes = {}
+        self._lock = Lock()     # Reports may be imported from several threads
+
+    def get(self, model, name):
+        with self._lock:
+            index = self._indexes.get(model)
+            if index is None:
+                # Reverse order, so the first definition with a name wins (as with filter().first())
+                index = {x.name: x for x in model.objects.filter(project=self.project).order_by('-pk')}
+                self._indexes[model] = index
+        return index.get(name)
+
+    def invalidate(self, model=None):
+        """ Drop the index for a definition model, or for all models. Called when definitions are (re)imported. """
+        with self._lock:
+            if model is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(model, None)
+
+
 class ProjectFilter:
     """ A utility class for quickly collecting a foreign key from project-level definitions """
     def __init__(self, model):
         self.model = model
 
-    def get(self, name, project):
+    def get(self, name, project, index=None):
+        """
+        :param index: (Optional) A DefinitionIndex for the project, to look the definition up in rather than querying.
+        """
+        if index is not None:
+            return index.get(self.model, name)
         return self.model.objects.filter(name__exact=name, project=project).first()
 
 
@@ -126,6 +126,7 @@ class ProjectImporter(ImporterBase):
         self._extract_sheet(TRANSITION_ATTRIBUTE_TYPE)
 
     def process_project_definitions(self):
+        self.definitions.invalidate()
         self.import_terminology()
         self.import_distribution_types()
         self.import_stratum()
@@ -12,17 +12,25 @@
 
 import csv
 import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from inspect import isfunction
+from time import time
 
 from django.conf import settings
 
 from landscapesim import models
 from landscapesim.common import config
+from landscapesim.common.bulk import load_rows
+from landscapesim.common.columnar import STSIM_REPORT_STORAGE, ColumnarReport, report_path
+from landscapesim.common.sheets import SheetReader
 from landscapesim.common.types import default_int
 from landscapesim.common.utils import get_random_csv
 from .filters import *
 
 DEBUG = getattr(settings, 'DEBUG')
+STSIM_DIRECT_SQLITE = getattr(settings, 'STSIM_DIRECT_SQLITE', True)
+STSIM_REPORT_JOBS = getattr(settings, 'STSIM_REPORT_JOBS', 3)     # Reports to generate concurrently
 
 
 """ Report summary configurations """
@@ -61,6 +69,10 @@ TRANSITION_ATTRIBUTE_REPORT = (
     config.TRANSITION_ATTRIBUTE_SUMMARY_ROW,
     (int, int, StratumFilter, TransitionAttributeTypeFilter, default_int, default_int, float, SecondaryStratumFilter)
 )
+ALL_REPORTS = (
+    STATECLASS_REPORT, TRANSITION_REPORT, TRANSITION_STATECLASS_REPORT, STATE_ATTRIBUTE_REPORT,
+    TRANSITION_ATTRIBUTE_REPORT
+)
 
 
 class ReportImporter:
@@ -81,13 +93,15 @@ class ReportImporter:
         self.console = console
         self.scenario = scenario
         self.temp_file = get_random_csv(scenario.library.tmp_file)
+        self.definitions = DefinitionIndex(scenario.project)
 
-    def generate_report(self, report_name):
+    def generate_report(self, report_name, temp_file=None):
         """
         Create a CSV report corresponding to the appropriate name.
         :param report_name: The name of the ST-Sim report to export.
+        :param temp_file: (Optional) The path to export the report to, instead of the importer's temp file.
         """
-        self.console.generate_report(report_name, self.temp_file, self.scenario.sid)
+        self.console.generate_report(report_name, temp_file or self.temp_file, self.scenario.sid)
 
     def map_row(self, row_data, sheet_map, type_map):
         result = {}
@@ -95,20 +109,69 @@ class ReportImporter:
             model_field, sheet_field = pair
             data = row_data[sheet_field]
             is_filter = not (isinstance(type_or_filter, type) or isfunction(type_or_filter))
-            result[model_field] = type_or_filter.get(data, self.scenario.project) if is_filter else type_or_filter(data)
+            result[model_field] = (
+                type_or_filter.get(data, self.scenario.project, self.definitions) if is_filter else type_or_filter(data)
+            )
         return result
 
-    def _create_report_summary(self, report_config):
+    def _library_rows(self, report_name):
+        """
+        Read a report directly from the library's output tables.
+        :return: An iterator of dicts keyed by SyncroSim column names, or None if the report must be created through
+        the STSimConsole.
+        """
+        if not STSIM_DIRECT_SQLITE:
+            return None
+        try:
+            return SheetReader(self.console).read_report(report_name, self.scenario.sid)
+        except (sqlite3.Error, ValueError):
+            print("Could not read {} from the library, creating report through SyncroSim...".format(report_name))
+            return None
+
+    @staticmethod
+    def _csv_rows(temp_file):
+        """ Iterate over the rows of a report exported by SyncroSim, removing the file once it has been read. """
+        with open(temp_file, 'r') as sheet:
+            yield from csv.DictReader(sheet)
+        if not DEBUG and os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    def _iter_report(self, report_name, temp_file=None):
+        """
+        Iterate over the rows of a report. Reads directly from the library's output tables when possible, otherwise
+        the report is created through the STSimConsole and rows are read from the CSV as they are needed.
+        :param temp_file: (Optional) The path to export the report to, instead of the importer's temp file.
+        :return: A generator of dicts, keyed by SyncroSim column names.
+        """
+        rows = self._library_rows(report_name)
+        if rows is not None:
+            yield from rows
+            return
+
+        temp_file = temp_file or self.temp_file
+        self.generate_report(report_name, temp_file)
+        yield from self._csv_rows(temp_file)
+
+    def _create_report_summary(self, report_config, data=None):
+        """
+        Create a summary report and its rows.
+        :param report_config: The report configuration (e.g. STATECLASS_REPORT).
+        :param data: (Optional) The rows of the report, if they have already been read.
+        """
         name, model, row_model, sheet_map, type_map = report_config
 
-        self.generate_report(name)
+        start = time()
         report, created = model.objects.get_or_create(scenario=self.scenario)
-        with open(self.temp_file, 'r') as sheet:
-            reader = csv.DictReader(sheet)
-            for row in reader:
-                row_model.objects.create(report=report, **self.map_row(row, sheet_map, type_map))
-        if not DEBUG and os.path.exists(self.temp_file):
-            os.remove(self.temp_file)
+        data = self._iter_report(name) if data is None else data
+        rows = ({'report': report, **self.map_row(row, sheet_map, type_map)} for row in data)
+        if STSIM_REPORT_STORAGE == 'columnar':
+            columnar_report = ColumnarReport.from_rows(row_model, rows)
+            columnar_report.save(report_path(self.scenario, name))
+            count = len(columnar_report)
+        else:
+            count = load_rows(row_model, rows)
+        elapsed = time() - start
+        print("Imported {} ({} rows, {:.0f} rows/sec)".format(name, count, count / elapsed if elapsed else 0))
 
         return report
 
@@ -127,9 +190,39 @@ class ReportImporter:
     def create_transition_attribute_summary(self):
         self._create_report_summary(TRANSITION_ATTRIBUTE_REPORT)
 
+    def create_summaries(self, report_configs, jobs=STSIM_REPORT_JOBS):
+        """
+        Create several summary reports. Reports read from the library are streamed into the database one at a time.
+        Reports which must be created through SyncroSim are exported concurrently (each to its own temp file), and
+        the rows of each report are imported as soon as its export is ready.
+        :param report_configs: The report configurations to create (e.g. STATECLASS_REPORT).
+        :param jobs: The maximum number of reports to export through SyncroSim at once.
+        """
+        exported = []
+        for report_config in report_configs:
+            rows = self._library_rows(report_config[0])
+            if rows is None:
+                exported.append(report_config)
+            else:
+                self._create_report_summary(report_config, rows)
+
+        if len(exported) < 2 or jobs < 2:
+            for report_config in exported:
+                self.generate_report(report_config[0])
+                self._create_report_summary(report_config, self._csv_rows(self.temp_file))
+            return
+
+        def export_report(report_config):
+            temp_file = get_random_csv(self.scenario.library.tmp_file)
+            self.generate_report(report_config[0], temp_file)
+            return report_config, temp_file
+
+        # Only the SyncroSim exports run concurrently. Rows are read from each CSV as they are imported, and database
+        # writes stay on this thread.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for future in as_completed([executor.submit(export_report, x) for x in exported]):
+                report_config, temp_file = future.result()
+                self._create_report_summary(report_config, self._csv_rows(temp_file))
+
     def create_all_summaries(self):
-        self.create_stateclass_summary()
-        self.create_transition_summary()
-        self.create_transition_sc_summary()
-        self.create_state_attribute_summary()
-        self.create_transition_attribute_summary()
+        self.create_summaries(ALL_REPORTS)
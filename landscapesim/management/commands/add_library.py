@@ -1,17 +1,54 @@
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import copyfile
+from time import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection, transaction
 
 from landscapesim import contrib
 from landscapesim.common.consoles import STSimConsole
-from landscapesim.models import Library, Project, Scenario
+from landscapesim.models import ImportCheckpoint, Library, Project, Scenario
 
 STSIM_LIBRARY_DIRECTORY = getattr(settings, 'STSIM_LIBRARY_DIRECTORY')
 
 
+def import_scenario(library_name, console_kwargs, scenario_id):
+    """
+    Import a scenario's inputs, and reports for result scenarios. Runs in a worker thread, so the scenario is
+    imported with its own console and database connection. The scenario is committed, along with its checkpoint, in
+    a single transaction.
+    :return: The imported scenario and the time taken to import it.
+    """
+    start = time()
+    try:
+        scenario = Scenario.objects.select_related('project').get(id=scenario_id)
+        console = STSimConsole(**console_kwargs)
+        with transaction.atomic():
+            # Import scenario inputs (transition probabilities, distributions, initial conditions, etc.)
+            scenario_importer = contrib.get_scenario_importer_cls(library_name)(console, scenario)
+            scenario_importer.import_run_control()
+            scenario_importer.import_output_options()
+            scenario_importer.import_post_processed_sheets()
+
+            if scenario.is_result:
+
+                # Import all available reports from result scenarios
+                report_importer = contrib.get_report_importer_cls(library_name)
+                report_importer(console, scenario).create_all_summaries()
+
+                # Import output rasters
+                # TODO - decide whether this should be allowed on initial import
+                # ServiceGenerator(s).create_output_services()
+
+            ImportCheckpoint.objects.create(library=scenario.project.library, scenario=scenario)
+
+        return scenario, time() - start
+    finally:
+        connection.close()
+
+
 class Command(BaseCommand):
 
     help = 'Registers a .ssim library based on the file path.'
@@ -19,20 +56,38 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('name', nargs=1, type=str)
         parser.add_argument('file', nargs=1, type=str)
+        parser.add_argument('--jobs', type=int, default=1, help='Number of scenarios to import concurrently.')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Keep a partially imported library if the import fails, and resume importing a library which was '
+                 'partially imported.'
+        )
 
     def handle(self, name, file, *args, **options):
         file = file[0]
         name = name[0]
+        jobs = max(1, options['jobs'])
+        resume = options['resume']
+        start = time()
 
         file = os.path.join(STSIM_LIBRARY_DIRECTORY, file)
         orig_file = file.split('.ssim')[0] + '_orig.ssim'
         tmp_file = file.split('.ssim')[0] + '_tmp.csv'
 
-        if Library.objects.filter(file__iexact=file).exists():
-            print('The library located at {} already exists in the database.'.format(file))
-            return
+        library = Library.objects.filter(file__iexact=file).first()
+        if library is not None:
+            if not resume:
+                print('The library located at {} already exists in the database.'.format(file))
+                return
+            if library.name != name:
+                print('The library located at {} is registered as {}.'.format(file, library.name))
+                return
+            if library.projects.exists() and not library.import_checkpoints.exists():
+                print('Library {} was not imported with checkpoints, and cannot be resumed.'.format(name))
+                return
+            print('Resuming import of library {}.'.format(name))
 
-        if not os.path.exists(orig_file):
+        elif not os.path.exists(orig_file):
             message = 'A copy of the library does not exist. Create one now or cancel? '
             if input(message).lower() not in {'y', 'yes'}:
                 print("Abort - Cannot continue without replicating the library values.")
@@ -40,19 +95,52 @@ class Command(BaseCommand):
             else:
                 copyfile(file, orig_file)
 
-        console = STSimConsole(lib_path=file, orig_lib_path=orig_file, exe=settings.STSIM_EXE_PATH)
+        console_kwargs = {'lib_path': file, 'orig_lib_path': orig_file, 'exe': settings.STSIM_EXE_PATH}
+        console = STSimConsole(**console_kwargs)
 
-        with transaction.atomic():
-
-            # Console works, now create library
+        # Console works, now create library
+        if library is None:
             library = Library.objects.create(name=name, file=file, orig_file=orig_file, tmp_file=tmp_file)
 
-            projects = console.list_projects()
-            all_scenarios = console.list_scenario_attrs()
-            result_scenarios = console.list_scenario_attrs(results_only=True)
-            orig_scenarios = [s for s in all_scenarios if s not in result_scenarios]
-
-            for pid in projects.keys():
+        # Each project and scenario is committed, with a checkpoint, as soon as it is imported
+        timings = []
+        try:
+            self.import_projects(library, console)
+            scenarios = self.import_scenarios(library, console_kwargs, jobs, timings)
+        except:
+            if resume:
+                print("Import failed, run add_library again with --resume to continue importing {}.".format(name))
+            else:
+                print("Import failed, removing library {}...".format(name))
+                library.delete()
+            raise
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        print('{:>8}  {:<30}{:<10}{:>10}'.format('sid', 'Project', 'Type', 'Seconds'))
+        for scenario, elapsed in sorted(timings, key=lambda x: x[1], reverse=True):
+            print('{:>8}  {:<30}{:<10}{:>10.1f}'.format(
+                scenario.sid, scenario.project.name[:29], 'result' if scenario.is_result else 'input', elapsed
+            ))
+        print("Library {} successfully added to landscapesim ({} scenarios, {} imported, {} jobs, {:.1f}s).".format(
+            name, scenarios, len(timings), jobs, time() - start
+        ))
+
+    def import_projects(self, library, console):
+        """ Create the projects of a library, along with their scenarios and definitions, skipping completed ones. """
+        projects = console.list_projects()
+        all_scenarios = console.list_scenario_attrs()
+        result_scenarios = console.list_scenario_attrs(results_only=True)
+        orig_scenarios = [s for s in all_scenarios if s not in result_scenarios]
+        completed = set(library.import_checkpoints.filter(project__isnull=False).values_list('project__pid', flat=True))
+
+        for pid in projects.keys():
+            if int(pid) in completed:
+                print('Project with pid {} already imported, skipping.'.format(pid))
+                continue
+
+            with transaction.atomic():
                 proj_name = projects[pid]
                 project = Project.objects.create(library=library, name=proj_name, pid=int(pid))
                 print('Created project {} with pid {}'.format(project.name, project.pid))
@@ -82,31 +170,37 @@ class Command(BaseCommand):
 
                 # At this point, there may be slightly different ways to import a library. We check to see
                 # if there are any contributor modules that might handle them. Otherwise, we do a normal import.
-                project_importer = contrib.get_project_importer_cls(name)
+                project_importer = contrib.get_project_importer_cls(library.name)
                 project_importer(console, project).process_project_definitions()
-
-                # Now import any scenario-specific information we want to capture
-                scenarios = Scenario.objects.filter(project=project)
-                for s in scenarios:
-                    # Import scenario inputs (transition probabilities, distributions, initial conditions, etc.)
-                    scenario_importer = contrib.get_scenario_importer_cls(name)(console, s)
-                    scenario_importer.import_run_control()
-                    scenario_importer.import_output_options()
-                    scenario_importer.import_post_processed_sheets()
-
-                    if os.path.exists(tmp_file):
-                        os.remove(tmp_file)
-
-                    if s.is_result:
-
-                        # Import all available reports from result scenarios
-                        report_importer = contrib.get_report_importer_cls(name)
-                        report_importer(s, console).create_all_summaries()
-
-                        # Import output rasters
-                        # TODO - decide whether this should be allowed on initial import
-                        # ServiceGenerator(s).create_output_services()
-
-                    print("Scenario {} successfully imported into project {}.".format(s.sid, project.name))
-                print("Project {} successfully imported into landscapesim.".format(project.name))
-            print("Library {} successfully added to landscapesim.".format(name))
+                ImportCheckpoint.objects.create(library=library, project=project)
+                print("Project {} definitions successfully imported into landscapesim.".format(project.name))
+
+    def import_scenarios(self, library, console_kwargs, jobs, timings):
+        """
+        Import any scenario-specific information we want to capture, skipping scenarios which were already imported.
+        Each scenario is imported in its own transaction, by a worker with its own console and database connection.
+        :param timings: A list to append each imported scenario and its import time to.
+        :return: The number of scenarios in the library.
+        """
+        scenarios = list(Scenario.objects.filter(project__library=library).select_related('project'))
+        completed = set(library.import_checkpoints.filter(scenario__isnull=False).values_list('scenario_id', flat=True))
+        remaining = [s for s in scenarios if s.id not in completed]
+        if completed:
+            print("{} of {} scenarios already imported, skipping.".format(len(completed), len(scenarios)))
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(import_scenario, library.name, console_kwargs, s.id) for s in remaining]
+            try:
+                for future in as_completed(futures):
+                    scenario, elapsed = future.result()
+                    timings.append((scenario, elapsed))
+                    print("[{}/{}] Scenario {} successfully imported into project {} ({:.1f}s).".format(
+                        len(completed) + len(timings), len(scenarios), scenario.sid, scenario.project.name, elapsed
+                    ))
+            except:
+                # Don't start any more scenarios. Leaving the executor waits (shutdown(wait=True)) for the scenarios
+                # already being imported, so the library is never deleted while a worker is still writing to it.
+                for future in futures:
+                    future.cancel()
+                raise
+        return len(scenarios)
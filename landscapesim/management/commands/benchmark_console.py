@@ -0,0 +1,64 @@
+import os
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from landscapesim.common.consoles import STSimConsole, METADATA_CACHE
+from landscapesim.common.sheets import SheetReader
+from landscapesim.common.utils import get_random_csv
+from landscapesim.importers.scenario import RUN_CONTROL
+from landscapesim.models import Library
+
+
+def time_command(func, repeat):
+    """ Returns the mean wall time (in ms) of calling func. """
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat * 1000
+
+
+class Command(BaseCommand):
+
+    help = 'Compares per-command latency of cold SyncroSim processes against the cached and direct SQLite paths.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('library_name', nargs=1, type=str)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, library_name, *args, **options):
+        library_name = library_name[0]
+        repeat = options['repeat']
+
+        lib = Library.objects.filter(name__exact=library_name).first()
+        if lib is None:
+            print('Library name {} does not exist in the database.'.format(library_name))
+            return
+
+        start = perf_counter()
+        console = STSimConsole(lib_path=lib.file, orig_lib_path=lib.orig_file, exe=settings.STSIM_EXE_PATH)
+        print('Console construction: {:.1f} ms'.format((perf_counter() - start) * 1000))
+
+        sid = console.list_scenarios()[0]
+        temp_file = get_random_csv(lib.tmp_file)
+        sheet_name, model, sheet_map, type_map = RUN_CONTROL
+
+        results = (
+            ('--version (cold spawn)', time_command(lambda: console.exec_command(['--version']), repeat)),
+            ('--list --datafeeds (cold spawn)',
+             time_command(lambda: console.exec_command(['--list', '--datafeeds']), repeat)),
+            ('list_datafeeds (cached)', time_command(console.list_datafeeds, repeat)),
+            ('export_sheet {} (cold spawn)'.format(sheet_name),
+             time_command(lambda: console.export_sheet(sheet_name, temp_file, sid=sid, overwrite=True), repeat)),
+            ('read_sheet {} (direct SQLite)'.format(sheet_name),
+             time_command(lambda: SheetReader(console).read_sheet(sheet_name, sheet_map, type_map, sid=sid), repeat))
+        )
+
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+        print('{:<50}{:>12}'.format('Command', 'Mean (ms)'))
+        for name, latency in results:
+            print('{:<50}{:>12.1f}'.format(name, latency))
+        print('Metadata cache: {}'.format(METADATA_CACHE.stats()))
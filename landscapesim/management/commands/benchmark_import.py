@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from shutil import rmtree
+from time import perf_counter
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from landscapesim import benchmark
+from landscapesim.async.tasks import ModelBootstrapper
+from landscapesim.benchmark.library import SCENARIO_TABLES, generate_library
+from landscapesim.common.columnar import load_report
+from landscapesim.common.consoles import AsyncSTSimConsole, STSimConsole
+from landscapesim.common.sheets import REPORT_TABLES
+from landscapesim.importers import ProjectImporter, ReportImporter, ScenarioImporter
+from landscapesim.importers.report import ALL_REPORTS
+from landscapesim.management.commands.sync_library import PROJECT_SHEETS, SCENARIO_SHEETS
+from landscapesim.models import Library, Project, RunScenarioModel, Scenario
+from landscapesim.serializers.scenarios import ScenarioConfigSerializer
+
+CONSOLE_SCRIPT = os.path.join(os.path.dirname(benchmark.__file__), 'console.py')
+
+
+class RollbackBenchmark(Exception):
+    """ Raised to roll back everything the benchmark created in the database. """
+
+
+def count_library_rows(lib, tables, sid):
+    """ The number of rows a scenario has in the given tables of a library. """
+    with sqlite3.connect(lib) as con:
+        return sum(
+            con.execute('SELECT COUNT(*) FROM [{}] WHERE ScenarioID = ?'.format(table), (sid,)).fetchone()[0]
+            for table in tables
+        )
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Times the import pipeline (ProjectImporter, ScenarioImporter, ReportImporter and ModelBootstrapper) against '
+        'a generated library, using a stand-in for SyncroSim. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=1)
+        parser.add_argument('--scenarios', type=int, default=2, help='Input scenarios per project.')
+        parser.add_argument('--results', type=int, default=1, help='Result scenarios per input scenario.')
+        parser.add_argument('--strata', type=int, default=5)
+        parser.add_argument('--stateclasses', type=int, default=10)
+        parser.add_argument('--transition-types', type=int, default=5)
+        parser.add_argument('--attribute-types', type=int, default=3)
+        parser.add_argument('--iterations', type=int, default=2)
+        parser.add_argument('--timesteps', type=int, default=10)
+        parser.add_argument('--raster-size', type=int, default=64)
+        parser.add_argument('--json', type=str, help='Write the results to a JSON file, for comparing runs.')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated library files.')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='landscapesim-benchmark-')
+        self.results = []
+        try:
+            self.setup_console(directory)
+            lib_path = os.path.join(directory, 'benchmark.ssim')
+            print('Generating library {}...'.format(lib_path))
+            start = perf_counter()
+            orig_path = generate_library(
+                lib_path, options['projects'], options['scenarios'], options['results'], options['strata'],
+                options['stateclasses'], options['transition_types'], options['attribute_types'],
+                options['iterations'], options['timesteps'], options['raster_size']
+            )
+            print('Library generated ({:.1f}s).'.format(perf_counter() - start))
+
+            try:
+                with transaction.atomic():
+                    self.run_benchmark(lib_path, orig_path, os.path.join(directory, 'benchmark_tmp.csv'))
+                    raise RollbackBenchmark
+            except RollbackBenchmark:
+                pass
+        finally:
+            if options['keep']:
+                print('Library files kept in {}'.format(directory))
+            else:
+                rmtree(directory, ignore_errors=True)
+
+        self.print_results()
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({'options': {k: options[k] for k in (
+                    'projects', 'scenarios', 'results', 'strata', 'stateclasses', 'transition_types',
+                    'attribute_types', 'iterations', 'timesteps', 'raster_size'
+                )}, 'results': self.results}, f, indent=2)
+
+    @staticmethod
+    def setup_console(directory):
+        """ Consoles run SyncroSim through mono on posix systems, so put a 'mono' which runs Python on the PATH. """
+        if os.name != 'posix':
+            return
+        bin_directory = os.path.join(directory, 'bin')
+        os.makedirs(bin_directory)
+        mono = os.path.join(bin_directory, 'mono')
+        with open(mono, 'w') as f:
+            f.write('#!/bin/sh\nexec "{}" "$@"\n'.format(sys.executable))
+        os.chmod(mono, 0o755)
+        os.environ['PATH'] = bin_directory + os.pathsep + os.environ.get('PATH', '')
+
+    def measure(self, stage, unit, console, func, count_rows):
+        """
+        Time a stage of the pipeline, recording the rows it created, and the database queries and SyncroSim commands
+        it executed.
+        :param count_rows: Called after the stage, returning the number of rows the stage created.
+        """
+        commands = console.command_log.count
+        with CaptureQueriesContext(connection) as queries:
+            start = perf_counter()
+            func()
+            elapsed = perf_counter() - start
+        rows = count_rows()
+        self.results.append({
+            'stage': stage, 'unit': unit, 'seconds': elapsed, 'rows': rows,
+            'rows_per_second': rows / elapsed if elapsed else 0, 'queries': len(queries),
+            'commands': console.command_log.count - commands
+        })
+        print('{} {}: {:.2f}s, {} rows'.format(stage, unit, elapsed, rows))
+
+    def run_benchmark(self, lib_path, orig_path, tmp_file):
+        console = STSimConsole(lib_path=lib_path, orig_lib_path=orig_path, exe=CONSOLE_SCRIPT)
+        library = Library.objects.create(
+            name='benchmark-{}'.format(uuid4()), file=lib_path, orig_file=orig_path, tmp_file=tmp_file
+        )
+        result_sids = {x['sid'] for x in console.list_scenario_attrs(results_only=True)}
+        scenarios = []
+        for pid, name in console.list_projects().items():
+            project = Project.objects.create(library=library, name=name, pid=int(pid))
+            for attrs in console.list_scenario_attrs():
+                if attrs['pid'] == pid:
+                    scenarios.append(Scenario.objects.create(
+                        project=project, name=attrs['name'], sid=int(attrs['sid']),
+                        is_result=attrs['sid'] in result_sids
+                    ))
+
+            self.measure(
+                'ProjectImporter', 'project {}'.format(pid), console,
+                ProjectImporter(console, project).process_project_definitions,
+                lambda: sum(config[1].objects.filter(project=project).count() for config, _ in PROJECT_SHEETS)
+            )
+
+        for scenario in scenarios:
+            def import_scenario():
+                importer = ScenarioImporter(console, scenario)
+                importer.import_run_control()
+                importer.import_output_options()
+                importer.import_post_processed_sheets(create_input_services=False)
+
+            self.measure(
+                'ScenarioImporter', 'scenario {}'.format(scenario.sid), console, import_scenario,
+                lambda: sum(config[1].objects.filter(scenario=scenario).count() for config, _ in SCENARIO_SHEETS)
+            )
+
+        for scenario in [x for x in scenarios if x.is_result]:
+            self.measure(
+                'ReportImporter', 'scenario {}'.format(scenario.sid), console,
+                ReportImporter(console, scenario).create_all_summaries,
+                lambda: sum(len(load_report(scenario, name, row_model, model.objects.filter(scenario=scenario).first()))
+                            for name, model, row_model, _, _ in ALL_REPORTS)
+            )
+
+        self.benchmark_model_run(library, next(x for x in scenarios if not x.is_result))
+
+    def benchmark_model_run(self, library, scenario):
+        """ Time writing a run configuration into the library, and running the model. """
+        console = AsyncSTSimConsole(lib_path=library.file, orig_lib_path=library.orig_file, exe=CONSOLE_SCRIPT)
+        request = RequestFactory().get('/')
+        config = json.loads(json.dumps(ScenarioConfigSerializer(scenario, context={'request': request}).data))
+        job = RunScenarioModel.objects.create(parent_scenario=scenario, inputs=json.dumps({'config': config}))
+        boot = ModelBootstrapper(scenario.sid, library, config, console, job)
+        result = {}
+
+        self.measure(
+            'ModelBootstrapper', 'setup scenario {}'.format(scenario.sid), console, boot.run_setup,
+            lambda: count_library_rows(library.file, [x[0] for x in SCENARIO_TABLES], scenario.sid)
+        )
+        self.measure(
+            'ModelBootstrapper', 'run scenario {}'.format(scenario.sid), console,
+            lambda: result.update(sid=boot.run_model()),
+            lambda: count_library_rows(library.file, [x[0] for x in REPORT_TABLES.values()], result['sid'])
+        )
+
+    def print_results(self):
+        print('{:<20}{:<24}{:>10}{:>10}{:>12}{:>10}{:>10}'.format(
+            'Stage', 'Unit', 'Seconds', 'Rows', 'Rows/sec', 'Queries', 'Commands'
+        ))
+        for x in self.results:
+            print('{:<20}{:<24}{:>10.2f}{:>10}{:>12.0f}{:>10}{:>10}'.format(
+                x['stage'], x['unit'], x['seconds'], x['rows'], x['rows_per_second'], x['queries'], x['commands']
+            ))
+
+        totals = {}
+        for x in self.results:
+            total = totals.setdefault(x['stage'], {'seconds': 0, 'rows': 0, 'queries': 0, 'commands': 0})
+            for key in total:
+                total[key] += x[key]
+        print('Totals:')
+        for stage, total in totals.items():
+            print('{:<20}{:<24}{:>10.2f}{:>10}{:>12.0f}{:>10}{:>10}'.format(
+                stage, '', total['seconds'], total['rows'], total['rows'] / total['seconds'] if total['seconds'] else 0,
+                total['queries'], total['commands']
+            ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from landscapesim.common.libraries import create_working_libraries
+from landscapesim.models import Library
+
+
+class Command(BaseCommand):
+
+    help = 'Creates a pool of working copies of a library, so that model runs on the library can run concurrently.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('library_name', nargs=1, type=str)
+        parser.add_argument('count', nargs=1, type=int)
+
+    def handle(self, library_name, count, *args, **options):
+        library_name = library_name[0]
+        count = count[0]
+
+        lib = Library.objects.filter(name__exact=library_name).first()
+        if lib is None:
+            print('Library name {} does not exist in the database.'.format(library_name))
+            return
+
+        for working_library in create_working_libraries(lib, count):
+            print('Created working library {} at {}'.format(working_library.index, working_library.file))
+        print('Library {} has {} working libraries.'.format(lib.name, lib.working_libraries.count()))
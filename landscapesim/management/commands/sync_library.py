@@ -0,0 +1,178 @@
+import os
+from shutil import copyfile
+from time import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from landscapesim import contrib
+from landscapesim.common.consoles import STSimConsole
+from landscapesim.importers import project as project_sheets, report as report_sheets, scenario as scenario_sheets
+from landscapesim.models import Library, Project, Scenario, ScenarioInputServices
+
+# Project definition sheets, and the ProjectImporter methods which import them
+PROJECT_SHEETS = (
+    (project_sheets.TERMINOLOGY, 'import_terminology'),
+    (project_sheets.DISTRIBUTION_TYPE, 'import_distribution_types'),
+    (project_sheets.STRATUM, 'import_stratum'),
+    (project_sheets.SECONDARY_STRATUM, 'import_secondary_stratum'),
+    (project_sheets.STATECLASS, 'import_stateclasses'),
+    (project_sheets.TRANSITION_TYPE, 'import_transition_types'),
+    (project_sheets.TRANSITION_GROUP, 'import_transition_groups'),
+    (project_sheets.TRANSITION_MULTIPLIER_TYPE, 'import_transition_multiplier_types'),
+    (project_sheets.ATTRIBUTE_GROUP, 'import_attribute_groups'),
+    (project_sheets.STATE_ATTRIBUTE_TYPE, 'import_state_attribute_types'),
+    (project_sheets.TRANSITION_ATTRIBUTE_TYPE, 'import_transition_attribute_types')
+)
+
+# Scenario sheets, and the ScenarioImporter methods which import them
+SCENARIO_SHEETS = (
+    (scenario_sheets.RUN_CONTROL, 'import_run_control'),
+    (scenario_sheets.OUTPUT_OPTIONS, 'import_output_options'),
+    (scenario_sheets.DETERMINISTIC_TRANSITION, 'import_deterministic_transitions'),
+    (scenario_sheets.TRANSITION, 'import_probabilistic_transitions'),
+    (scenario_sheets.INITIAL_CONDITIONS_NON_SPATIAL, 'import_initial_conditions_non_spatial'),
+    (scenario_sheets.INITIAL_CONDITIONS_NON_SPATIAL_DISTRIBUTION,
+     'import_initial_conditions_non_spatial_distribution'),
+    (scenario_sheets.INITIAL_CONDITIONS_SPATIAL, 'import_initial_conditions_spatial'),
+    (scenario_sheets.TRANSITION_TARGET, 'import_transition_targets'),
+    (scenario_sheets.TRANSITION_MULTIPLIER_VALUE, 'import_transition_multiplier_values'),
+    (scenario_sheets.TRANSITION_SPATIAL_MULTIPLIER, 'import_transition_spatial_multipliers'),
+    (scenario_sheets.STATE_ATTRIBUTE_VALUE, 'import_state_attribute_values'),
+    (scenario_sheets.TRANSITION_ATTRIBUTE_VALUE, 'import_transition_attribute_values'),
+    (scenario_sheets.TRANSITION_ATTRIBUTE_TARGET, 'import_transition_attribute_targets')
+)
+
+
+class Command(BaseCommand):
+
+    help = 'Re-imports only the projects, scenarios and sheets of a registered library which have changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs=1, type=str)
+        parser.add_argument(
+            '--copy-orig', action='store_true', help='Replace the original copy of the library with the library file.'
+        )
+
+    def handle(self, name, *args, **options):
+        name = name[0]
+        start = time()
+
+        library = Library.objects.filter(name__exact=name).first()
+        if library is None:
+            print('Library name {} does not exist in the database.'.format(name))
+            return
+
+        if options['copy_orig']:
+            copyfile(library.file, library.orig_file)
+
+        self.library = library
+        self.consoles = {}
+        self.changes = 0
+        console = self.get_console(library.file)
+
+        projects = console.list_projects()
+        all_scenarios = console.list_scenario_attrs()
+        result_sids = {s['sid'] for s in console.list_scenario_attrs(results_only=True)}
+
+        with transaction.atomic():
+            for project in library.projects.exclude(pid__in=[int(pid) for pid in projects]):
+                print('Removing project {}.'.format(project.name))
+                project.delete()
+                self.changes += 1
+
+            for pid, proj_name in projects.items():
+                project, created = Project.objects.get_or_create(
+                    library=library, pid=int(pid), defaults={'name': proj_name}
+                )
+                if project.name != proj_name:
+                    project.name = proj_name
+                    project.save()
+                if created:
+                    print('Created project {} with pid {}'.format(project.name, project.pid))
+                    self.changes += 1
+
+                definitions_changed = self.sync_project_definitions(project, created)
+                scenarios = {s['sid']: s for s in all_scenarios if s['pid'] == pid}
+                self.sync_scenarios(project, scenarios, result_sids, definitions_changed)
+
+        if os.path.exists(library.tmp_file):
+            os.remove(library.tmp_file)
+        print("Library {} synced: {} changes ({:.1f}s).".format(name, self.changes, time() - start))
+
+    def get_console(self, lib_path):
+        """ A console for the library, or a working copy of the library. """
+        if lib_path not in self.consoles:
+            self.consoles[lib_path] = STSimConsole(
+                lib_path=lib_path, orig_lib_path=self.library.orig_file, exe=settings.STSIM_EXE_PATH
+            )
+        return self.consoles[lib_path]
+
+    def sync_project_definitions(self, project, created):
+        """
+        Re-import the project definitions if any of them have changed. Scenario rows reference definitions, so all
+        definitions are replaced together.
+        :return: True if the definitions were re-imported.
+        """
+        importer = contrib.get_project_importer_cls(self.library.name)(self.get_console(self.library.file), project)
+        changed = [config[0] for config, _ in PROJECT_SHEETS if created or importer.sheet_changed(config)]
+        if not changed:
+            return False
+
+        print('Re-importing definitions for project {} (changed: {}).'.format(project.name, ', '.join(changed)))
+        for (sheet_name, model, sheet_map, type_map), _ in reversed(PROJECT_SHEETS):
+            model.objects.filter(project=project).delete()
+        importer.process_project_definitions()
+        self.changes += len(changed)
+        return True
+
+    def sync_scenarios(self, project, scenarios, result_sids, definitions_changed):
+        """
+        Add and remove scenarios which were added to or removed from the library, and re-import changed sheets of the
+        remaining scenarios. If the project's definitions were re-imported, every scenario is re-imported.
+        :param scenarios: Scenario attributes for the project, keyed by sid.
+        """
+        existing = project.scenarios.filter(working_library__isnull=True)
+        for scenario in existing.exclude(sid__in=[int(sid) for sid in scenarios]):
+            print('Removing scenario {}.'.format(scenario.sid))
+            scenario.release_shared_values()
+            scenario.delete()
+            self.changes += 1
+
+        for sid, attrs in scenarios.items():
+            scenario, created = Scenario.objects.get_or_create(
+                project=project, sid=int(sid), working_library=None,
+                defaults={'name': attrs['name'], 'is_result': sid in result_sids}
+            )
+            if created:
+                print('Created scenario {}.'.format(sid))
+            self.sync_scenario(scenario, created or definitions_changed)
+
+        # Result scenarios from working copies lost their rows with the definitions they referenced
+        if definitions_changed:
+            for scenario in project.scenarios.filter(working_library__isnull=False):
+                self.sync_scenario(scenario, True)
+
+    def sync_scenario(self, scenario, replace_all):
+        """ Re-import the sheets (and reports) of a scenario which have changed, or all of them. """
+        console = self.get_console(scenario.library_file)
+        importer = contrib.get_scenario_importer_cls(self.library.name)(console, scenario)
+        changed = [(config, method) for config, method in SCENARIO_SHEETS
+                   if replace_all or importer.sheet_changed(config)]
+        if not changed:
+            return
+
+        print('Re-importing {} sheets for scenario {}.'.format(len(changed), scenario.sid))
+        for (sheet_name, model, sheet_map, type_map), method in changed:
+            scenario.release_shared_values(sheet_name)
+            model.objects.filter(scenario=scenario).delete()
+            if model is scenario_sheets.INITIAL_CONDITIONS_SPATIAL[1]:
+                ScenarioInputServices.objects.filter(scenario=scenario).delete()
+            getattr(importer, method)()
+        self.changes += len(changed)
+
+        if scenario.is_result and replace_all:
+            for report_config in report_sheets.ALL_REPORTS:
+                report_config[1].objects.filter(scenario=scenario).delete()
+            contrib.get_report_importer_cls(self.library.name)(console, scenario).create_all_summaries()
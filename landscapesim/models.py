@@ -11,6 +11,8 @@ from celery.result import AsyncResult
 from django.contrib.gis.db import models as gis_models
 from django.db import models
 
+from landscapesim.common import config
+
 
 class Library(models.Model):
     name = models.CharField(max_length=256, unique=True)
@@ -19,6 +21,18 @@ class Library(models.Model):
     tmp_file = models.FilePathField()
 
 
+class WorkingLibrary(models.Model):
+    """
+        A working copy of a library, cloned from the library's original file. Model runs lease a working library so that
+        concurrent runs on the same library do not contend on a single .ssim file.
+    """
+    library = models.ForeignKey('Library', related_name='working_libraries', on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    file = models.FilePathField(match="*.ssim")
+    job = models.ForeignKey('RunScenarioModel', null=True, blank=True, on_delete=models.SET_NULL)
+    leased = models.DateTimeField(null=True, blank=True)
+
+
 class Project(models.Model):
     library = models.ForeignKey('Library', related_name='projects', on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
@@ -31,27 +45,95 @@ class Scenario(models.Model):
     is_result = models.BooleanField(default=False)
     sid = models.PositiveSmallIntegerField()
     parent = models.ForeignKey("self", null=True, blank=True)
+    working_library = models.ForeignKey('WorkingLibrary', related_name='scenarios', null=True, blank=True)
 
     @property
     def library(self):
         return self.project.library
 
+    @property
+    def library_file(self):
+        """ The .ssim file containing this scenario. Result scenarios may live in a working copy of the library. """
+        return self.working_library.file if self.working_library_id else self.library.file
+
     @property
     def input_directory(self):
         return os.path.join(
-            self.library.file + '.input', 'Scenario-' + str(self.sid), 'STSim_InitialConditionsSpatial'
+            self.library_file + '.input', 'Scenario-' + str(self.sid), 'STSim_InitialConditionsSpatial'
         )
 
     @property
     def output_directory(self):
-        return os.path.join(self.library.file + '.output', 'Scenario-' + str(self.sid), 'Spatial')
+        return os.path.join(self.library_file + '.output', 'Scenario-' + str(self.sid), 'Spatial')
 
     @property
     def multiplier_directory(self):
         return os.path.join(
-            self.library.file + '.input', 'Scenario-' + str(self.sid), 'STSim_TransitionSpatialMultiplier'
+            self.library_file + '.input', 'Scenario-' + str(self.sid), 'STSim_TransitionSpatialMultiplier'
         )
 
+    def configuration_values(self, related_name):
+        """
+        The rows of one of the scenario's value sheets (e.g. 'transitions'). Rows which are identical to the parent
+        scenario's are not copied on import, and are instead read from the scenario which stores them.
+        """
+        sheet_name = dict(config.SHARED_VALUES).get(related_name)
+        if sheet_name is not None:
+            fingerprint = self.sheet_fingerprints.filter(
+                sheet_name=sheet_name, source__isnull=False
+            ).select_related('source').first()
+            if fingerprint is not None:
+                return getattr(fingerprint.source, related_name)
+        return getattr(self, related_name)
+
+    def release_shared_values(self, sheet_name=None):
+        """
+        Copy this scenario's value rows to the scenarios sharing them, so that the rows can be replaced or deleted.
+        :param sheet_name: (Optional) The sheet to release. By default, all shared sheets are released.
+        """
+        related_names = {sheet: name for name, sheet in config.SHARED_VALUES}
+        fingerprints = SheetFingerprint.objects.filter(source=self)
+        if sheet_name is not None:
+            fingerprints = fingerprints.filter(sheet_name=sheet_name)
+        for fingerprint in fingerprints.select_related('scenario'):
+            rows = list(getattr(self, related_names[fingerprint.sheet_name]).all())
+            for row in rows:
+                row.pk = None
+                row.scenario = fingerprint.scenario
+            if rows:
+                type(rows[0]).objects.bulk_create(rows)
+            fingerprint.source = None
+            fingerprint.save(update_fields=['source'])
+
+
+class SheetFingerprint(models.Model):
+    """
+        A digest of the rows last imported from a SyncroSim sheet for a project or scenario. Used to re-import only
+        the sheets which have changed when a library is synced, and to share identical value rows between scenarios.
+    """
+    project = models.ForeignKey(
+        'Project', related_name='sheet_fingerprints', null=True, blank=True, on_delete=models.CASCADE
+    )
+    scenario = models.ForeignKey(
+        'Scenario', related_name='sheet_fingerprints', null=True, blank=True, on_delete=models.CASCADE
+    )
+    sheet_name = models.CharField(max_length=100)
+    digest = models.CharField(max_length=40, db_index=True)
+
+    # The scenario storing the rows, if they are shared with another scenario rather than copied
+    source = models.ForeignKey('Scenario', related_name='+', null=True, blank=True, on_delete=models.CASCADE)
+
+
+class ImportCheckpoint(models.Model):
+    """
+        A project or scenario of a library which has been completely imported. Used to resume an interrupted import
+        from the last completed project or scenario.
+    """
+    library = models.ForeignKey('Library', related_name='import_checkpoints', on_delete=models.CASCADE)
+    project = models.ForeignKey('Project', null=True, blank=True, on_delete=models.CASCADE)
+    scenario = models.ForeignKey('Scenario', null=True, blank=True, on_delete=models.CASCADE)
+    completed = models.DateTimeField(auto_now_add=True)
+
 
 class LibraryAssets(models.Model):
     library = models.OneToOneField('Library', related_name='assets', on_delete=models.CASCADE)
@@ -473,7 +555,12 @@ class AsyncJobModel(models.Model):
 class RunScenarioModel(AsyncJobModel):
     parent_scenario = models.ForeignKey('Scenario', related_name='parent_scenario')
     result_scenario = models.ForeignKey('Scenario', related_name='result_scenario', null=True)
+    working_library = models.ForeignKey('WorkingLibrary', related_name='+', null=True, blank=True)
     model_status = models.TextField(null=False, default='complete')
+    cancel_requested = models.BooleanField(default=False)
+    service_iterations = models.TextField(default='[]')    # Iterations added to output services during the run
+    updating_services = models.BooleanField(default=False)  # Iterations are being added to output services
+    run_progress = models.FloatField(null=True, blank=True)  # Fraction of iterations complete, from the run's output
 
     @property
     def progress(self):
@@ -485,9 +572,9 @@ class RunScenarioModel(AsyncJobModel):
             config = json.loads(self.inputs)['config']
             run_control = config['run_control']
 
-            # Non-spatial runs have no progress
+            # Non-spatial runs have no output files, so use the progress reported by SyncroSim
             if not run_control.get('is_spatial'):
-                return None
+                return self.run_progress
 
             iterations = run_control['max_iteration']
             timesteps = run_control['max_timestep']
@@ -496,7 +583,7 @@ class RunScenarioModel(AsyncJobModel):
             progress = len(outputs) / max_num_files
             return progress
         else:
-            return None
+            return self.run_progress
 
 
 class ScenarioInputServices(models.Model):
@@ -7,16 +7,17 @@ from base64 import b64encode
 from datetime import datetime
 from io import StringIO, BytesIO
 from shutil import copyfileobj
-from statistics import median
 
+import numpy
 import pdfkit
 from django.conf import settings
-from django.db.models import Min, Max, Sum
+from django.db.models import Sum
 from django.template.loader import render_to_string
 from geopy.distance import vincenty
 from ncdjango.geoimage import image_to_world
 from pyproj import Proj, transform
 
+from landscapesim.common.columnar import load_report
 from landscapesim.common.consoles import STSimConsole
 from landscapesim.common.utils import get_random_csv
 from landscapesim.mapimage import MapImage
@@ -68,7 +69,7 @@ class Report:
     def get_csv_data(self):
         lib = self.scenario.project.library
         temp_file = get_random_csv(lib.tmp_file)
-        STSimConsole(exe=EXE, lib_path=lib.file, orig_lib_path=lib.orig_file) \
+        STSimConsole(exe=EXE, lib_path=self.scenario.library_file, orig_lib_path=lib.orig_file) \
             .generate_report(self.report_name, temp_file, self.scenario.sid)
         result = StringIO()
         with open(temp_file, 'r') as src:
@@ -227,7 +228,7 @@ class Report:
 
         # Management actions list
         has_management_actions = False
-        tsms = self.scenario.transition_spatial_multipliers.all()
+        tsms = self.scenario.configuration_values('transition_spatial_multipliers').all()
         management_actions = []
         if is_spatial:
             management_actions = [get_management_action_map(x) for x in tsms]
@@ -239,7 +240,9 @@ class Report:
         charts = []
         
         # Detailed analysis breakdown from StateClass Summary Report
-        output_data = StateClassSummaryReportRow.objects.filter(report=self.scenario.stateclass_summary_report)
+        output_data = load_report(
+            self.scenario, 'stateclass-summary', StateClassSummaryReportRow, self.scenario.stateclass_summary_report
+        )
         stateclasses = self.scenario.project.stateclasses.all()
 
         for i, column in enumerate(column_charts):
@@ -252,13 +255,14 @@ class Report:
             veg_output_data = output_data.filter(stratum=stratum)
             column_output_context = []
             for stateclass in stateclasses:
-                rows = veg_output_data.filter(stateclass=stateclass, timestep=num_timesteps)
-                if rows:
+                proportions = veg_output_data.filter(stateclass=stateclass, timestep=num_timesteps) \
+                    .values('proportion_of_landscape')
+                if len(proportions):
                     column_data = {
                         'name': stateclass.name,
-                        'max': round(100 * rows.aggregate(max=Max('proportion_of_landscape'))['max'], 2),
-                        'min': round(100 * rows.aggregate(min=Min('proportion_of_landscape'))['min'], 2),
-                        'median': round(100 * median(x[0] for x in rows.values_list('proportion_of_landscape')), 2)
+                        'max': round(100 * float(proportions.max()), 2),
+                        'min': round(100 * float(proportions.min()), 2),
+                        'median': round(100 * float(numpy.median(proportions)), 2)
                     }
                     column_output_context.append(column_data)
             
@@ -267,10 +271,14 @@ class Report:
             filtered_timesteps = [i for i in range(0, num_timesteps + 1) if i % timestep_interval == 0]
             for stateclass in stateclasses:
                 stateclass_data = veg_output_data.filter(iteration=1, stateclass=stateclass)
-                if stateclass_data:
+                if len(stateclass_data):
+                    order = numpy.argsort(stateclass_data.values('timestep'), kind='mergesort')
                     row_values = [
-                        x for i, x in enumerate(stateclass_data.order_by('timestep')
-                                                .values('proportion_of_landscape', 'timestep'))
+                        {'proportion_of_landscape': float(proportion), 'timestep': int(timestep)}
+                        for i, (proportion, timestep) in enumerate(zip(
+                            stateclass_data.values('proportion_of_landscape')[order],
+                            stateclass_data.values('timestep')[order]
+                        ))
                         if i in filtered_timesteps
                     ]
                     for i, x in enumerate(row_values):
@@ -2,9 +2,25 @@
     Model serializers for models that contain information for reports for a given scenario.
 """
 
+import os
+
 from rest_framework import serializers
 
 from landscapesim import models
+from landscapesim.common.columnar import ColumnarReport, report_path
+
+
+class ColumnarResultsMixin(object):
+    """ Serve the results of reports which are stored in columnar files (see landscapesim.common.columnar). """
+
+    report_name = None
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        path = report_path(instance.scenario, self.report_name)
+        if os.path.exists(path):
+            data['results'] = [{'report': instance.id, **row} for row in ColumnarReport.load(path).rows()]
+        return data
 
 
 class GenerateReportSerializer(serializers.Serializer):
@@ -17,7 +33,8 @@ class StateClassSummaryReportRowSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class StateClassSummaryReportSerializer(serializers.ModelSerializer):
+class StateClassSummaryReportSerializer(ColumnarResultsMixin, serializers.ModelSerializer):
+    report_name = 'stateclass-summary'
     results = StateClassSummaryReportRowSerializer(many=True, read_only=True)
 
     class Meta:
@@ -31,7 +48,8 @@ class TransitionSummaryReportRowSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class TransitionSummaryReportSerializer(serializers.ModelSerializer):
+class TransitionSummaryReportSerializer(ColumnarResultsMixin, serializers.ModelSerializer):
+    report_name = 'transition-summary'
     results = TransitionSummaryReportRowSerializer(many=True, read_only=True)
 
     class Meta:
@@ -45,7 +63,8 @@ class TransitionByStateClassSummaryReportRowSerializer(serializers.ModelSerializ
         fields = '__all__'
 
 
-class TransitionByStateClassSummaryReportSerializer(serializers.ModelSerializer):
+class TransitionByStateClassSummaryReportSerializer(ColumnarResultsMixin, serializers.ModelSerializer):
+    report_name = 'transition-stateclass-summary'
     results = TransitionByStateClassSummaryReportRowSerializer(many=True, read_only=True)
 
     class Meta:
@@ -59,7 +78,8 @@ class StateAttributeSummaryReportRowSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class StateAttributeSummaryReportSerializer(serializers.ModelSerializer):
+class StateAttributeSummaryReportSerializer(ColumnarResultsMixin, serializers.ModelSerializer):
+    report_name = 'state-attributes'
     results = StateAttributeSummaryReportRowSerializer(many=True, read_only=True)
 
     class Meta:
@@ -73,7 +93,8 @@ class TransitionAttributeSummaryReportRowSerializer(serializers.ModelSerializer)
         fields = '__all__'
 
 
-class TransitionAttributeSummaryReportSerializer(serializers.ModelSerializer):
+class TransitionAttributeSummaryReportSerializer(ColumnarResultsMixin, serializers.ModelSerializer):
+    report_name = 'transition-attributes'
     results = TransitionAttributeSummaryReportRowSerializer(many=True, read_only=True)
 
     class Meta:
@@ -8,6 +8,7 @@ from rest_framework import serializers
 from rest_framework.exceptions import NotFound
 
 from landscapesim import models, contrib
+from landscapesim.common import config
 
 
 class DistributionValueSerializer(serializers.ModelSerializer):
@@ -223,6 +224,18 @@ class ScenarioOutputServicesSerializer(serializers.ModelSerializer):
             return None
 
 
+class SharedValues:
+    """ A scenario whose value sheets are read from the scenario storing them (see Scenario.configuration_values). """
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+
+    def __getattr__(self, name):
+        if name in dict(config.SHARED_VALUES):
+            return self.scenario.configuration_values(name)
+        return getattr(self.scenario, name)
+
+
 class ScenarioConfigSerializer(serializers.Serializer):
     # OneToOne fields
     run_control = RunControlSerializer(many=False, read_only=True)
@@ -274,3 +287,6 @@ class ScenarioConfigSerializer(serializers.Serializer):
         unit = self.reporting_unit
         data = obj.initial_conditions_nonspatial_distributions.filter(reporting_unit=unit)
         return InitialConditionsNonSpatialDistributionSerializer(data, many=True).data
+
+    def to_representation(self, instance):
+        return super().to_representation(SharedValues(instance))
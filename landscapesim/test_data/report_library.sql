@@ -0,0 +1,58 @@
+-- A small result scenario (ScenarioID 2) with summary output, for testing reports read directly from a library.
+-- ScenarioID 3 is another result scenario in the same library, whose rows must not affect scenario 2's reports.
+
+CREATE TABLE SSim_Scenario (ScenarioID INTEGER PRIMARY KEY, ProjectID INTEGER, Name TEXT, IsResult BOOLEAN);
+CREATE TABLE STSim_Stratum (StratumID INTEGER PRIMARY KEY, ProjectID INTEGER, Name TEXT);
+CREATE TABLE STSim_SecondaryStratum (SecondaryStratumID INTEGER PRIMARY KEY, ProjectID INTEGER, Name TEXT);
+CREATE TABLE STSim_StateClass (StateClassID INTEGER PRIMARY KEY, ProjectID INTEGER, Name TEXT);
+CREATE TABLE STSim_TransitionGroup (TransitionGroupID INTEGER PRIMARY KEY, ProjectID INTEGER, Name TEXT);
+CREATE TABLE STSim_OutputStratumState (
+    OutputStratumStateID INTEGER PRIMARY KEY, ScenarioID INTEGER, Iteration INTEGER, Timestep INTEGER,
+    StratumID INTEGER, SecondaryStratumID INTEGER, StateClassID INTEGER, AgeMin INTEGER, AgeMax INTEGER, Amount DOUBLE
+);
+CREATE TABLE STSim_OutputStratumTransition (
+    OutputStratumTransitionID INTEGER PRIMARY KEY, ScenarioID INTEGER, Iteration INTEGER, Timestep INTEGER,
+    StratumID INTEGER, SecondaryStratumID INTEGER, TransitionGroupID INTEGER, AgeMin INTEGER, AgeMax INTEGER,
+    Amount DOUBLE
+);
+
+INSERT INTO SSim_Scenario VALUES (1, 1, 'Scenario', 0), (2, 1, 'Scenario', -1), (3, 1, 'Scenario', -1);
+INSERT INTO STSim_Stratum VALUES (11, 1, 'Stratum A'), (12, 1, 'Stratum B');
+INSERT INTO STSim_SecondaryStratum VALUES (21, 1, 'Secondary 1');
+INSERT INTO STSim_StateClass VALUES (31, 1, 'Class 1:All'), (32, 1, 'Class 2:All');
+INSERT INTO STSim_TransitionGroup VALUES (41, 1, 'Fire'), (42, 1, 'Harvest');
+
+-- Iteration 1, timestep 0: stratum totals of 40 and 60
+INSERT INTO STSim_OutputStratumState
+    (ScenarioID, Iteration, Timestep, StratumID, SecondaryStratumID, StateClassID, AgeMin, AgeMax, Amount) VALUES
+    (2, 1, 0, 11, NULL, 31, 0, 9, 30),
+    (2, 1, 0, 11, NULL, 32, 0, 9, 10),
+    (2, 1, 0, 12, NULL, 31, 10, NULL, 60);
+
+-- Iteration 1, timestep 1
+INSERT INTO STSim_OutputStratumState
+    (ScenarioID, Iteration, Timestep, StratumID, SecondaryStratumID, StateClassID, AgeMin, AgeMax, Amount) VALUES
+    (2, 1, 1, 11, NULL, 31, 0, 9, 20),
+    (2, 1, 1, 11, NULL, 32, 0, 9, 20),
+    (2, 1, 1, 12, NULL, 31, 10, NULL, 45),
+    (2, 1, 1, 12, NULL, 32, 10, NULL, 15);
+
+-- Iteration 2, timestep 0: totals are per iteration. Stratum B has no amount, so its proportions are 0.
+INSERT INTO STSim_OutputStratumState
+    (ScenarioID, Iteration, Timestep, StratumID, SecondaryStratumID, StateClassID, AgeMin, AgeMax, Amount) VALUES
+    (2, 2, 0, 11, NULL, 31, 0, 9, 25),
+    (2, 2, 0, 11, 21, 31, 0, 9, 25),
+    (2, 2, 0, 12, NULL, 31, 0, 9, 0),
+    (2, 2, 0, 12, NULL, 32, 0, 9, NULL);
+
+-- Another result scenario
+INSERT INTO STSim_OutputStratumState
+    (ScenarioID, Iteration, Timestep, StratumID, SecondaryStratumID, StateClassID, AgeMin, AgeMax, Amount) VALUES
+    (3, 1, 0, 11, NULL, 31, 0, 9, 1000),
+    (3, 2, 0, 12, NULL, 32, 0, 9, 1000);
+
+INSERT INTO STSim_OutputStratumTransition
+    (ScenarioID, Iteration, Timestep, StratumID, SecondaryStratumID, TransitionGroupID, AgeMin, AgeMax, Amount) VALUES
+    (2, 1, 1, 11, NULL, 41, 0, 9, 2.5),
+    (2, 1, 1, 12, 21, 42, 10, NULL, 7),
+    (3, 1, 1, 11, NULL, 41, 0, 9, 1000);
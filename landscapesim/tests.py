@@ -1,3 +1,550 @@
-from django.test import TestCase
+import asyncio
+import csv
+import os
+import sqlite3
+import sys
+import tempfile
+from shutil import rmtree
+from time import time
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import netCDF4
+import numpy
+import pyproj
+from clover.geometry.bbox import BBox
+from clover.netcdf.describe import describe
+from django.conf import settings
+from django.db.models import Avg, Sum
+from django.test import SimpleTestCase, TestCase
+
+from landscapesim import models
+from landscapesim.async.tasks import RunProgress, run_shards
+from landscapesim.benchmark.library import CELL_SIZE, XLL_CORNER, YLL_CORNER, random_raster, write_raster
+from landscapesim.common.columnar import ColumnarReport, report_path
+from landscapesim.common.consoles import AsyncSTSimConsole, STSimConsole
+from landscapesim.common.libraries import lease_working_libraries, merge_result_scenario, release_stale_leases
+from landscapesim.common.services import ServiceGenerator
+from landscapesim.common.sheets import REPORT_TABLES, SheetReader
+from landscapesim.importers import project, scenario
+from landscapesim.serializers.reports import StateClassSummaryReportRowSerializer, StateClassSummaryReportSerializer
+
+# A small .ssim library (and a copy to use as the original library) used for comparing SyncroSim exports
+STSIM_TEST_LIBRARY = getattr(settings, 'STSIM_TEST_LIBRARY', None)
+STSIM_EXE_PATH = getattr(settings, 'STSIM_EXE_PATH', None)
+
+# A library fixture with summary output, and the reports expected from it (<report name>.csv)
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+PROJECT_SHEETS = (
+    project.TERMINOLOGY, project.DISTRIBUTION_TYPE, project.STRATUM, project.SECONDARY_STRATUM, project.STATECLASS,
+    project.TRANSITION_TYPE, project.TRANSITION_GROUP, project.TRANSITION_TYPE_GROUP,
+    project.TRANSITION_MULTIPLIER_TYPE, project.ATTRIBUTE_GROUP, project.STATE_ATTRIBUTE_TYPE,
+    project.TRANSITION_ATTRIBUTE_TYPE
+)
+SCENARIO_SHEETS = (
+    scenario.RUN_CONTROL, scenario.OUTPUT_OPTIONS, scenario.DISTRIBUTION_VALUE, scenario.DETERMINISTIC_TRANSITION,
+    scenario.TRANSITION, scenario.INITIAL_CONDITIONS_NON_SPATIAL, scenario.INITIAL_CONDITIONS_NON_SPATIAL_DISTRIBUTION,
+    scenario.INITIAL_CONDITIONS_SPATIAL, scenario.TRANSITION_TARGET, scenario.TRANSITION_MULTIPLIER_VALUE,
+    scenario.TRANSITION_SIZE_DISTRIBUTION, scenario.TRANSITION_SIZE_PRIORITIZATION,
+    scenario.TRANSITION_SPATIAL_MULTIPLIER, scenario.STATE_ATTRIBUTE_VALUE, scenario.TRANSITION_ATTRIBUTE_VALUE,
+    scenario.TRANSITION_ATTRIBUTE_TARGET
+)
+
+
+# A stand-in for a SyncroSim model run, which reports its progress as SyncroSim does
+FAKE_RUN = """
+import time
+for iteration in range({first}, {last} + 1):
+    for timestep in range(1, 11):
+        print('Iteration {{}} - Timestep {{}}'.format(iteration, timestep), flush=True)
+    print('Iteration {{}} complete'.format(iteration), flush=True)
+    time.sleep(0.3)
+print('Run complete. Result scenario ID is: {result_sid}')
+"""
+
+
+def normalize(value):
+    """ Compare numbers by value, since SyncroSim and SQLite may format them differently. """
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+@skipUnless(STSIM_TEST_LIBRARY and STSIM_EXE_PATH, 'STSIM_TEST_LIBRARY and STSIM_EXE_PATH must be set.')
+class SheetReaderParityTestCase(SimpleTestCase):
+    """ Rows read directly from the library must match the rows exported by SyncroSim. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.console = STSimConsole(lib_path=STSIM_TEST_LIBRARY, exe=STSIM_EXE_PATH)
+        cls.reader = SheetReader(cls.console)
+        cls.temp_dir = tempfile.mkdtemp()
+
+    def export_rows(self, sheet_name, **kwargs):
+        path = os.path.join(self.temp_dir, sheet_name + '.csv')
+        self.console.export_sheet(sheet_name, path, overwrite=True, **kwargs)
+        with open(path, 'r') as f:
+            return [r for r in csv.DictReader(f)]
+
+    def assert_parity(self, sheet_config, **kwargs):
+        sheet_name, model, sheet_map, type_map = sheet_config
+        columns = [x[1] for x in sheet_map]
+        exported = self.export_rows(sheet_name, **kwargs)
+        direct = self.reader.read_sheet(sheet_name, sheet_map, type_map, **kwargs)
+        self.assertEqual(len(exported), len(direct), sheet_name)
+        for expected, actual in zip(exported, direct):
+            for column in columns:
+                self.assertEqual(normalize(expected[column]), normalize(actual[column]), (sheet_name, column))
+
+    def test_project_sheets(self):
+        for pid in self.console.list_projects():
+            for sheet_config in PROJECT_SHEETS:
+                with self.subTest(pid=pid, sheet=sheet_config[0]):
+                    self.assert_parity(sheet_config, pid=pid)
+
+    def test_scenario_sheets(self):
+        for sid in self.console.list_scenarios():
+            for sheet_config in SCENARIO_SHEETS:
+                with self.subTest(sid=sid, sheet=sheet_config[0]):
+                    self.assert_parity(sheet_config, sid=sid)
+
+    def test_reports(self):
+        for sid in self.console.list_scenarios(results_only=True):
+            for report_name, (_, sheet_map) in REPORT_TABLES.items():
+                with self.subTest(sid=sid, report=report_name):
+                    path = os.path.join(self.temp_dir, report_name + '.csv')
+                    if os.path.exists(path):
+                        os.remove(path)
+                    self.console.generate_report(report_name, path, sid)
+                    with open(path, 'r') as f:
+                        exported = [r for r in csv.DictReader(f)]
+                    direct = list(self.reader.read_report(report_name, sid))
+                    self.assertEqual(len(exported), len(direct), report_name)
+                    for expected, actual in zip(exported, direct):
+                        for column in (x[1] for x in sheet_map):
+                            expected_value, actual_value = normalize(expected[column]), normalize(actual[column])
+                            if isinstance(expected_value, float) and isinstance(actual_value, float):
+                                self.assertAlmostEqual(expected_value, actual_value, msg=(report_name, column))
+                            else:
+                                self.assertEqual(expected_value, actual_value, (report_name, column))
+
+
+class ReportReaderTestCase(SimpleTestCase):
+    """
+    Reports read from a library fixture must match the expected reports. The fixture covers the calculated
+    proportion columns: totals per iteration and timestep, multiple strata and secondary strata, missing and zero
+    amounts, and output from other scenarios in the same library.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.temp_dir = tempfile.mkdtemp()
+        lib = os.path.join(cls.temp_dir, 'reports.ssim')
+        with open(os.path.join(TEST_DATA_DIR, 'report_library.sql'), 'r') as f, sqlite3.connect(lib) as con:
+            con.executescript(f.read())
+        cls.reader = SheetReader(SimpleNamespace(lib=lib, orig_lib=None))
+
+    @classmethod
+    def tearDownClass(cls):
+        rmtree(cls.temp_dir)
+        super().tearDownClass()
+
+    def assert_report(self, report_name):
+        with open(os.path.join(TEST_DATA_DIR, report_name + '.csv'), 'r') as f:
+            expected = [r for r in csv.DictReader(f)]
+        self.assertEqual(list(self.reader.read_report(report_name, 2)), expected)
+        self.assertEqual(list(self.reader.read_report(report_name, 2, batch_size=2)), expected)
+
+    def test_stateclass_summary(self):
+        self.assert_report('stateclass-summary')
+
+    def test_transition_summary(self):
+        self.assert_report('transition-summary')
+
+
+class OutputServicesTestCase(TestCase):
+    """ Output services are created from every iteration of a raster time series, or added to as iterations finish. """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.temp_dir)
+        patcher = mock.patch('landscapesim.common.services.NC_ROOT', os.path.join(self.temp_dir, 'nc'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        lib_path = os.path.join(self.temp_dir, 'test.ssim')
+        library = models.Library.objects.create(name='test', file=lib_path, orig_file=lib_path, tmp_file=lib_path)
+        project = models.Project.objects.create(library=library, name='project', pid=1)
+        self.scenario = models.Scenario.objects.create(project=project, name='result', sid=2, is_result=True)
+        self.generator = ServiceGenerator(self.scenario)
+
+    def write_rasters(self, iteration, timesteps):
+        paths = [os.path.join(self.scenario.output_directory, 'It{:04d}-Ts{:04d}-age.tif'.format(iteration, timestep))
+                 for timestep in timesteps]
+        for path in paths:
+            write_raster(path, random_raster(range(50), 8))
+        return paths
+
+    def generate_service(self, **kwargs):
+        return self.generator.generate_service('It*-Ts*-age.tif', 'age', unique=False, **kwargs)
+
+    @staticmethod
+    def variables(service):
+        return list(service.variable_set.order_by('index').values_list('variable', flat=True))
+
+    def test_all_iterations(self):
+        for iteration in (1, 2, 3):
+            self.write_rasters(iteration, range(3))
+        service = self.generate_service()
+        self.assertEqual(self.variables(service), ['age-1', 'age-2', 'age-3'])
+        self.assertEqual(service.variable_set.first().time_steps, 3)
+
+    def test_only_iterations(self):
+        for iteration in (1, 2, 3):
+            self.write_rasters(iteration, range(3))
+        service = self.generate_service(only_iterations={2})
+        self.assertEqual(self.variables(service), ['age-2'])
+        service = self.generate_service(service=service, only_iterations={1, 2})
+        self.assertEqual(self.variables(service), ['age-2', 'age-1'])
+        service = self.generate_service(service=service)
+        self.assertEqual(self.variables(service), ['age-2', 'age-1', 'age-3'])
+
+    def test_no_rasters_for_iterations(self):
+        self.write_rasters(1, range(3))
+        self.assertIsNone(self.generate_service(only_iterations={2}))
+
+    def test_completed_iterations(self):
+        output_options = models.OutputOption(raster_age=True, raster_age_t=2)
+        settled = time() - 60
+
+        # Iterations may finish out of order, and an iteration is only complete once every output timestep is written
+        for iteration, timesteps in ((1, (0, 2)), (2, (0, 2, 4, 5)), (3, (0, 2, 4, 5))):
+            for path in self.write_rasters(iteration, timesteps):
+                os.utime(path, (settled, settled))
+        self.write_rasters(4, (0, 2, 4, 5))     # Just written
+        self.assertEqual(self.generator.completed_iterations(0, 5, output_options), {2, 3})
+
+
+class NetCDFConversionTestCase(SimpleTestCase):
+    """ Converted and merged rasters must keep their projection, so that services can be created from them. """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.temp_dir)
+
+    def convert_iteration(self, iteration):
+        for timestep in range(3):
+            path = os.path.join(self.temp_dir, 'It{:04d}-Ts{:04d}-sc.tif'.format(iteration, timestep))
+            write_raster(path, random_raster(range(5), 8))
+        ServiceGenerator.convert_to_netcdf(
+            os.path.join(self.temp_dir, 'It{:04d}-Ts*-sc.tif'.format(iteration)),
+            os.path.join(self.temp_dir, 'sc-{}.nc'.format(iteration)), 'sc-{}'.format(iteration), categorical=True
+        )
+
+    def assert_extent(self, path, variable_name):
+        """ Build the service extent as ServiceGenerator.generate_service does. """
+        grid = describe(path)['variables'][variable_name]['spatial_grid']['extent']
+        extent = BBox((grid['xmin'], grid['ymin'], grid['xmax'], grid['ymax']), projection=pyproj.Proj(grid['proj4']))
+        self.assertEqual(
+            [extent.xmin, extent.ymin, extent.xmax, extent.ymax],
+            [XLL_CORNER, YLL_CORNER, XLL_CORNER + 8 * CELL_SIZE, YLL_CORNER + 8 * CELL_SIZE]
+        )
+
+    def test_converted_extent(self):
+        self.convert_iteration(1)
+        path = os.path.join(self.temp_dir, 'sc-1.nc')
+        self.assert_extent(path, 'sc-1')
+        with netCDF4.Dataset(path) as dataset:
+            grid_mapping = dataset.variables[dataset.variables['sc-1'].grid_mapping]
+            self.assertEqual(grid_mapping.grid_mapping_name, 'universal_transverse_mercator')
+
+    def test_merged_extent(self):
+        for iteration in (1, 2):
+            self.convert_iteration(iteration)
+        path = os.path.join(self.temp_dir, 'sc.nc')
+        ServiceGenerator.merge_netcdf(os.path.join(self.temp_dir, 'sc-*.nc'), path, categorical=True)
+        for variable_name in ('sc-1', 'sc-2'):
+            self.assert_extent(path, variable_name)
+
+    def test_append_while_reading(self):
+        """ Iterations are added to a copy of a service's file, so a service reading the file is not disturbed. """
+        path = os.path.join(self.temp_dir, 'sc.nc')
+        self.convert_iteration(1)
+        ServiceGenerator.merge_netcdf(os.path.join(self.temp_dir, 'sc-*.nc'), path, categorical=True)
+
+        with netCDF4.Dataset(path) as reader:
+            expected = reader.variables['sc-1'][:]
+            self.convert_iteration(2)
+            ServiceGenerator.merge_netcdf(os.path.join(self.temp_dir, 'sc-*.nc'), path, categorical=True, append=True)
+            self.assertNotIn('sc-2', reader.variables)
+            numpy.testing.assert_array_equal(reader.variables['sc-1'][:], expected)
+
+        with netCDF4.Dataset(path) as dataset:
+            self.assertIn('sc-2', dataset.variables)
+            numpy.testing.assert_array_equal(dataset.variables['sc-1'][:], expected)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+        self.assert_extent(path, 'sc-2')
+
+
+class MergeResultScenarioTestCase(SimpleTestCase):
+    """ Merging the result scenarios of a sharded run copies outputs, and leaves the scenario's inputs alone. """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.temp_dir)
+
+    def create_library(self, name, sid, iterations):
+        path = os.path.join(self.temp_dir, name)
+        with sqlite3.connect(path) as con:
+            con.execute('CREATE TABLE STSim_RunControl (ScenarioID INTEGER, MinimumIteration INTEGER, '
+                        'MaximumIteration INTEGER)')
+            con.execute('CREATE TABLE STSim_OutputOptions (ScenarioID INTEGER, RasterOutputSC INTEGER)')
+            con.execute('CREATE TABLE STSim_OutputStratumState (OutputStratumStateID INTEGER PRIMARY KEY, '
+                        'ScenarioID INTEGER, Iteration INTEGER, Timestep INTEGER, Amount DOUBLE)')
+            con.execute('INSERT INTO STSim_RunControl VALUES (?, ?, ?)', (sid, min(iterations), max(iterations)))
+            con.execute('INSERT INTO STSim_OutputOptions VALUES (?, 1)', (sid,))
+            con.executemany(
+                'INSERT INTO STSim_OutputStratumState (ScenarioID, Iteration, Timestep, Amount) VALUES (?, ?, ?, ?)',
+                [(sid, iteration, timestep, 1.0) for iteration in iterations for timestep in range(3)]
+            )
+        output_directory = os.path.join(path + '.output', 'Scenario-{}'.format(sid), 'Spatial')
+        os.makedirs(output_directory)
+        for iteration in iterations:
+            open(os.path.join(output_directory, 'It{:04d}-Ts0000-sc.tif'.format(iteration)), 'w').close()
+        return path
+
+    def test_merge(self):
+        lib = self.create_library('primary.ssim', 5, (1, 2))
+        source_lib = self.create_library('shard.ssim', 7, (3, 4))
+        merge_result_scenario(lib, 5, source_lib, 7, 1, 4)
+
+        with sqlite3.connect(lib) as con:
+            self.assertEqual(
+                con.execute('SELECT DISTINCT Iteration FROM STSim_OutputStratumState WHERE ScenarioID = 5 '
+                            'ORDER BY Iteration').fetchall(), [(1,), (2,), (3,), (4,)]
+            )
+            self.assertEqual(con.execute('SELECT COUNT(*) FROM STSim_OutputStratumState').fetchone()[0], 12)
+            self.assertEqual(con.execute('SELECT ScenarioID FROM STSim_OutputOptions').fetchall(), [(5,)])
+            self.assertEqual(
+                con.execute('SELECT MinimumIteration, MaximumIteration FROM STSim_RunControl').fetchone(), (1, 4)
+            )
+        with sqlite3.connect(source_lib) as con:
+            self.assertEqual(con.execute('SELECT COUNT(*) FROM STSim_OutputStratumState').fetchone()[0], 0)
+            self.assertEqual(con.execute('SELECT ScenarioID FROM STSim_OutputOptions').fetchall(), [(7,)])
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(lib + '.output', 'Scenario-5', 'Spatial'))),
+            ['It{:04d}-Ts0000-sc.tif'.format(x) for x in (1, 2, 3, 4)]
+        )
+        self.assertFalse(os.path.exists(os.path.join(source_lib + '.output', 'Scenario-7')))
+
+
+class ColumnarReportTestCase(TestCase):
+    """ Reports stored in columnar files must give the same results as report rows stored in the database. """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.temp_dir)
+
+        lib_path = os.path.join(self.temp_dir, 'test.ssim')
+        library = models.Library.objects.create(name='test', file=lib_path, orig_file=lib_path, tmp_file=lib_path)
+        project = models.Project.objects.create(library=library, name='project', pid=1)
+        self.scenario = models.Scenario.objects.create(project=project, name='result', sid=2, is_result=True)
+        self.strata = [
+            models.Stratum.objects.create(project=project, stratum_id=i, name='Stratum {}'.format(i)) for i in (1, 2)
+        ]
+        self.stateclasses = [
+            models.StateClass.objects.create(project=project, stateclass_id=i, name='Class {}'.format(i))
+            for i in (1, 2)
+        ]
+        secondary_stratum = models.SecondaryStratum.objects.create(project=project, secondary_stratum_id=1, name='S1')
+
+        self.report = models.StateClassSummaryReport.objects.create(scenario=self.scenario)
+        self.mapped_rows = []
+        for iteration in (1, 2):
+            for timestep in (0, 1, 2):
+                for i, (stratum, stateclass) in enumerate((
+                        (self.strata[0], self.stateclasses[0]), (self.strata[0], self.stateclasses[1]),
+                        (self.strata[1], self.stateclasses[0]))):
+                    self.mapped_rows.append({
+                        'report': self.report, 'iteration': iteration, 'timestep': timestep, 'stratum': stratum,
+                        'stateclass': stateclass, 'secondary_stratum': secondary_stratum if i == 2 else None,
+                        'amount': 10.0 * iteration + timestep + i / 4, 'age_min': 0, 'age_max': -1,
+                        'proportion_of_landscape': i / 4, 'proportion_of_stratum': i / 2
+                    })
+        for row in self.mapped_rows:
+            models.StateClassSummaryReportRow.objects.create(**row)
+        self.queryset = models.StateClassSummaryReportRow.objects.filter(report=self.report).order_by('pk')
+
+    def serialized_rows(self, queryset):
+        return [dict(x) for x in StateClassSummaryReportRowSerializer(queryset.order_by('pk'), many=True).data]
+
+    def columnar_rows(self, columnar_report):
+        return [{'report': self.report.id, **row} for row in columnar_report.rows()]
+
+    def test_rows_from_database(self):
+        path = report_path(self.scenario, 'stateclass-summary')
+        expected = StateClassSummaryReportSerializer(self.report).data['results']
+        ColumnarReport.from_queryset(models.StateClassSummaryReportRow, self.queryset).save(path)
+
+        results = StateClassSummaryReportSerializer(self.report).data['results']
+        self.assertEqual(
+            sorted([dict(x) for x in expected], key=lambda x: x['id']), sorted(results, key=lambda x: x['id'])
+        )
+
+    def test_rows_from_import(self):
+        """ Imported rows were never stored in the database, so they are numbered in the order they were imported. """
+        path = report_path(self.scenario, 'stateclass-summary')
+        ColumnarReport.from_rows(models.StateClassSummaryReportRow, self.mapped_rows).save(path)
+        rows = self.columnar_rows(ColumnarReport.load(path))
+        expected = self.serialized_rows(self.queryset)
+
+        self.assertEqual([x['id'] for x in rows], list(range(1, len(expected) + 1)))
+        for row, expected_row in zip(rows, expected):
+            row['id'] = expected_row['id']
+        self.assertEqual(rows, expected)
+
+    def test_filter(self):
+        columnar_report = ColumnarReport.from_queryset(models.StateClassSummaryReportRow, self.queryset)
+        for criteria, lookups in (
+                ({'stratum': self.strata[0], 'timestep': [0, 2]}, {'stratum': self.strata[0], 'timestep__in': [0, 2]}),
+                ({'stateclass': self.stateclasses[0].pk, 'iteration': 2},
+                 {'stateclass': self.stateclasses[0], 'iteration': 2}),
+                ({'secondary_stratum': None}, {'secondary_stratum__isnull': True}),
+                ({'timestep': 5}, {'timestep': 5})):
+            with self.subTest(criteria=criteria):
+                self.assertEqual(
+                    self.columnar_rows(columnar_report.filter(**criteria)),
+                    self.serialized_rows(self.queryset.filter(**lookups))
+                )
+
+    def test_aggregate(self):
+        columnar_report = ColumnarReport.from_queryset(models.StateClassSummaryReportRow, self.queryset)
+        self.assertAlmostEqual(
+            columnar_report.aggregate('amount'), self.queryset.aggregate(mean=Avg('amount'))['mean']
+        )
+        self.assertIsNone(columnar_report.filter(timestep=5).aggregate('amount'))
+
+        totals = columnar_report.aggregate('amount', by=('timestep', 'stratum'), func=numpy.sum)
+        expected = {
+            (x['timestep'], x['stratum']): x['total']
+            for x in self.queryset.order_by().values('timestep', 'stratum').annotate(total=Sum('amount'))
+        }
+        self.assertEqual(set(totals), set(expected))
+        for key, value in expected.items():
+            self.assertAlmostEqual(totals[key], value, msg=key)
+
+        for criteria, lookups, by in (
+                ({'stratum': self.strata[0]}, {'stratum': self.strata[0]}, 'iteration'),
+                ({}, {}, 'secondary_stratum')):
+            with self.subTest(by=by):
+                means = columnar_report.filter(**criteria).aggregate('amount', by=(by,))
+                expected = {
+                    x[by]: x['mean']
+                    for x in self.queryset.filter(**lookups).order_by().values(by).annotate(mean=Avg('amount'))
+                }
+                self.assertEqual(set(means), set(expected))
+                for key, value in expected.items():
+                    self.assertAlmostEqual(means[key], value, msg=key)
+
+
+class WorkingLibraryLeaseTestCase(TestCase):
+    """ Leases of working libraries are released when the job holding them is no longer running. """
+
+    def setUp(self):
+        self.library = models.Library.objects.create(name='test', file='test.ssim', orig_file='test_orig.ssim',
+                                                     tmp_file='test_tmp.csv')
+        project = models.Project.objects.create(library=self.library, name='project', pid=1)
+        self.scenario = models.Scenario.objects.create(project=project, name='scenario', sid=1)
+        for index in range(2):
+            models.WorkingLibrary.objects.create(
+                library=self.library, index=index, file='test_work{}.ssim'.format(index)
+            )
+
+    def create_job(self, celery_id):
+        return models.RunScenarioModel.objects.create(parent_scenario=self.scenario, celery_id=celery_id)
+
+    def leased_count(self):
+        return self.library.working_libraries.filter(leased__isnull=False).count()
+
+    def test_release_after_worker_crash(self):
+        running, crashed = self.create_job('running'), self.create_job('crashed')
+        with lease_working_libraries(self.library, 1, running), lease_working_libraries(self.library, 1, crashed):
+            self.assertEqual(release_stale_leases(self.library, ['running']), 1)
+            self.assertEqual(list(self.library.working_libraries.filter(leased__isnull=False)
+                                  .values_list('job__celery_id', flat=True)), ['running'])
+
+    def test_release_after_job_deleted(self):
+        job = self.create_job('deleted')
+        with lease_working_libraries(self.library, 2, job):
+            job.delete()
+            self.assertEqual(self.leased_count(), 2)
+            self.assertFalse(self.library.working_libraries.filter(job__isnull=False).exists())
+            self.assertEqual(release_stale_leases(self.library, ['deleted']), 2)
+            self.assertEqual(self.leased_count(), 0)
+
+            # The pool is usable again
+            with lease_working_libraries(self.library, 2, self.create_job('next'), max_wait=0) as leased:
+                self.assertEqual(len(leased), 2)
+
+
+@skipUnless(os.name == 'posix', 'Model runs are only supervised on posix systems.')
+class RunProgressTestCase(TestCase):
+    """ The progress of a model run is parsed from the output of each shard while it runs, and recorded on the job. """
+
+    def setUp(self):
+        library = models.Library.objects.create(name='test', file='test.ssim', orig_file='test_orig.ssim',
+                                                tmp_file='test_tmp.csv')
+        project = models.Project.objects.create(library=library, name='project', pid=1)
+        scenario = models.Scenario.objects.create(project=project, name='scenario', sid=1)
+        self.job = models.RunScenarioModel.objects.create(parent_scenario=scenario, celery_id='running')
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(rmtree, self.temp_dir)
+
+    def shard(self, first, last, result_sid):
+        """ A shard whose console runs a fake model, reporting iterations first to last. """
+        exe = os.path.join(self.temp_dir, 'run{}.py'.format(result_sid))
+        with open(exe, 'w') as f:
+            f.write(FAKE_RUN.format(first=first, last=last, result_sid=result_sid))
+        with mock.patch('landscapesim.common.consoles.VERIFIED_EXECUTABLES', {exe}):
+            console = AsyncSTSimConsole(exe=exe, lib_path=os.path.join(self.temp_dir, 'test.ssim'))
+        console.prefix = sys.executable
+        run_control = {'MinimumIteration': first, 'MaximumIteration': last, 'MinimumTimestep': 1, 'MaximumTimestep': 10}
+        return SimpleNamespace(console=console, scenario_id=1, iterations=(first, last),
+                               config={'run_control': run_control})
+
+    def test_parse_progress(self):
+        progress = RunProgress([self.shard(1, 4, 7)])
+        self.assertIsNone(progress.fraction)
+        progress.parse(0, 'Iteration 1 complete')
+        self.assertEqual(progress.fraction, 0.25)
+        progress.parse(0, 'Iteration 2 - Timestep 5')
+        self.assertAlmostEqual(progress.fraction, 0.35)
+        progress.parse(0, 'Loading library...')
+        self.assertAlmostEqual(progress.fraction, 0.35)
+
+    def test_progress_recorded_during_run(self):
+        shards = [self.shard(1, 2, 7), self.shard(3, 5, 8)]
+        saved = []
+        save = RunProgress.save
+
+        def record(progress, job):
+            saved.append(progress.fraction)
+            save(progress, job)
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        with mock.patch('landscapesim.async.tasks.JOB_POLL_RATE', 0.1), \
+                mock.patch.object(AsyncSTSimConsole, 'prepare_library'), \
+                mock.patch.object(RunProgress, 'save', autospec=True, side_effect=record):
+            self.assertEqual(loop.run_until_complete(run_shards(shards, self.job)), ['7', '8'])
+
+        # Progress was recorded while the shards were still running, not only once they had exited
+        self.assertTrue(any(0 < x < 1 for x in saved if x is not None))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.run_progress, 1)
+        self.assertEqual(self.job.progress, 1)
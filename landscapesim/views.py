@@ -1,11 +1,14 @@
+import os
+
 from django.http import HttpResponse, JsonResponse
 from rest_framework import viewsets
 from rest_framework.decorators import detail_route
-from rest_framework.exceptions import ParseError
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
 
 from landscapesim import models
+from landscapesim.common.services import ServiceGenerator, read_pixel_history
 from landscapesim.report import Report
 from landscapesim.serializers import projects, reports, scenarios, regions
 
@@ -56,6 +59,29 @@ class ScenarioViewset(viewsets.ReadOnlyModelViewSet):
         context = {'request': self.request}
         return Response(scenarios.ScenarioConfigSerializer(self.get_object(), context=context).data)
 
+    @detail_route(methods=['get'], url_path='pixel-history')
+    def pixel_history(self, *args, **kwargs):
+        """
+        Every iteration and timestep of an output raster at a point, e.g. ?variable=stateclasses&x=<x>&y=<y>, where x
+        and y are in the projection of the output service. An optional size reads a window of cells around the point.
+        """
+        params = self.request.query_params
+        try:
+            variable = params['variable']
+            x, y, size = float(params['x']), float(params['y']), int(params.get('size', 1))
+        except (KeyError, ValueError):
+            raise ParseError('variable, x and y are required, and x, y and size must be numbers.')
+
+        path = ServiceGenerator(self.get_object()).timeseries_store_path(variable.split('-')[0])
+        if not os.path.exists(path):
+            raise NotFound('There are no pixel histories for {} in this scenario.'.format(variable))
+        try:
+            return Response(read_pixel_history(path, variable, x, y, size))
+        except KeyError:
+            raise NotFound('There are no pixel histories for {} in this scenario.'.format(variable))
+        except ValueError as e:
+            raise ParseError(str(e))
+
     def get_queryset(self):
         if not self.request.query_params.get('results_only'):
             return self.queryset
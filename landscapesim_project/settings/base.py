@@ -125,6 +125,7 @@ CELERY_TRACK_STARTED = True
 CELERY_ROUTES = {
     'landscapesim.async.tasks.post_process_results': {'queue': 'periodic-tasks'},
     'landscapesim.async.tasks.look_for_new_scenario': {'queue': 'periodic-tasks'},
+    'landscapesim.async.tasks.update_output_services': {'queue': 'periodic-tasks'},
     'landscapesim.async.tasks.cleanup_temp_files': {'queue': 'periodic-tasks'},
     'landscapesim.async.tasks.run_model': {'queue': 'run-model'}
 }